@@ -0,0 +1,185 @@
+"""ASGI-приложение поверх обычного обработчика Django.
+
+В Django 2.2 нет ни ASGI, ни асинхронных представлений, поэтому
+представления остаются синхронными, а асинхронна только работа с
+клиентом. Цикл событий читает тело запроса и отдаёт ответ, сколько бы
+это ни заняло у медленного клиента. Пул потоков занят лишь на время
+работы самого Django: разбора запроса, обращений к базе и отрисовки.
+
+Лёгкие страницы для чтения (``ASGI_READ_VIEWS``: ленты, профиль, пост)
+выполняются в отдельном пуле на ``ASGI_READ_THREADS`` потоков. У каждого
+потока своё соединение с базой, так что размер пула — это и число
+соединений. Остальные запросы (формы, загрузки картинок, подписки) идут
+в пул на ``ASGI_THREADS`` потоков и не отнимают потоки у лент.
+"""
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import Resolver404, resolve
+
+
+class ASGIHandler:
+    """ASGI 3.0 приложение: ``await application(scope, receive, send)``.
+    """
+
+    def __init__(self, wsgi=None, read_threads=None, threads=None):
+        self.wsgi = wsgi or WSGIHandler()
+        self.read_views = frozenset(getattr(settings, 'ASGI_READ_VIEWS', ()))
+        self.read_executor = ThreadPoolExecutor(
+            max_workers=read_threads or getattr(
+                settings, 'ASGI_READ_THREADS', 8),
+            thread_name_prefix='asgi-read')
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or getattr(settings, 'ASGI_THREADS', 4),
+            thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Тип соединения {scope["type"]} '
+                             'не поддерживается.')
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self.executor_for(scope['path'])
+        try:
+            status, headers, chunks, response = await loop.run_in_executor(
+                executor, self.run, self.environ(scope, body))
+        finally:
+            body.close()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        if response is None:
+            await send({'type': 'http.response.body', 'body': chunks})
+            return
+        # Потоковый ответ (например, файл) читается в пуле кусками.
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, next, chunks,
+                                                   None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            await loop.run_in_executor(executor, response.close)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        self.read_executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
+    def executor_for(self, path):
+        try:
+            view = resolve(path).view_name
+        except Resolver404:
+            return self.executor
+        if view in self.read_views:
+            return self.read_executor
+        return self.executor
+
+    async def read_body(self, receive):
+        """Тело запроса во временном файле; ``None``, если клиент
+        отключился."""
+        body = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE, mode='w+b')
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    @staticmethod
+    def environ(scope, body):
+        """WSGI-окружение для запроса ASGI."""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI передаёт путь байтами, раскрытыми как latin-1.
+            'PATH_INFO': scope['path'].encode().decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = name
+            else:
+                key = f'HTTP_{name}'
+            if key in environ:
+                value = f'{environ[key]},{value}'
+            environ[key] = value
+        if body is not None and 'CONTENT_LENGTH' not in environ:
+            # Тело уже прочитано целиком, и без длины WSGIRequest
+            # посчитал бы его пустым (например, при chunked-передаче).
+            body.seek(0, 2)
+            environ['CONTENT_LENGTH'] = str(body.tell())
+            body.seek(0)
+        return environ
+
+    def run(self, environ):
+        """Выполняется в пуле: обрабатывает запрос и возвращает (статус,
+        заголовки, тело, потоковый ответ или ``None``)."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            # Set-Cookie от WSGIHandler начинается с пробела.
+            started['headers'] = [
+                (name.lower().encode('latin-1'),
+                 value.strip().encode('latin-1'))
+                for name, value in headers]
+
+        response = self.wsgi(environ, start_response)
+        if getattr(response, 'streaming', False):
+            chunks = iter(response)
+            return started['status'], started['headers'], chunks, response
+        try:
+            body = b''.join(response)
+        finally:
+            # Закрытие ответа посылает request_finished и возвращает
+            # соединение с базой — в том же потоке, где оно открыто.
+            response.close()
+        return started['status'], started['headers'], body, None
+
+
+def get_asgi_application():
+    import django
+    django.setup(set_prefix=False)
+    return ASGIHandler()
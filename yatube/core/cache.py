@@ -0,0 +1,302 @@
+"""Двухуровневый кэш: маленький LRU в памяти процесса перед общим кэшем.
+
+Второй уровень — любой кэш из ``settings.CACHES`` (файловый, Redis и
+т. п.), общий для всех воркеров. Первый уровень отвечает на повторные
+чтения без обращения к общему кэшу. Запись и удаление идут в общий кэш и
+попадают в журнал инвалидаций: остальные процессы не реже чем раз в
+``SYNC_INTERVAL`` секунд читают журнал и выбрасывают изменившиеся ключи
+из своего первого уровня. Если запись журнала потерялась, устаревшее
+значение всё равно проживёт в памяти не дольше ``LOCAL_TIMEOUT``.
+
+Номер записи журнала выдаёт ``incr`` общего кэша. У Redis и Memcached он
+атомарный, а у файлового кэша и кэша в базе — чтение и запись, так что
+два процесса могут получить один номер, и одна инвалидация потеряется;
+такие бэкенды годятся только для разработки (см. проверку
+``core.W001`` в ``manage.py check --deploy``).
+
+Ключи из пространств ``SHARED_ONLY`` (по умолчанию ``ratelimit`` — ведра
+``core.ratelimit``, которые меняются на каждый запрос) живут только в
+общем кэше: они не занимают первый уровень и не засоряют журнал.
+"""
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import perf
+
+JOURNAL_SEQ_KEY = 'tiered:journal:seq'
+JOURNAL_KEY = 'tiered:journal:%d'
+
+# Какие события попадают в метрики запроса: промах первого уровня —
+# ещё не промах кэша.
+PERF_EVENTS = {'local_hits': True, 'shared_hits': True,
+               'shared_misses': False}
+
+_MISSING = object()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._local_max_entries = int(
+            options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 5))
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 1))
+        self._journal_timeout = int(options.get('JOURNAL_TIMEOUT', 60))
+        self._shared_only = frozenset(
+            options.get('SHARED_ONLY', ('ratelimit',)))
+        self._local = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = Counter()
+        self._synced_at = 0
+        self._journal_seq = None
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    # Статистика
+
+    @staticmethod
+    def _namespace(key):
+        return str(key).split(':', 1)[0]
+
+    def _is_shared_only(self, key):
+        return self._namespace(key) in self._shared_only
+
+    def _count(self, key, event, amount=1):
+        self._stats[(self._namespace(key), event)] += amount
+        if event in PERF_EVENTS:
+            perf.cache_event(PERF_EVENTS[event])
+
+    def stats(self):
+        """Счётчики попаданий, промахов и вытеснений по пространствам
+        ключей (часть ключа до первого двоеточия)."""
+        with self._lock:
+            result = {'local_entries': len(self._local),
+                      'local_max_entries': self._local_max_entries,
+                      'namespaces': {}}
+            for (namespace, event), value in self._stats.items():
+                result['namespaces'].setdefault(namespace, {})[event] = value
+        return result
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    # Первый уровень
+
+    def _local_get(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            expires, pickled, _ = entry
+            if expires <= time.monotonic():
+                del self._local[local_key]
+                return _MISSING
+            self._local.move_to_end(local_key)
+        return pickle.loads(pickled)
+
+    def _local_set(self, key, local_key, value, timeout):
+        ttl = self._local_timeout
+        if timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            self._local_drop(local_key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + ttl, pickled,
+                                      self._namespace(key))
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                _, (_, _, namespace) = self._local.popitem(last=False)
+                self._stats[(namespace, 'evictions')] += 1
+
+    def _local_drop(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    def _local_key(self, key, version):
+        # Префикс и версия общего кэша применяются в нём самом, здесь
+        # ключ нужен только для словаря первого уровня.
+        return self.make_key(key, version=version)
+
+    # Журнал инвалидаций
+
+    def _publish(self, *local_keys):
+        if not local_keys:
+            return
+        shared = self.shared
+        # Один incr на все ключи: номера seq - n + 1 … seq.
+        try:
+            seq = shared.incr(JOURNAL_SEQ_KEY, len(local_keys))
+        except ValueError:
+            shared.add(JOURNAL_SEQ_KEY, 0, None)
+            seq = shared.incr(JOURNAL_SEQ_KEY, len(local_keys))
+        first = seq - len(local_keys) + 1
+        shared.set_many({JOURNAL_KEY % number: local_key
+                         for number, local_key
+                         in enumerate(local_keys, first)},
+                        self._journal_timeout)
+        # Собственные записи этого процесса уже учтены.
+        if (self._journal_seq is not None
+                and first == self._journal_seq + 1):
+            self._journal_seq = seq
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._synced_at < self._sync_interval:
+            return
+        self._synced_at = now
+        shared = self.shared
+        seq = shared.get(JOURNAL_SEQ_KEY, 0)
+        last = self._journal_seq
+        self._journal_seq = seq
+        if last is None or seq == last:
+            return
+        if seq < last or seq - last > self._local_max_entries:
+            # Общий кэш очищали или изменений больше, чем записей
+            # в памяти: проще начать первый уровень заново.
+            self._local_clear()
+            return
+        wanted = [JOURNAL_KEY % number
+                  for number in range(last + 1, seq + 1)]
+        found = shared.get_many(wanted)
+        if len(found) < len(wanted):
+            self._local_clear()
+            return
+        with self._lock:
+            for local_key in found.values():
+                entry = self._local.pop(local_key, None)
+                if entry is not None:
+                    self._stats[(entry[2], 'invalidations')] += 1
+
+    def _local_clear(self):
+        with self._lock:
+            self._local.clear()
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        if self._is_shared_only(key):
+            return self.shared.get(key, default, version=version)
+        self._sync()
+        local_key = self._local_key(key, version)
+        value = self._local_get(local_key)
+        if value is not _MISSING:
+            self._count(key, 'local_hits')
+            return value
+        self._count(key, 'local_misses')
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._count(key, 'shared_misses')
+            return default
+        self._count(key, 'shared_hits')
+        self._local_set(key, local_key, value, self._local_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        result = {}
+        remote = []
+        for key in keys:
+            if self._is_shared_only(key):
+                remote.append(key)
+                continue
+            value = self._local_get(self._local_key(key, version))
+            if value is _MISSING:
+                self._count(key, 'local_misses')
+                remote.append(key)
+            else:
+                self._count(key, 'local_hits')
+                result[key] = value
+        if remote:
+            found = self.shared.get_many(remote, version=version)
+            for key in remote:
+                if self._is_shared_only(key):
+                    continue
+                if key in found:
+                    self._count(key, 'shared_hits')
+                    self._local_set(key, self._local_key(key, version),
+                                    found[key], self._local_timeout)
+                else:
+                    self._count(key, 'shared_misses')
+            result.update(found)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        self.shared.set(key, value, timeout, version=version)
+        if self._is_shared_only(key):
+            return
+        local_key = self._local_key(key, version)
+        self._local_set(key, local_key, value, timeout)
+        self._publish(local_key)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        failed = self.shared.set_many(data, timeout, version=version)
+        local_keys = []
+        for key, value in data.items():
+            if self._is_shared_only(key):
+                continue
+            local_key = self._local_key(key, version)
+            self._local_set(key, local_key, value, timeout)
+            local_keys.append(local_key)
+        self._publish(*local_keys)
+        return failed or []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and not self._is_shared_only(key):
+            local_key = self._local_key(key, version)
+            self._local_set(key, local_key, value, timeout)
+            self._publish(local_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, self.get_backend_timeout(timeout),
+                                 version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self.delete_local(key, version)
+        return value
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version=version)
+        self.delete_local(key, version)
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version=version)
+        for key in keys:
+            self.delete_local(key, version)
+
+    def delete_local(self, key, version=None):
+        if self._is_shared_only(key):
+            return
+        local_key = self._local_key(key, version)
+        self._local_drop(local_key)
+        self._publish(local_key)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self.shared.clear()
+        self._local_clear()
+        self._journal_seq = None
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return timeout
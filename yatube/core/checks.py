@@ -0,0 +1,67 @@
+"""Проверки настроек: окружения — при каждом запуске, развёртывания —
+в ``manage.py check --deploy``.
+
+gunicorn и uvicorn системные проверки не запускают, поэтому версию
+SQLite ещё раз проверяет ``CoreConfig.ready()`` через
+``require_sqlite_version``."""
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+# INSERT/DELETE … RETURNING (posts.follow_graph, posts.recommendations).
+SQLITE_MIN_VERSION = (3, 35)
+
+# Бэкенды, у которых incr — это чтение и запись, а не одна операция.
+NON_ATOMIC_INCR = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.db.DatabaseCache',
+)
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_tiered_caches(app_configs, **kwargs):
+    """Журнал инвалидаций ``core.cache.TieredCache`` требует атомарного
+    incr от общего кэша."""
+    errors = []
+    for alias, config in settings.CACHES.items():
+        if config['BACKEND'] != 'core.cache.TieredCache':
+            continue
+        shared = config.get('OPTIONS', {}).get('SHARED', 'shared')
+        backend = settings.CACHES.get(shared, {}).get('BACKEND')
+        if backend in NON_ATOMIC_INCR:
+            errors.append(checks.Warning(
+                f'Общий кэш {shared!r} кэша {alias!r} не умеет атомарный '
+                f'incr: воркеры будут терять инвалидации.',
+                hint='Используйте Redis или Memcached; файловый кэш и '
+                     'кэш в базе годятся только для разработки.',
+                id='core.W001'))
+    return errors
+
+
+@checks.register()
+def check_sqlite_version(app_configs, **kwargs):
+    """Подписки и очередь рекомендаций пишутся запросами с RETURNING."""
+    errors = []
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        version = connection.Database.sqlite_version_info
+        if version < SQLITE_MIN_VERSION:
+            errors.append(checks.Error(
+                f'База {alias!r}: SQLite '
+                f'{".".join(map(str, version))} не поддерживает '
+                f'RETURNING.',
+                hint=f'Нужен SQLite '
+                     f'{".".join(map(str, SQLITE_MIN_VERSION))} или новее.',
+                id='core.E001'))
+    return errors
+
+
+def require_sqlite_version():
+    """Не даёт запуститься процессу со слишком старым SQLite."""
+    errors = check_sqlite_version(None)
+    if errors:
+        raise ImproperlyConfigured(
+            f'{errors[0].id}: {errors[0].msg} {errors[0].hint}')
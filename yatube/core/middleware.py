@@ -0,0 +1,74 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import perf, queries, routers
+
+logger = logging.getLogger('core.queries')
+
+
+class PerformanceMiddleware:
+    """Собирает ``perf.RequestMetrics`` для каждого запроса, добавляет их
+    в ``perf.registry`` и в заголовок ``Server-Timing``.
+
+    В режиме ``PERF_QUERY_INSPECTION`` ещё и пишет в лог N+1, медленные
+    запросы и превышение бюджета страницы (см. ``core.queries``).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = perf.RequestMetrics()
+        log = queries.QueryLog() if queries.inspection_enabled() else None
+        perf.activate(metrics)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    connection = connections[alias]
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                    if log is not None:
+                        stack.enter_context(connection.execute_wrapper(log))
+                response = self.get_response(request)
+        finally:
+            perf.deactivate()
+        metrics.finish()
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        perf.registry.record(view, metrics, response.status_code)
+        if getattr(settings, 'PERF_SERVER_TIMING', True):
+            response['Server-Timing'] = metrics.server_timing()
+        if log is not None:
+            for problem in log.problems(view):
+                logger.warning('%s %s', request.path, problem)
+        return response
+
+
+class ReplicaMiddleware:
+    """Включает чтение с реплики для страниц из
+    ``DATABASE_REPLICA_VIEWS`` и закрепляет клиента за основной базой
+    после записи (см. ``core.routers``)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.reset()
+        try:
+            response = self.get_response(request)
+            if routers.pinned():
+                response.set_cookie(
+                    settings.DATABASE_PIN_COOKIE, '1',
+                    max_age=settings.DATABASE_PIN_SECONDS, httponly=True)
+        finally:
+            routers.reset()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in ('GET', 'HEAD')
+                and settings.DATABASE_PIN_COOKIE not in request.COOKIES
+                and request.resolver_match.view_name
+                in settings.DATABASE_REPLICA_VIEWS):
+            routers.use_replica(routers.choose_replica())
@@ -0,0 +1,243 @@
+"""Метрики производительности запросов.
+
+``PerformanceMiddleware`` заводит на каждый запрос ``RequestMetrics``:
+время ответа, время и число SQL-запросов (через
+``connection.execute_wrapper``), повторы одинаковых запросов, время
+отрисовки шаблонов (через бэкенд ``core.template_backend``) и попадания
+в кэш (их сообщает ``core.cache.TieredCache``). Итоги складываются в
+скользящие гистограммы процесса: окна по ``PERF_WINDOW_SECONDS`` секунд,
+хранятся последние ``PERF_WINDOWS`` окон.
+
+Все измерения — это ``perf_counter`` и пара сложений, так что
+инструментирование можно не выключать в продакшене.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from django.conf import settings
+
+# Верхние границы корзин гистограмм, мс; последняя корзина — всё, что
+# больше.
+BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+TIMINGS = ('total', 'db', 'template')
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """Метрики одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.db = 0.0
+        self.template = 0.0
+        self.queries = 0
+        self.duplicates = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._seen = set()
+        self._template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обёртка для ``connection.execute_wrapper``."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+            key = (sql, repr(params))
+            if key in self._seen:
+                self.duplicates += 1
+            else:
+                self._seen.add(key)
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Значение заголовка ``Server-Timing``."""
+        return ', '.join([
+            f'total;dur={self.total * 1000:.1f}',
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries, '
+            f'{self.duplicates} duplicates"',
+            f'tpl;dur={self.template * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, '
+            f'{self.cache_misses} misses"',
+        ])
+
+
+def current():
+    """Метрики текущего запроса или ``None`` вне запроса."""
+    return getattr(_local, 'metrics', None)
+
+
+def activate(metrics):
+    _local.metrics = metrics
+
+
+def deactivate():
+    _local.metrics = None
+
+
+class template_timer:
+    """Считает время отрисовки шаблона; вложенные шаблоны (например,
+    карточки постов внутри страницы) не учитываются дважды."""
+
+    def __enter__(self):
+        self.metrics = current()
+        if self.metrics is not None:
+            self.metrics._template_depth += 1
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics._template_depth -= 1
+            if not self.metrics._template_depth:
+                self.metrics.template += time.perf_counter() - self.started
+
+
+def cache_event(hit):
+    metrics = current()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value_ms):
+        self.counts[bisect_left(BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, percent):
+        """Верхняя граница корзины, в которую попал перцентиль;
+        ``None`` для последней, открытой корзины."""
+        if not self.count:
+            return None
+        wanted = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                break
+        return BOUNDS_MS[index] if index < len(BOUNDS_MS) else None
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.sum / self.count, 2) if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'buckets': dict(zip(
+                [str(bound) for bound in BOUNDS_MS] + ['inf'],
+                self.counts)),
+        }
+
+
+class ViewStats:
+    def __init__(self):
+        self.timings = {name: Histogram() for name in TIMINGS}
+        self.requests = 0
+        self.errors = 0
+        self.queries = 0
+        self.duplicates = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, metrics, status):
+        for name in TIMINGS:
+            self.timings[name].add(getattr(metrics, name) * 1000)
+        self.requests += 1
+        self.errors += status >= 500
+        self.queries += metrics.queries
+        self.duplicates += metrics.duplicates
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+
+    def merge(self, other):
+        for name in TIMINGS:
+            self.timings[name].merge(other.timings[name])
+        for name in ('requests', 'errors', 'queries', 'duplicates',
+                     'cache_hits', 'cache_misses'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'queries_avg': round(self.queries / requests, 2),
+            'duplicates_avg': round(self.duplicates / requests, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            **{name: histogram.as_dict()
+               for name, histogram in self.timings.items()},
+        }
+
+
+class Registry:
+    """Скользящие гистограммы по представлениям в памяти процесса."""
+
+    def __init__(self, window_seconds=None, windows=None):
+        self.window_seconds = window_seconds or getattr(
+            settings, 'PERF_WINDOW_SECONDS', 60)
+        self.windows = deque(maxlen=windows or getattr(
+            settings, 'PERF_WINDOWS', 15))
+        self._lock = threading.Lock()
+
+    def _window(self, now):
+        start = now - now % self.window_seconds
+        if not self.windows or self.windows[-1][0] != start:
+            self.windows.append((start, {}))
+        return self.windows[-1][1]
+
+    def record(self, view, metrics, status):
+        with self._lock:
+            views = self._window(time.time())
+            stats = views.get(view)
+            if stats is None:
+                stats = views[view] = ViewStats()
+            stats.add(metrics, status)
+
+    def snapshot(self):
+        now = time.time()
+        oldest = now - self.window_seconds * self.windows.maxlen
+        merged = {}
+        with self._lock:
+            windows = [views for start, views in self.windows
+                       if start > oldest]
+            for views in windows:
+                for view, stats in views.items():
+                    merged.setdefault(view, ViewStats()).merge(stats)
+        return {
+            'window_seconds': self.window_seconds * len(windows),
+            'views': {view: stats.as_dict()
+                      for view, stats in sorted(merged.items())},
+        }
+
+    def reset(self):
+        with self._lock:
+            self.windows.clear()
+
+
+registry = Registry()
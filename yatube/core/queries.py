@@ -0,0 +1,165 @@
+"""Разбор SQL-запросов одного HTTP-запроса: N+1 и медленные запросы.
+
+Запросы группируются по «отпечатку» — тексту SQL без литералов и с
+одинаково записанными списками ``IN (...)``. Если запрос с одним и тем же
+отпечатком повторился ``PERF_NPLUSONE_THRESHOLD`` раз и больше, скорее
+всего, это N+1: например, шаблон в цикле обращается к ``post.author``
+без ``select_related``. Для каждого запроса запоминается, откуда он
+пришёл: строка шаблона, если запрос выполнен при отрисовке, или
+ближайший кадр кода проекта.
+
+Обход стека дорог, поэтому в middleware разбор включается только при
+``DEBUG`` (или явно через ``PERF_QUERY_INSPECTION``), а тесты вызывают
+``capture()`` сами.
+Бюджеты числа запросов для страниц задаются в ``PERF_QUERY_BUDGETS``;
+тесты ``posts/test/test_query_budgets.py`` падают при их превышении, а
+``posts/test/test_queries.py`` — при N+1. Медленные запросы тесты не
+проверяют: время зависит от машины.
+"""
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+Query = namedtuple('Query', 'sql fingerprint duration origin')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:[^()]*)\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+_RENDER_CODE = Node.render_annotated.__code__
+_SKIP_FILES = (os.path.abspath(__file__),
+               os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'perf.py'))
+
+
+def inspection_enabled():
+    enabled = getattr(settings, 'PERF_QUERY_INSPECTION', None)
+    return settings.DEBUG if enabled is None else enabled
+
+
+def nplusone_threshold():
+    return getattr(settings, 'PERF_NPLUSONE_THRESHOLD', 3)
+
+
+def slow_query_ms():
+    return getattr(settings, 'PERF_SLOW_QUERY_MS', 100)
+
+
+def budget(view):
+    """Допустимое число запросов страницы или ``None``, если бюджета
+    нет."""
+    return getattr(settings, 'PERF_QUERY_BUDGETS', {}).get(view)
+
+
+def fingerprint(sql):
+    """Текст запроса без значений: структурно одинаковые запросы дают
+    один отпечаток."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _project_frame(frame):
+    filename = os.path.abspath(frame.f_code.co_filename)
+    return (filename.startswith(settings.BASE_DIR)
+            and filename not in _SKIP_FILES
+            and 'site-packages' not in filename)
+
+
+def origin(frame=None):
+    """Откуда выполнен запрос: ``шаблон:строка`` для запросов во время
+    отрисовки, иначе ``файл:строка в функции`` ближайшего кадра проекта.
+    """
+    frame = frame or sys._getframe(1)
+    project = None
+    while frame is not None:
+        if frame.f_code is _RENDER_CODE:
+            node = frame.f_locals.get('self')
+            token = getattr(node, 'token', None)
+            template = getattr(getattr(node, 'origin', None),
+                               'template_name', None)
+            if token is not None and template:
+                place = f'{template}:{token.lineno}'
+                # Запрос из тега или метода модели: полезны оба места.
+                return f'{place} ({project})' if project else place
+        elif project is None and _project_frame(frame):
+            filename = os.path.relpath(frame.f_code.co_filename,
+                                       settings.BASE_DIR)
+            project = (f'{filename}:{frame.f_lineno} '
+                       f'in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return project or 'unknown'
+
+
+class QueryLog:
+    """Все запросы одного HTTP-запроса с отпечатками и источниками."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    def add(self, sql, duration):
+        self.queries.append(Query(sql, fingerprint(sql), duration,
+                                  origin(sys._getframe(1))))
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обёртка для ``connection.execute_wrapper``."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(sql, time.perf_counter() - started)
+
+    def repeated(self, threshold=None):
+        """Группы структурно одинаковых запросов, повторившихся не менее
+        ``threshold`` раз: [(отпечаток, [Query, ...]), ...]."""
+        threshold = threshold or nplusone_threshold()
+        groups = {}
+        for query in self.queries:
+            groups.setdefault(query.fingerprint, []).append(query)
+        return [(key, queries) for key, queries in groups.items()
+                if len(queries) >= threshold]
+
+    def slow(self, threshold_ms=None):
+        threshold_ms = threshold_ms or slow_query_ms()
+        return [query for query in self.queries
+                if query.duration * 1000 >= threshold_ms]
+
+    def problems(self, view=None, nplusone=True, slow=True):
+        """Описания найденных проблем; пустой список, если их нет.
+        ``nplusone`` и ``slow`` включают поиск N+1 и медленных запросов."""
+        result = []
+        limit = budget(view) if view else None
+        if limit is not None and len(self) > limit:
+            result.append(f'{view}: {len(self)} запросов при бюджете '
+                          f'{limit}')
+        for key, queries in self.repeated() if nplusone else ():
+            origins = sorted({query.origin for query in queries})
+            result.append(f'N+1: {len(queries)} раз {key} '
+                          f'из {", ".join(origins)}')
+        for query in self.slow() if slow else ():
+            result.append(f'Медленный запрос {query.duration * 1000:.0f} '
+                          f'мс: {query.fingerprint} из {query.origin}')
+        return result
+
+
+@contextmanager
+def capture():
+    """Записывает запросы всех соединений в ``QueryLog``; работает и без
+    ``DEBUG``."""
+    log = QueryLog()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(log))
+        yield log
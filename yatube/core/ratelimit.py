@@ -0,0 +1,41 @@
+"""Ограничение частоты действий пользователя «ведром токенов» в кэше.
+
+В ведре помещается ``burst`` токенов, за секунду добавляется ``rate``
+токенов, каждое действие забирает один. Состояние ведра — пара (токены,
+время) под одним ключом кэша: проверка стоит одного чтения и одной
+записи. Полное ведро не хранится: ключ истекает, когда ведро успело бы
+наполниться, и отсутствие ключа значит «токенов сколько угодно до
+``burst``».
+
+Чтение и запись не атомарны, поэтому одновременные запросы одного
+пользователя из разных процессов изредка пропускают лишнее действие.
+Для защиты от всплесков этого достаточно.
+"""
+import math
+import time
+
+from django.core.cache import cache
+
+BUCKET_KEY = 'ratelimit:%s'
+
+
+def _tokens(key, rate, burst, now):
+    tokens, updated = cache.get(key) or (burst, now)
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def allow(name, rate, burst):
+    """Забирает токен из ведра ``name``; False — токенов нет."""
+    key = BUCKET_KEY % name
+    now = time.time()
+    tokens = _tokens(key, rate, burst, now)
+    if tokens < 1:
+        return False
+    cache.set(key, (tokens - 1, now), math.ceil(burst / rate))
+    return True
+
+
+def retry_after(name, rate, burst):
+    """Через сколько секунд в ведре ``name`` появится токен."""
+    tokens = _tokens(BUCKET_KEY % name, rate, burst, time.time())
+    return max(0, math.ceil((1 - tokens) / rate))
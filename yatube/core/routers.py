@@ -0,0 +1,111 @@
+"""Чтение с реплик и запись в основную базу.
+
+``ReplicaRouter`` отправляет все записи в ``default``. Чтения идут на
+реплику из ``DATABASE_REPLICAS`` только внутри страниц из
+``DATABASE_REPLICA_VIEWS`` (ленты, профиль, пост) — это отмечает
+``core.middleware.ReplicaMiddleware``. Команды, формы, подписки и всё
+остальное читают из основной базы.
+
+Реплики отстают от основной базы, поэтому действует правило «читай
+свои записи»:
+
+* после первой записи в запросе его чтения тоже идут в основную базу;
+* ответ на запрос с записью видимых пользователю данных ставит клиенту
+  cookie ``DATABASE_PIN_COOKIE`` на ``DATABASE_PIN_SECONDS`` секунд, и
+  до её истечения этот клиент читает только из основной базы.
+
+Служебные записи — сессии (``DATABASE_PRIMARY_APPS``) и модели из
+``DATABASE_UNPINNED_MODELS``, скажем, ленты, которые дописывает само
+чтение страницы, — клиента не закрепляют: иначе обычный просмотр
+навсегда уводил бы его с реплик.
+
+Реплика выбирается один раз на запрос, так что страница видит
+согласованный снимок одной базы. Приложения из ``DATABASE_PRIMARY_APPS``
+(сессии) всегда читаются из основной базы.
+"""
+import random
+import threading
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def reset():
+    """Чтения и записи текущего потока снова идут в основную базу."""
+    _state.replica = None
+    _state.wrote = False
+    _state.pinned = False
+
+
+def use_replica(alias):
+    """Дальнейшие чтения запроса (до первой записи) идут в ``alias``."""
+    _state.replica = alias
+
+
+def choose_replica():
+    aliases = replicas()
+    return random.choice(aliases) if aliases else None
+
+
+def reading_replica():
+    """Читает ли текущий запрос с реплики."""
+    return getattr(_state, 'replica', None) is not None and not wrote()
+
+
+def wrote():
+    """Была ли запись в основную базу в текущем запросе."""
+    return getattr(_state, 'wrote', False)
+
+
+def pinned():
+    """Нужно ли закрепить клиента за основной базой после запроса."""
+    return getattr(_state, 'pinned', False)
+
+
+def mark_written():
+    """Отмечает запись, которую роутер не видел: сырой SQL или запись
+    из фонового потока по просьбе запроса."""
+    _state.wrote = True
+    _state.pinned = True
+
+
+def _pins(model):
+    options = model._meta
+    return (options.app_label not in getattr(
+                settings, 'DATABASE_PRIMARY_APPS', ())
+            and options.label_lower not in getattr(
+                settings, 'DATABASE_UNPINNED_MODELS', ()))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if (replica is None or wrote()
+                or model._meta.app_label in getattr(
+                    settings, 'DATABASE_PRIMARY_APPS', ())):
+            return PRIMARY
+        return replica
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        if _pins(model):
+            _state.pinned = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы, объекты из них можно связывать.
+        aliases = {PRIMARY, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схема реплик приходит вместе с данными основной базы.
+        return db == PRIMARY
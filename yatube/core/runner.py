@@ -0,0 +1,34 @@
+"""Запуск тестов с кэшем в памяти.
+
+Общий уровень ``core.cache.TieredCache`` по умолчанию файловый и лежит
+в каталоге проекта. Тесты получают вместо него locmem: они не пишут
+файлы, ``cache.clear()`` в тестах не стирает рабочий кэш разработчика,
+а прогоны и параллельные процессы не видят состояние друг друга.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'SHARED_ONLY': ['ratelimit'],
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    },
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=TEST_CACHES)
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,46 @@
+"""Настройка соединений SQLite для работы под нагрузкой.
+
+При открытии каждого соединения выполняются ``PRAGMA`` из
+``SQLITE_PRAGMAS`` (или из ключа ``PRAGMAS`` настроек конкретной базы):
+
+* ``journal_mode=wal`` — читатели не ждут писателя и наоборот, запись
+  не блокирует ленты;
+* ``synchronous=normal`` — в режиме WAL fsync нужен только при
+  контрольной точке, данные при этом не портятся, а последние
+  транзакции теряются лишь при отключении питания;
+* ``busy_timeout`` — сколько миллисекунд ждать блокировку, прежде чем
+  вернуть «database is locked»;
+* ``mmap_size`` и ``cache_size`` — чтение страниц через отображение
+  файла в память и кэш страниц соединения (отрицательное значение —
+  в КиБ);
+* ``temp_store=memory`` — временные B-деревья сортировок в памяти.
+
+Порядок важен: ``journal_mode`` меняется первым.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragmas_for(connection):
+    return connection.settings_dict.get(
+        'PRAGMAS', getattr(settings, 'SQLITE_PRAGMAS', {}))
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas_for(connection).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def current_pragmas(connection, names):
+    """Действующие значения ``PRAGMA`` соединения."""
+    result = {}
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'PRAGMA {name}')
+            result[name] = cursor.fetchone()[0]
+    return result
@@ -1,4 +1,36 @@
-from django.test import TestCase
+import asyncio
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from posts.models import Comment, Post, TimelineEntry
+
+from . import checks, perf, routers, sqlite
+from .asgi import ASGIHandler
+from .cache import JOURNAL_SEQ_KEY, TieredCache
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'OPTIONS': {'SHARED': 'shared'},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-cache-tests',
+    },
+}
 
 
 class ViewTestClass(TestCase):
@@ -6,3 +38,429 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'core/404.html')
+
+    def test_cache_stats_only_for_staff(self):
+        url = reverse('core:cache_stats')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        admin = get_user_model().objects.create_user(
+            username='admin', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('default', response.json())
+
+
+class TestRunnerTests(TestCase):
+    def test_tests_do_not_touch_project_cache(self):
+        self.assertIsInstance(caches['shared'], LocMemCache)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TieredCacheTests(TestCase):
+    def worker(self, **options):
+        """Отдельный экземпляр кэша, как в другом воркере."""
+        options = {'SHARED': 'shared', 'SYNC_INTERVAL': 0, **options}
+        return TieredCache('', {'OPTIONS': options})
+
+    def setUp(self):
+        self.worker().clear()
+
+    def test_local_tier_answers_repeated_reads(self):
+        cache = self.worker()
+        cache.set('post_card:1', 'html')
+        cache.reset_stats()
+        self.assertEqual(cache.get('post_card:1'), 'html')
+        self.assertEqual(cache.get('post_card:2', 'нет'), 'нет')
+        stats = cache.stats()['namespaces']['post_card']
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['local_misses'], 1)
+        self.assertEqual(stats['shared_misses'], 1)
+
+    def test_invalidation_reaches_other_workers(self):
+        first, second = self.worker(), self.worker()
+        first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        first.set('key', 2)
+        self.assertEqual(second.get('key'), 2)
+        first.delete('key')
+        self.assertIsNone(second.get('key'))
+        stats = second.stats()['namespaces']['key']
+        self.assertEqual(stats['invalidations'], 2)
+
+    def test_local_tier_is_bounded(self):
+        cache = self.worker(LOCAL_MAX_ENTRIES=2)
+        for number in range(3):
+            cache.set(f'version:{number}', number)
+        stats = cache.stats()
+        self.assertEqual(stats['local_entries'], 2)
+        self.assertEqual(stats['namespaces']['version']['evictions'], 1)
+        # Вытесненное значение по-прежнему есть в общем кэше.
+        self.assertEqual(cache.get('version:0'), 0)
+
+    def test_get_many_and_incr(self):
+        cache = self.worker()
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.assertEqual(cache.incr('a'), 2)
+        self.assertEqual(self.worker().get('a'), 2)
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_set_many_takes_one_journal_range(self):
+        first, second = self.worker(), self.worker()
+        first.set_many({'a': 1, 'b': 2})
+        self.assertEqual(second.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        seq = first.shared.get(JOURNAL_SEQ_KEY)
+        first.set_many({'a': 3, 'b': 4, 'c': 5})
+        self.assertEqual(first.shared.get(JOURNAL_SEQ_KEY), seq + 3)
+        self.assertEqual(second.get_many(['a', 'b']), {'a': 3, 'b': 4})
+
+    def test_shared_only_keys_skip_local_tier_and_journal(self):
+        first, second = self.worker(), self.worker()
+        first.set('key', 0)
+        first.set('ratelimit:1', 1)
+        seq = first.shared.get(JOURNAL_SEQ_KEY)
+        second.set('ratelimit:1', 2)
+        second.delete('ratelimit:2')
+        self.assertEqual(first.get('ratelimit:1'), 2)
+        self.assertEqual(first.get_many(['ratelimit:1']), {'ratelimit:1': 2})
+        self.assertEqual(first.shared.get(JOURNAL_SEQ_KEY), seq)
+        self.assertEqual(first.stats()['local_entries'], 1)
+
+    def test_check_needs_sqlite_with_returning(self):
+        self.assertEqual(checks.check_sqlite_version(None), [])
+        with mock.patch.object(connection.Database, 'sqlite_version_info',
+                               (3, 31, 1)):
+            errors = checks.check_sqlite_version(None)
+        self.assertEqual({error.id for error in errors}, {'core.E001'})
+        self.assertIn('3.31.1', errors[0].msg)
+
+    def test_old_sqlite_stops_startup(self):
+        # Серверы приложений системные проверки не запускают.
+        checks.require_sqlite_version()
+        with mock.patch.object(connection.Database, 'sqlite_version_info',
+                               (3, 31, 1)), \
+                self.assertRaisesMessage(ImproperlyConfigured, 'core.E001'):
+            apps.get_app_config('core').ready()
+
+    def test_deploy_check_needs_atomic_incr(self):
+        self.assertEqual(checks.check_tiered_caches(None), [])
+        caches = {**LOCMEM_CACHES, 'shared': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': settings.BASE_DIR}}
+        with self.settings(CACHES=caches):
+            self.assertEqual(
+                [error.id for error in checks.check_tiered_caches(None)],
+                ['core.W001'])
+
+
+class PerformanceTests(TestCase):
+    def setUp(self):
+        perf.registry.reset()
+        # Страница из кэша не делает запросов и не рисует шаблон.
+        cache.clear()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'tpl;dur=', 'cache;desc='):
+            self.assertIn(metric, timing)
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_server_timing_can_be_disabled(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_registry_aggregates_per_view(self):
+        for _ in range(2):
+            self.client.get(reverse('posts:index'))
+        self.client.get('/nonexist-page/')
+        views = perf.registry.snapshot()['views']
+        index = views['posts:index']
+        self.assertEqual(index['requests'], 2)
+        self.assertGreater(index['queries_avg'], 0)
+        self.assertEqual(index['total']['count'], 2)
+        self.assertGreater(index['template']['avg_ms'], 0)
+        self.assertIn('unresolved', views)
+
+    def test_duplicate_queries_counted(self):
+        metrics = perf.RequestMetrics()
+
+        def execute(sql, params, many, context):
+            return None
+
+        for params in ([1], [2], [1]):
+            metrics(execute, 'SELECT %s', params, False, {})
+        self.assertEqual(metrics.queries, 3)
+        self.assertEqual(metrics.duplicates, 1)
+
+    def test_histogram_percentiles(self):
+        histogram = perf.Histogram()
+        for value in [0.5] * 90 + [30] * 9 + [10000]:
+            histogram.add(value)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(95), 50)
+        self.assertIsNone(histogram.percentile(100))
+
+    def test_old_windows_expire(self):
+        registry = perf.Registry(window_seconds=60, windows=2)
+        metrics = perf.RequestMetrics()
+        metrics.finish()
+        with mock.patch('core.perf.time.time', return_value=0):
+            registry.record('view', metrics, 200)
+        with mock.patch('core.perf.time.time', return_value=150):
+            registry.record('view', metrics, 500)
+            snapshot = registry.snapshot()
+        self.assertEqual(snapshot['views']['view']['requests'], 1)
+        self.assertEqual(snapshot['views']['view']['errors'], 1)
+
+    def test_stats_only_for_staff(self):
+        url = reverse('core:performance_stats')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        admin = get_user_model().objects.create_user(
+            username='admin', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('views', response.json())
+
+
+    @override_settings(PERF_QUERY_INSPECTION=True,
+                       PERF_QUERY_BUDGETS={'posts:index': 0})
+    def test_inspection_logs_problems(self):
+        with self.assertLogs('core.queries', 'WARNING') as logs:
+            self.client.get(reverse('posts:index'))
+        self.assertIn('при бюджете 0', logs.output[0])
+
+    def test_inspection_off_without_debug(self):
+        with mock.patch('core.queries.QueryLog') as query_log:
+            self.client.get(reverse('posts:index'))
+        query_log.assert_not_called()
+
+
+class ASGIHandlerTests(TransactionTestCase):
+    """Запросы выполняются в потоках пула со своими соединениями, поэтому
+    данные должны быть закоммичены."""
+
+    def setUp(self):
+        self.application = ASGIHandler(read_threads=2, threads=1)
+        self.addCleanup(self.application.shutdown)
+
+    def request(self, path, method='GET', query=b'', headers=(),
+                body=b''):
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'query_string': query,
+            'root_path': '', 'server': ('localhost', 80),
+            'client': ('127.0.0.1', 5000),
+            'headers': [(b'host', b'localhost'), *headers],
+        }
+        # Тело приходит двумя кусками, как от медленного клиента.
+        incoming = [
+            {'type': 'http.request', 'body': body[:1], 'more_body': True},
+            {'type': 'http.request', 'body': body[1:]},
+        ]
+        sent = []
+
+        async def receive():
+            return incoming.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        return sent
+
+    def test_read_view(self):
+        get_user_model().objects.create_user(username='author')
+        start, body = self.request('/profile/author/')
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/html; charset=utf-8'),
+                      start['headers'])
+        self.assertIn('author'.encode(), body['body'])
+
+    def test_views_routed_to_pools(self):
+        self.assertIs(self.application.executor_for('/'),
+                      self.application.read_executor)
+        self.assertIs(self.application.executor_for('/create/'),
+                      self.application.executor)
+        self.assertIs(self.application.executor_for('/nonexist-page/'),
+                      self.application.executor)
+
+    def test_environ(self):
+        environ = ASGIHandler.environ({
+            'method': 'POST', 'path': '/группа/', 'query_string': b'q=1',
+            'headers': [(b'content-type', b'text/plain'),
+                        (b'x-forwarded-for', b'10.0.0.1')],
+        }, None)
+        self.assertEqual(environ['PATH_INFO'],
+                         '/группа/'.encode().decode('latin-1'))
+        self.assertEqual(environ['QUERY_STRING'], 'q=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_X_FORWARDED_FOR'], '10.0.0.1')
+
+    def test_post_body_reaches_view(self):
+        user = get_user_model().objects.create_user(username='writer')
+        user.set_password('secret-password')
+        user.save()
+        token = 'a' * 64
+        start, _ = self.request(
+            '/auth/login/', method='POST',
+            headers=[(b'content-type',
+                      b'application/x-www-form-urlencoded'),
+                     (b'cookie', f'csrftoken={token}'.encode())],
+            body=f'username=writer&password=secret-password'
+                 f'&csrfmiddlewaretoken={token}'.encode())
+        self.assertEqual(start['status'], 302)
+        self.assertTrue(any(value.startswith(b'sessionid=')
+                            for name, value in start['headers']
+                            if name == b'set-cookie'))
+
+    def test_disconnect_before_body(self):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.application(
+            {'type': 'http', 'method': 'GET', 'path': '/'}, receive, send))
+        self.assertEqual(sent, [])
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.application({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
+
+
+REPLICA = 'replica_test'
+
+
+# Кэш страниц отдал бы свежую страницу и без чтения с реплики.
+@override_settings(DATABASE_REPLICAS=[REPLICA], PAGE_CACHE_TIMEOUT=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Реплика — отдельный файл SQLite, который обновляется только
+    командой sync_replicas, поэтому её отставание видно явно."""
+
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        connections.databases[REPLICA] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f'{cls.directory}/replica.sqlite3',
+        }
+        connections.ensure_defaults(REPLICA)
+        connections.prepare_test_settings(REPLICA)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections.databases[REPLICA]
+        delattr(connections._connections, REPLICA)
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.author = get_user_model().objects.create_user(username='author')
+        self.post = Post.objects.create(author=self.author, text='Старый')
+        self.sync()
+        self.client.force_login(self.author)
+
+    def sync(self):
+        call_command('sync_replicas', stdout=StringIO())
+
+    def detail(self):
+        return reverse('posts:post_detail', args=[self.post.pk])
+
+    def test_read_views_use_replica(self):
+        post = Post.objects.create(author=self.author, text='Новый')
+        url = reverse('posts:post_detail', args=[post.pk])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.sync()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_other_views_use_primary(self):
+        post = Post.objects.create(author=self.author, text='Новый')
+        response = self.client.get(reverse('posts:post_edit',
+                                           args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_writer_reads_own_writes(self):
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Свежий комментарий'})
+        self.assertIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+        self.assertContains(self.client.get(self.detail()),
+                            'Свежий комментарий')
+        # Без cookie страница снова читается с отстающей реплики.
+        del self.client.cookies[settings.DATABASE_PIN_COOKIE]
+        self.assertNotContains(self.client.get(self.detail()),
+                               'Свежий комментарий')
+
+    def test_reads_without_writes_do_not_pin(self):
+        response = self.client.get(self.detail())
+        self.assertNotIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+
+
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.addCleanup(routers.reset)
+        routers.reset()
+
+    def test_primary_outside_read_views(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_reads_follow_writes_to_primary(self):
+        routers.use_replica('replica_1')
+        self.assertEqual(self.router.db_for_read(Post), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Comment), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_bookkeeping_writes_do_not_pin(self):
+        routers.use_replica('replica_1')
+        for model in (Session, TimelineEntry):
+            self.assertEqual(self.router.db_for_write(model), 'default')
+        # Запрос читает свою запись, но клиент не закрепляется.
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        self.assertFalse(routers.pinned())
+        self.router.db_for_write(Comment)
+        self.assertTrue(routers.pinned())
+
+    def test_sessions_always_primary(self):
+        routers.use_replica('replica_1')
+        self.assertEqual(self.router.db_for_read(Session), 'default')
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate('default', 'posts'))
+        self.assertFalse(self.router.allow_migrate('replica_1', 'posts'))
+
+
+class SqlitePragmaTests(TestCase):
+    def test_pragmas_applied_to_new_connections(self):
+        # Тестовая база в памяти: журнал у неё всегда memory, остальное
+        # настраивается как у файла.
+        self.assertEqual(
+            sqlite.current_pragmas(connection, ['synchronous',
+                                                'busy_timeout',
+                                                'temp_store', 'cache_size']),
+            {'synchronous': 1, 'busy_timeout': 10000, 'temp_store': 2,
+             'cache_size': -64 * 1024})
+
+    def test_database_can_override_pragmas(self):
+        database = mock.Mock(settings_dict={'PRAGMAS': {'cache_size': 10}})
+        self.assertEqual(sqlite.pragmas_for(database), {'cache_size': 10})
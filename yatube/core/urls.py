@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'core'
+
+urlpatterns = [
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
+    path('performance/', views.performance_stats,
+         name='performance_stats'),
+]
@@ -1,5 +1,11 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from . import perf
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -15,3 +21,20 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def cache_stats(request):
+    """Счётчики кэшей, которые их ведут (см. ``core.cache.TieredCache``)."""
+    stats = {
+        alias: caches[alias].stats()
+        for alias in settings.CACHES
+        if hasattr(caches[alias], 'stats')
+    }
+    return JsonResponse(stats)
+
+
+@staff_member_required
+def performance_stats(request):
+    """Скользящие метрики запросов этого процесса (см. ``core.perf``)."""
+    return JsonResponse(perf.registry.snapshot())
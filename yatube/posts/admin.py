@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group, Comment, Follow
 
 
@@ -10,6 +11,12 @@ class PostAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
     list_editable = ('group',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Вместо LIKE '%...%' по всей таблице — полнотекстовый индекс.
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -0,0 +1,148 @@
+"""Буфер записи комментариев.
+
+Когда включён ``COMMENT_BUFFER``, ``add_comment`` проверяет форму и пост
+в запросе, а сам комментарий ставит в очередь процесса. Фоновый поток
+забирает из очереди всё, что успело накопиться (не больше
+``COMMENT_BUFFER_BATCH``), и пишет пачку одним ``bulk_create`` в
+короткой транзакции вместе со счётчиками. Пока пишется одна пачка,
+копится следующая, поэтому при всплеске комментариев к популярному
+посту блокировка записи SQLite берётся раз на пачку, а не на каждый
+запрос.
+
+``bulk_create`` не посылает сигналов, поэтому счётчики и штампы страниц
+(``posts.conditional``) обновляются здесь явно. Комментарий появляется
+на страницах, когда записана его пачка и другие потоки увидели новый
+штамп (не дольше ``SYNC_INTERVAL`` ``core.cache.TieredCache``). При
+остановке процесса поток дописывает очередь (``atexit``); если очередь
+переполнена, ``submit`` ждёт места в ней. Ошибка в пачке теряет только
+эту пачку: поток пишет её в лог и продолжает, а если он всё же умер,
+``submit`` запускает новый.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from . import conditional, counters
+from .models import Comment
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+
+_STOP = object()
+_queue = queue.Queue(QUEUE_SIZE)
+_lock = threading.Lock()
+_thread = None
+
+
+def submit(comment):
+    """Ставит несохранённый комментарий в очередь записи."""
+    if _thread is None or not _thread.is_alive():
+        _start()
+    _queue.put(comment)
+
+
+def flush():
+    """Ждёт, пока будут записаны все поставленные в очередь
+    комментарии."""
+    _queue.join()
+
+
+def shutdown():
+    """Дописывает очередь и останавливает поток."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            return
+        _queue.put(_STOP)
+        _thread.join()
+        _thread = None
+
+
+def _start():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='comment-buffer',
+                                       daemon=True)
+            _thread.start()
+
+
+def _forget():
+    # Поток родителя в дочерний процесс после fork не переходит.
+    global _queue, _lock, _thread
+    _queue = queue.Queue(QUEUE_SIZE)
+    _lock = threading.Lock()
+    _thread = None
+
+
+atexit.register(shutdown)
+os.register_at_fork(after_in_child=_forget)
+
+
+def _run():
+    try:
+        while True:
+            batch = _collect()
+            try:
+                comments = [item for item in batch if item is not _STOP]
+                if comments:
+                    write(comments)
+            except Exception:
+                logger.exception('Пачка из %s комментариев потеряна',
+                                 len(batch))
+            finally:
+                for _ in batch:
+                    _queue.task_done()
+            if batch[-1] is _STOP:
+                return
+    finally:
+        connection.close()
+
+
+def _collect():
+    """Ждёт первый комментарий и добирает к нему уже накопившиеся."""
+    batch = [_queue.get()]
+    while batch[-1] is not _STOP and len(batch) < (
+            settings.COMMENT_BUFFER_BATCH):
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def write(comments):
+    """Пишет пачку комментариев одной транзакцией; если она не удалась
+    (скажем, пост удалили, пока комментарий ждал в очереди), пишет их
+    по одному, чтобы не потерять остальные. Штампы страниц меняются
+    после записи, чтобы их ошибка не записала комментарии второй раз."""
+    written = set()
+    try:
+        written.update(_save(comments))
+    except DatabaseError:
+        logger.warning('Пачка из %s комментариев не записалась, пишем по '
+                       'одному', len(comments), exc_info=True)
+        for comment in comments:
+            try:
+                written.update(_save([comment]))
+            except DatabaseError:
+                logger.exception('Комментарий к посту %s потерян',
+                                 comment.post_id)
+    conditional.touch(*(f'post:{post_id}' for post_id in sorted(written)))
+
+
+def _save(comments):
+    """Записывает комментарии и счётчики; возвращает id постов."""
+    posts = Counter(comment.post_id for comment in comments)
+    with transaction.atomic():
+        Comment.objects.bulk_create(comments)
+        for post_id, amount in posts.items():
+            counters.comments_added(post_id, amount)
+    return posts.keys()
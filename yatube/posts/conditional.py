@@ -0,0 +1,139 @@
+"""Условные GET (ETag) для лент и страницы поста.
+
+Валидаторы строятся из «штампов» — меток времени в кэше, которые
+сигналы обновляют при изменении того, что видно на странице:
+
+* ``posts`` — любой пост (состав главной ленты);
+* ``groups`` и ``authors`` — любая группа или автор (их показывают
+  карточки и комментарии);
+* ``group:<id>``, ``author:<id>``, ``post:<id>`` — посты группы, посты,
+  счётчики и подписки автора, сам пост с его комментариями;
+* ``site`` — всё сразу, его обновляют команды обслуживания.
+
+Кроме того, у каждого пользователя есть свой штамп ``viewer:<id>``: его
+обновляют подписки и отписки пользователя и пересчёт его рекомендаций.
+От них зависят кнопки подписки и блок «на кого подписаться» на чужих
+страницах, штампы которых при этом не меняются. Штамп читателя входит
+только в ETag: кэш страниц (``posts.pagecache``) общий для всех.
+
+ETag — хэш штампов страницы, штампа читателя, версии
+``CONDITIONAL_GET_VERSION`` и id пользователя (от него зависят кнопки
+подписки и редактирования, форма комментария и шапка). Если штампы не
+изменились, представление отвечает ``304 Not Modified``, не загружая
+посты и не отрисовывая шаблон.
+
+Last-Modified не отдаётся: время не зависит от пользователя, поэтому
+после входа или выхода ``If-Modified-Since`` без ``If-None-Match``
+вернул бы 304 на чужую страницу, а его точность в секунду пропускает
+изменения в ту же секунду. Такие запросы получают страницу целиком.
+
+Страница, прочитанная с реплики сразу после изменения, могла его ещё не
+увидеть, поэтому в течение ``DATABASE_PIN_SECONDS`` после обновления
+штампа такие ответы валидаторов не получают.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from core import routers
+
+STAMP_KEY = 'stamp:%s'
+
+
+def stamps(*names):
+    """Штампы по именам одним запросом к кэшу."""
+    keys = [STAMP_KEY % name for name in names]
+    found = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in found}
+    if missing:
+        # Вытесненный штамп считается только что изменившимся.
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def touch(*names):
+    """Отмечает, что содержимое с этими штампами изменилось."""
+    now = time.time()
+    cache.set_many({STAMP_KEY % name: now for name in names}, None)
+
+
+def post_stamps(post, *group_ids):
+    """Штампы, которые меняет правка или удаление поста; ``group_ids`` —
+    прежние группы поста."""
+    names = ['posts', f'post:{post.pk}', f'author:{post.author_id}']
+    for group_id in {post.group_id, *group_ids} - {None}:
+        names.append(f'group:{group_id}')
+    return names
+
+
+def viewer_stamp(user_id):
+    """Имя штампа персональных частей страниц пользователя."""
+    return f'viewer:{user_id}'
+
+
+def signature(page_stamps):
+    """Хэш штампов страницы ``{имя: значение}``; один для всех
+    пользователей."""
+    source = '|'.join([str(settings.CONDITIONAL_GET_VERSION), *page_stamps,
+                       *(repr(value) for value in page_stamps.values())])
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def etag_for(request, page_stamps, viewer_stamps=None):
+    """ETag страницы со штампами ``page_stamps`` для пользователя
+    запроса; ``viewer_stamps`` — его собственный штамп."""
+    viewer = request.user.pk if request.user.is_authenticated else 0
+    source = f'{signature(page_stamps)}|{viewer}'
+    if viewer_stamps:
+        source += f'|{signature(viewer_stamps)}'
+    return quote_etag(hashlib.md5(source.encode()).hexdigest())
+
+
+def unsettled(page_stamps):
+    """Страницу читают с реплики вскоре после изменения, и реплика могла
+    его ещё не получить."""
+    return (time.time() - max(page_stamps.values())
+            < settings.DATABASE_PIN_SECONDS and routers.reading_replica())
+
+
+def conditional(stamp_names):
+    """Декоратор представления: ``stamp_names(request, **kwargs)``
+    возвращает имена штампов страницы или ``None``, если страницы нет —
+    тогда представление само ответит 404.
+
+    Штампы со значениями остаются в ``request.page_stamps`` для
+    ``posts.pagecache``."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            names = stamp_names(request, *args, **kwargs)
+            if names is None:
+                return view(request, *args, **kwargs)
+            names = ['site', *names]
+            personal = ([viewer_stamp(request.user.pk)]
+                        if request.user.is_authenticated else [])
+            values = stamps(*names, *personal)
+            request.page_stamps = dict(zip(names, values))
+            viewer_stamps = dict(zip(personal, values[len(names):]))
+            etag = etag_for(request, request.page_stamps, viewer_stamps)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if (response.status_code != 200 or unsettled(
+                        {**request.page_stamps, **viewer_stamps})):
+                    return response
+                response['ETag'] = etag
+            # Страница зависит от пользователя и должна проверяться
+            # при каждом показе.
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,133 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным ``UPDATE ... SET x = x + 1`` в той же
+транзакции, что и сама запись, поэтому страницы профиля и поста читают
+готовые числа вместо ``COUNT(*)``. Расхождения, если они всё же
+появились, исправляет ``reconcile()`` (команда ``reconcile_counters``).
+Уменьшение не опускает счётчик ниже нуля и не создаёт недостающую
+строку: оно приходит и из каскада удаления самого пользователя, когда
+его строка счётчиков уже удалена.
+"""
+from django.db.models import (Count, F, IntegerField, OuterRef, Q,
+                              Subquery)
+from django.db.models.functions import Coalesce, Greatest
+
+from . import conditional
+from .models import Comment, Follow, Post, User, UserStats
+
+RECONCILE_BATCH_SIZE = 500
+
+
+def _changed(field, delta):
+    return {field: Greatest(F(field) + delta, 0)}
+
+
+def _change_user(user_id, field, delta):
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **_changed(field, delta))
+    if not updated and delta > 0 and User.objects.filter(
+            pk=user_id).exists():
+        # Строки со счётчиками ещё нет: считаем её целиком.
+        reconcile_users(User.objects.filter(pk=user_id))
+
+
+def _change_users(user_ids, field, delta):
+    updated = UserStats.objects.filter(user_id__in=user_ids).update(
+        **_changed(field, delta))
+    if updated < len(user_ids) and delta > 0:
+        reconcile_users(User.objects.filter(pk__in=user_ids,
+                                            stats__isnull=True))
+
+
+def post_added(post):
+    _change_user(post.author_id, 'posts_count', 1)
+
+
+def post_removed(post):
+    _change_user(post.author_id, 'posts_count', -1)
+
+
+def comments_added(post_id, amount=1):
+    Post.objects.filter(pk=post_id).update(
+        **_changed('comments_count', amount))
+
+
+def comments_removed(post_id, amount=1):
+    Post.objects.filter(pk=post_id).update(
+        **_changed('comments_count', -amount))
+
+
+def follow_added(user_id, author_id):
+    _change_user(user_id, 'following_count', 1)
+    _change_user(author_id, 'followers_count', 1)
+
+
+def follow_removed(user_id, author_id):
+    _change_user(user_id, 'following_count', -1)
+    _change_user(author_id, 'followers_count', -1)
+
+
+def follows_added(user_id, author_ids):
+    """Счётчики после подписки ``user_id`` сразу на несколько авторов."""
+    _change_user(user_id, 'following_count', len(author_ids))
+    _change_users(author_ids, 'followers_count', 1)
+
+
+def follows_removed(user_id, author_ids):
+    _change_user(user_id, 'following_count', -len(author_ids))
+    _change_users(author_ids, 'followers_count', -1)
+
+
+def _count(queryset, field):
+    """Подзапрос с числом строк ``queryset`` для внешней строки."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total'),
+        output_field=IntegerField()), 0)
+
+
+def _reconcile(queryset, expressions):
+    """Исправляет поля по подзапросам и возвращает число расхождений."""
+    drift = Q()
+    for name in expressions:
+        drift |= ~Q(**{name: F(f'real_{name}')})
+    drifted = list(
+        queryset.annotate(**{
+            f'real_{name}': expression
+            for name, expression in expressions.items()})
+        .filter(drift)
+        .values_list('pk', flat=True))
+    for start in range(0, len(drifted), RECONCILE_BATCH_SIZE):
+        batch = drifted[start:start + RECONCILE_BATCH_SIZE]
+        queryset.model.objects.filter(pk__in=batch).update(**expressions)
+    return len(drifted)
+
+
+def reconcile_users(users=None):
+    """Создаёт недостающие строки счётчиков и исправляет расхождения."""
+    users = User.objects.all() if users is None else users
+    missing = users.filter(stats__isnull=True).values_list('pk', flat=True)
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in missing], ignore_conflicts=True)
+    return _reconcile(UserStats.objects.filter(user__in=users), {
+        'posts_count': _count(Post.objects.all(), 'author'),
+        'followers_count': _count(Follow.objects.all(), 'author'),
+        'following_count': _count(Follow.objects.all(), 'user'),
+    })
+
+
+def reconcile():
+    """Пересчитывает все счётчики; возвращает число исправленных строк."""
+    fixed = {
+        'posts': _reconcile(Post.objects.all(), {
+            'comments_count': _count(Comment.objects.all(), 'post'),
+        }),
+        'users': reconcile_users(),
+    }
+    if any(fixed.values()):
+        # Исправленные числа видны на страницах профиля и поста.
+        conditional.touch('site')
+    return fixed
@@ -0,0 +1,187 @@
+"""Граф подписок в кэше.
+
+Для каждого пользователя хранятся два отсортированных массива id
+(``array('i')``, 4 байта на id): на кого он подписан (``following``) и
+кто подписан на него (``followers``). Массив читается из индекса
+подписок одним запросом без создания объектов модели и кладётся в кэш
+байтами под ключом с версией пользователя (``fragments.versions``).
+Любое изменение подписок меняет версию, и старый массив просто
+перестаёт находиться.
+
+Проверка «подписан ли» — двоичный поиск в массиве подписок читателя,
+без запроса к базе. Массивы длиннее ``FOLLOW_GRAPH_CACHE_LIMIT`` (у
+очень популярных авторов) не кэшируются: вместо них в кэше лежит
+отметка, и такие проверки идут в базу по индексу.
+
+Подписка и отписка — один запрос ``INSERT ... ON CONFLICT DO NOTHING``
+или ``DELETE`` с ``RETURNING``: база сама говорит, какие подписки
+появились или исчезли, поэтому повторный или одновременный клик ничего
+не ломает и не считается дважды. Запросы идут в обход сигналов, а
+счётчики, ленты подписок, штампы страниц и версии графа обновляются в
+той же транзакции. ``RETURNING`` есть в SQLite с версии 3.35; более
+старую версию отвергает проверка ``core.E001`` при запуске.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from core import routers
+
+from . import (conditional, counters, fragments, recommendations,
+               timelines)
+from .models import Follow, StaleRecommendation
+
+GRAPH_KEY = 'follow_graph:%s:%s:%s'
+
+# Отметка в кэше: массив слишком велик, чтобы его хранить. Строка, а
+# не байты: пустой массив — это b''.
+TOO_LARGE = 'too large'
+
+# Поле, по которому ищутся связи пользователя, и поле с id на другом
+# конце. Оба обхода покрыты индексами: unique_user_author и
+# follow_author_user_idx.
+EDGES = {
+    'following': ('user_id', 'author_id'),
+    'followers': ('author_id', 'user_id'),
+}
+
+# Сколько подписок пишется одним запросом: по два параметра на строку
+# укладываются в старый предел SQLite в 999 параметров.
+BATCH_SIZE = 400
+
+
+def edges(kind, user_id):
+    """Запрос id на другом конце связей пользователя по порядку id."""
+    field, other = EDGES[kind]
+    return (Follow.objects.filter(**{field: user_id}).order_by(other)
+            .values_list(other, flat=True))
+
+
+def ids(kind, user_id):
+    """Отсортированный ``array('i')`` подписок (``kind='following'``) или
+    подписчиков (``'followers'``) пользователя; ``None``, если их больше
+    ``FOLLOW_GRAPH_CACHE_LIMIT``."""
+    version, = fragments.versions((kind, user_id))
+    key = GRAPH_KEY % (kind, user_id, version)
+    packed = cache.get(key)
+    if packed is None:
+        limit = settings.FOLLOW_GRAPH_CACHE_LIMIT
+        found = array('i', edges(kind, user_id)[:limit + 1])
+        packed = TOO_LARGE if len(found) > limit else found.tobytes()
+        cache.set(key, packed, settings.FOLLOW_GRAPH_CACHE_TIMEOUT)
+    if packed == TOO_LARGE:
+        return None
+    found = array('i')
+    found.frombytes(packed)
+    return found
+
+
+def contains(sorted_ids, value):
+    index = bisect_left(sorted_ids, value)
+    return index < len(sorted_ids) and sorted_ids[index] == value
+
+
+def is_following(user_id, author_id):
+    following = ids('following', user_id)
+    if following is None:
+        return Follow.objects.filter(user_id=user_id,
+                                     author_id=author_id).exists()
+    return contains(following, author_id)
+
+
+def changed(user_id, *author_ids):
+    """Сбрасывает массивы, затронутые подписками ``user_id`` на
+    ``author_ids``."""
+    fragments.bump('following', user_id)
+    for author_id in author_ids:
+        fragments.bump('followers', author_id)
+
+
+def _invalidate(user_id, author_ids):
+    """Подписки писались без сигналов: граф и страницы сбрасываются здесь.
+
+    Сразу — чтобы изменения увидел этот же поток, и ещё раз после
+    коммита — чтобы параллельный запрос не успел закэшировать прежние
+    подписки под новой версией."""
+    def invalidate():
+        changed(user_id, *author_ids)
+        conditional.touch(
+            conditional.viewer_stamp(user_id), f'author:{user_id}',
+            *(f'author:{author_id}' for author_id in author_ids))
+    invalidate()
+    transaction.on_commit(invalidate)
+    recommendations.mark_stale(StaleRecommendation.USER, user_id)
+
+
+def _returning(statement, user, author_ids):
+    """Выполняет ``statement(user_id, batch)`` пачками авторов;
+    возвращает отсортированные id авторов из ``RETURNING``."""
+    found = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(author_ids), BATCH_SIZE):
+            sql, params = statement(
+                user.pk, author_ids[start:start + BATCH_SIZE])
+            cursor.execute(sql, params)
+            found.extend(author_id for author_id, in cursor.fetchall())
+    if found:
+        # Запись мимо ORM роутер не видит.
+        routers.mark_written()
+    return sorted(found)
+
+
+def _insert(user_id, batch):
+    values = ', '.join(['(%s, %s)'] * len(batch))
+    return (f'INSERT INTO {Follow._meta.db_table} (user_id, author_id) '
+            f'VALUES {values} ON CONFLICT DO NOTHING RETURNING author_id',
+            [value for author_id in batch for value in (user_id, author_id)])
+
+
+def _delete(user_id, batch):
+    placeholders = ', '.join(['%s'] * len(batch))
+    return (f'DELETE FROM {Follow._meta.db_table} WHERE user_id = %s '
+            f'AND author_id IN ({placeholders}) RETURNING author_id',
+            [user_id, *batch])
+
+
+def follow_many(user, author_ids):
+    """Подписывает ``user`` на авторов; возвращает id тех, на кого он
+    ещё не был подписан."""
+    wanted = sorted(set(author_ids) - {user.pk})
+    with transaction.atomic():
+        added = _returning(_insert, user, wanted)
+        if not added:
+            return []
+        counters.follows_added(user.pk, added)
+        for author_id in added:
+            timelines.backfill(user, author_id)
+        _invalidate(user.pk, added)
+    return added
+
+
+def unfollow_many(user, author_ids):
+    """Отписывает ``user`` от авторов; возвращает id тех, на кого он был
+    подписан."""
+    wanted = sorted(set(author_ids))
+    with transaction.atomic():
+        removed = _returning(_delete, user, wanted)
+        if not removed:
+            return []
+        counters.follows_removed(user.pk, removed)
+        timelines.trim(user, *removed)
+        _invalidate(user.pk, removed)
+    return removed
+
+
+def follow(user, author_id):
+    """Подписка на одного автора одним запросом; True, если её ещё не
+    было."""
+    return bool(follow_many(user, [author_id]))
+
+
+def unfollow(user, author_id):
+    """Отписка от одного автора одним запросом; True, если подписка
+    была."""
+    return bool(unfollow_many(user, [author_id]))
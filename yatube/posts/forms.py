@@ -1,5 +1,7 @@
 from .models import Post, Comment
+from . import uploads
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.translation import gettext_lazy as _
 
 
@@ -13,6 +15,27 @@ class PostForm(forms.ModelForm):
             'image': _('Изображение')
         }
 
+    def __init__(self, *args, rejected_uploads=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        # Поля, файлы которых отбросил uploads.SizeLimitUploadHandler.
+        self.rejected_uploads = rejected_uploads
+
+    def clean_image(self):
+        if 'image' in self.rejected_uploads:
+            raise uploads.too_large()
+        image = self.cleaned_data['image']
+        if isinstance(image, UploadedFile):
+            uploads.validate(image)
+        return image
+
+    def save(self, commit=True):
+        if 'image' in self.changed_data:
+            # Размеры из заголовка записывает поле картинки; после
+            # фоновой обработки оригинала их обновит uploads.normalize
+            # вместе с хэшем.
+            self.instance.image_hash = ''
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,56 @@
+"""Кэш отрендеренных карточек постов.
+
+Ключ карточки состоит из id поста и версий поста, его группы и автора.
+Сигналы ``post_save``/``post_delete`` меняют версию изменившегося
+объекта, после чего все карточки с его участием перестают совпадать по
+ключу и при следующем показе рендерятся заново; остальные карточки
+страницы берутся из кэша.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+
+
+def _version_key(kind, pk):
+    return f'version:{kind}:{pk}'
+
+
+def versions(*objects):
+    """Версии объектов, заданных парами (вид, pk), одним запросом к кэшу."""
+    keys = [_version_key(kind, pk) for kind, pk in objects]
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex[:12] for key in keys
+               if key not in found}
+    if missing:
+        # Версия, вытесненная из кэша, заменяется новой: карточки со
+        # старой версией при этом просто перестают находиться.
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump(kind, pk):
+    """Делает недействительными все карточки с участием объекта."""
+    cache.set(_version_key(kind, pk), uuid.uuid4().hex[:12], None)
+
+
+def card_key(post):
+    post_version, group_version, author_version = versions(
+        ('post', post.pk), ('group', post.group_id),
+        ('user', post.author_id))
+    return (f'post_card:{post.pk}:{post_version}:'
+            f'{group_version}:{author_version}')
+
+
+def render_card(post):
+    key = card_key(post)
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(CARD_TEMPLATE, {'post': post})
+        cache.set(key, html, getattr(settings, 'POST_CARD_CACHE_TIMEOUT',
+                                     60 * 60))
+    return html
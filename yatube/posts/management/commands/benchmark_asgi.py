@@ -0,0 +1,172 @@
+import asyncio
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from core.asgi import ASGIHandler
+from posts import urls
+
+from .benchmark_site import Command as SiteBenchmark
+from .benchmark_site import percentile
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность страниц для чтения при '
+            'обслуживании через WSGI (синхронные воркеры) и через ASGI '
+            '(core.asgi) при большом числе одновременных медленных '
+            'клиентов. Сервер не нужен: оба приложения вызываются '
+            'напрямую, медленный клиент изображается задержкой при '
+            'получении запроса и отдаче ответа.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Всего запросов в каждом режиме.')
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='Число одновременных клиентов.')
+        parser.add_argument('--threads', type=int,
+                            help='Потоков (и соединений с базой) в обоих '
+                                 'режимах; по умолчанию '
+                                 'ASGI_READ_THREADS.')
+        parser.add_argument('--client-delay', type=float, default=100,
+                            help='Сколько миллисекунд клиент передаёт '
+                                 'запрос и столько же принимает ответ.')
+        parser.add_argument('--output', help='Файл для JSON-отчёта.')
+
+    # Разбор запросов из DEBUG обходит стек на каждом SQL и исказил бы
+    # замеры.
+    @override_settings(PERF_QUERY_INSPECTION=False)
+    def handle(self, *args, **options):
+        read_views = set(settings.ASGI_READ_VIEWS)
+        targets = [url for name, url in SiteBenchmark().targets()
+                   if f'{urls.app_name}:{name}' in read_views]
+        plan = [targets[i % len(targets)]
+                for i in range(options['requests'])]
+        threads = options['threads'] or settings.ASGI_READ_THREADS
+        delay = options['client_delay'] / 1000
+        concurrency = options['concurrency']
+        report = {
+            'meta': {
+                'requests': len(plan),
+                'concurrency': concurrency,
+                'threads': threads,
+                'client_delay_ms': options['client_delay'],
+                'urls': targets,
+            },
+            'wsgi': self.measure(self.wsgi_client(threads, delay),
+                                 plan, concurrency),
+            'asgi': self.measure(self.asgi_client(threads, delay),
+                                 plan, concurrency),
+        }
+        report['speedup'] = round(
+            report['asgi']['requests_per_second']
+            / report['wsgi']['requests_per_second'], 2)
+        output = json.dumps(report, ensure_ascii=False, indent=2,
+                            sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def scope(url):
+        path, _, query = url.partition('?')
+        return {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path,
+            'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost')],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        }
+
+    def wsgi_client(self, threads, delay):
+        """Синхронный воркер занят запросом целиком, вместе с временем,
+        пока медленный клиент передаёт запрос и принимает ответ."""
+        handler = WSGIHandler()
+        executor = ThreadPoolExecutor(max_workers=threads)
+        statuses = []
+
+        def serve(url):
+            time.sleep(delay)
+            environ = ASGIHandler.environ(self.scope(url), io.BytesIO())
+            response = handler(environ, lambda status, headers: None)
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            statuses.append(response.status_code)
+            time.sleep(delay)
+
+        async def request(url):
+            await asyncio.get_running_loop().run_in_executor(
+                executor, serve, url)
+
+        request.statuses = statuses
+        request.close = executor.shutdown
+        return request
+
+    def asgi_client(self, threads, delay):
+        """Медленный клиент ждёт в цикле событий, поток пула занят только
+        работой Django."""
+        application = ASGIHandler(read_threads=threads, threads=threads)
+        statuses = []
+
+        async def receive():
+            await asyncio.sleep(delay)
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif not message.get('more_body'):
+                await asyncio.sleep(delay)
+
+        async def request(url):
+            await application(self.scope(url), receive, send)
+
+        request.statuses = statuses
+        request.close = application.shutdown
+        return request
+
+    def measure(self, request, plan, concurrency):
+        timings = []
+
+        async def client(queue):
+            while not queue.empty():
+                url = queue.get_nowait()
+                started = time.perf_counter()
+                await request(url)
+                timings.append((time.perf_counter() - started) * 1000)
+
+        async def warm_up():
+            for url in set(plan):
+                await request(url)
+
+        async def main():
+            queue = asyncio.Queue()
+            for url in plan:
+                queue.put_nowait(url)
+            await asyncio.gather(*[client(queue)
+                                   for _ in range(concurrency)])
+
+        # Прогревочный запрос на каждый адрес в отчёт не входит.
+        asyncio.run(warm_up())
+        del request.statuses[:]
+        started = time.perf_counter()
+        asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        request.close()
+        return {
+            'seconds': round(elapsed, 2),
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'status': sorted(set(request.statuses)),
+        }
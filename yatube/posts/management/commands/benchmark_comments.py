@@ -0,0 +1,123 @@
+import json
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts import comment_buffer
+from posts.models import Comment, Post, User
+
+from .benchmark_site import percentile
+from .stress_sqlite import Command as StressCommand
+
+
+class Command(BaseCommand):
+    help = ('Одновременные авторы отправляют комментарии через '
+            'add_comment: сравнивает прямую запись с буфером записи '
+            '(COMMENT_BUFFER) на копии базы. Для каждого режима выводит '
+            'записанные комментарии в секунду, время ответа и число '
+            'принятых, но не записанных комментариев.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posters', type=int, default=16,
+                            help='Число одновременных авторов (потоков).')
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--posts', type=int, default=3,
+                            help='На сколько самых свежих постов идут '
+                                 'комментарии.')
+        parser.add_argument('--output', help='Файл для JSON-отчёта.')
+
+    # Ограничение частоты остановило бы авторов, а разбор запросов из
+    # DEBUG исказил бы замеры.
+    @override_settings(COMMENT_RATE_PER_MINUTE=0,
+                       PERF_QUERY_INSPECTION=False)
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда проверяет только SQLite.')
+        self.post_ids = list(Post.objects.order_by('-pub_date')
+                             .values_list('pk', flat=True)[:options['posts']])
+        self.users = list(User.objects.all()[:options['posters']])
+        if not self.post_ids or len(self.users) < options['posters']:
+            raise CommandError('Мало данных: сначала запустите '
+                               'generate_data.')
+        report = {
+            'meta': {
+                'posters': options['posters'],
+                'seconds': options['seconds'],
+                'posts': self.post_ids,
+                'batch': settings.COMMENT_BUFFER_BATCH,
+            },
+        }
+        for mode, buffered in (('direct', False), ('buffered', True)):
+            with StressCommand().database_copy(settings.SQLITE_PRAGMAS), \
+                    override_settings(COMMENT_BUFFER=buffered):
+                report[mode] = self.run(options)
+        output = json.dumps(report, ensure_ascii=False, indent=2,
+                            sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        before = Comment.objects.count()
+        stop = threading.Event()
+        results = []
+        posters = [threading.Thread(target=self.poster,
+                                    args=(user, stop, results))
+                   for user in self.users]
+        started = time.perf_counter()
+        for poster in posters:
+            poster.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for poster in posters:
+            poster.join()
+        # Остановка процесса: буфер обязан дописать всё принятое.
+        comment_buffer.shutdown()
+        elapsed = time.perf_counter() - started
+        stored = Comment.objects.count() - before
+        timings = [timing for poster in results for timing in poster[0]]
+        errors = sum(poster[1] for poster in results)
+        return {
+            'accepted': len(timings),
+            'stored': stored,
+            'lost': len(timings) - stored,
+            'errors': errors,
+            'comments_per_second': round(stored / elapsed, 1),
+            'p50_ms': round(percentile(timings or [0], 50), 2),
+            'p95_ms': round(percentile(timings or [0], 95), 2),
+            'max_ms': round(max(timings or [0]), 2),
+        }
+
+    def poster(self, user, stop, results):
+        client = Client()
+        timings, errors = [], 0
+        try:
+            client.force_login(user)
+            step = 0
+            while not stop.is_set():
+                step += 1
+                url = reverse('posts:add_comment',
+                              args=[random.choice(self.post_ids)])
+                started = time.perf_counter()
+                try:
+                    response = client.post(
+                        url, {'text': f'Комментарий {user.pk}-{step}'})
+                except Exception:
+                    errors += 1
+                    continue
+                if response.status_code == 302:
+                    timings.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+        finally:
+            connection.close()
+            results.append((timings, errors))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+from posts.views import POSTS_ON_PAGE
+
+
+def _pick(candidates, needed):
+    """Кандидат, которого выберет браузер: самый узкий из тех, что не уже
+    ``needed`` пикселей, иначе самый широкий."""
+    for width, thumbnail in candidates:
+        if width >= needed:
+            return thumbnail
+    return candidates[-1][1]
+
+
+def _bytes(thumbnail):
+    return thumbnail.storage.size(thumbnail.name)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает вес картинок первой страницы ленты с одной '
+            'миниатюрой на пост и с srcset/WebP для заданного экрана.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viewport', type=int, default=390,
+                            help='Ширина экрана в CSS-пикселях.')
+        parser.add_argument('--dpr', type=float, default=2,
+                            help='Плотность пикселей экрана.')
+        parser.add_argument('--rendition', default='feed_card',
+                            choices=sorted(thumbnails.RENDITIONS))
+
+    def handle(self, *args, **options):
+        name = options['rendition']
+        full_width = thumbnails.RENDITIONS[name]['size'][0]
+        slot = min(options['viewport'], full_width)
+        needed = slot * options['dpr']
+        posts = (Post.objects.exclude(image='')
+                 .order_by('-pub_date', '-id')[:POSTS_ON_PAGE])
+        before = after = counted = 0
+        for post in posts:
+            thumbnails.generate(post.pk)
+            rendition = thumbnails.get_rendition(post, name)
+            if rendition is None:
+                continue
+            counted += 1
+            # Раньше каждая карточка получала одну самую широкую
+            # миниатюру в исходном формате.
+            before += _bytes(rendition.fallback)
+            candidates = (rendition.candidates.get('WEBP')
+                          or rendition.candidates[None])
+            after += _bytes(_pick(candidates, needed))
+        self.stdout.write(
+            f'Картинок на странице: {counted}, экран {options["viewport"]}'
+            f' px × {options["dpr"]:g}, WebP: '
+            f'{"да" if thumbnails.WEBP else "нет"}')
+        self.stdout.write(f'Одна миниатюра: {before / 1024:.1f} КБ')
+        self.stdout.write(f'srcset: {after / 1024:.1f} КБ')
+        if before:
+            self.stdout.write(self.style.SUCCESS(
+                f'Экономия: {100 * (before - after) / before:.0f}%'))
@@ -0,0 +1,53 @@
+from timeit import repeat
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+
+from posts.models import Post
+from posts.paginators import NEXT, CursorPaginator
+from posts.views import POSTS_ON_PAGE
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время выдачи первой и глубокой страницы ленты '
+            'для обычного и курсорного паджинатора.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=10000,
+                            help='Номер глубокой страницы.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Сколько раз повторить замер.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        total = posts.count()
+        page = min(options['page'], max(total // POSTS_ON_PAGE, 1))
+        self.stdout.write(f'Постов: {total}, глубокая страница: {page}')
+
+        cursor_paginator = CursorPaginator(posts, POSTS_ON_PAGE)
+        # Курсор глубокой страницы получаем заранее: в реальной ленте
+        # он приходит из ссылки «Следующая» предыдущей страницы.
+        deep_cursor = None
+        offset = (page - 1) * POSTS_ON_PAGE
+        if offset:
+            last = posts.order_by(*cursor_paginator.ordering)[offset - 1]
+            deep_cursor = cursor_paginator.encode_cursor(NEXT, last)
+
+        def numbered(number):
+            # Paginator кэширует COUNT(*), поэтому создаём его заново,
+            # как это происходит на каждом запросе.
+            return list(Paginator(posts, POSTS_ON_PAGE).get_page(number))
+
+        cases = {
+            'Paginator, страница 1':
+                lambda: numbered(1),
+            f'Paginator, страница {page}':
+                lambda: numbered(page),
+            'CursorPaginator, страница 1':
+                lambda: list(cursor_paginator.get_page(None)),
+            f'CursorPaginator, страница {page}':
+                lambda: list(cursor_paginator.get_page(deep_cursor)),
+        }
+        for name, case in cases.items():
+            best = min(repeat(case, number=1, repeat=options['repeat']))
+            self.stdout.write(f'{name}: {best * 1000:.2f} мс')
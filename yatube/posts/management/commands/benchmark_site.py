@@ -0,0 +1,150 @@
+import json
+import platform
+import time
+import tracemalloc
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import urls
+from posts.models import Follow, Group, Post, User
+
+# Подписка и отписка идут в каждом круге подряд, поэтому обе делают
+# настоящую запись, а данные после прогона остаются прежними.
+FOLLOW_TARGET = ('profile_follow', 'profile_unfollow')
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет каждый адрес posts/urls.py через тестовый клиент и '
+            'выводит JSON с перцентилями времени ответа, числом запросов '
+            'и пиком памяти.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз запросить каждый адрес.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кэш перед каждым запросом.')
+        parser.add_argument('--output', help='Файл для JSON-отчёта.')
+
+    def handle(self, *args, **options):
+        targets = self.targets()
+        client = Client()
+        client.force_login(self.reader)
+        results = {name: {'url': url, 'timings': [], 'queries': [],
+                          'statuses': set()}
+                   for name, url in targets}
+        # Прогревочный круг в отчёт не входит.
+        for name, url in targets:
+            client.get(url)
+        for _ in range(options['repeat']):
+            for name, url in targets:
+                if options['cold']:
+                    cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    elapsed = time.perf_counter() - started
+                result = results[name]
+                result['timings'].append(elapsed * 1000)
+                result['queries'].append(len(queries))
+                result['statuses'].add(response.status_code)
+        # Память меряется отдельным кругом: tracemalloc замедляет запросы.
+        tracemalloc.start()
+        for name, url in targets:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            client.get(url)
+            peak = tracemalloc.get_traced_memory()[1]
+            results[name]['peak_memory_kb'] = round((peak - before) / 1024)
+        tracemalloc.stop()
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'cold_cache': options['cold'],
+                'users': User.objects.count(),
+                'posts': Post.objects.count(),
+                'follows': Follow.objects.count(),
+            },
+            'urls': {name: self.summary(result)
+                     for name, result in results.items()},
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2,
+                            sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def summary(self, result):
+        timings = result['timings']
+        return {
+            'url': result['url'],
+            'status': sorted(result['statuses']),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'queries_min': min(result['queries']),
+            'queries_max': max(result['queries']),
+            'peak_memory_kb': result['peak_memory_kb'],
+        }
+
+    def targets(self):
+        """Пары (имя, адрес) для всех маршрутов posts/urls.py."""
+        author = (User.objects.filter(stats__posts_count__gt=0)
+                  .order_by('-stats__posts_count').first())
+        if author is None:
+            raise CommandError('Нет постов: сначала запустите '
+                               'generate_data.')
+        self.reader = (User.objects.exclude(pk=author.pk)
+                       .order_by('-stats__following_count').first())
+        if self.reader is None:
+            raise CommandError('Нужно хотя бы два пользователя.')
+        stranger = (User.objects.exclude(pk__in=[author.pk, self.reader.pk])
+                    .exclude(following__user=self.reader).first())
+        post = author.posts.order_by('-comments_count').first()
+        group = (Group.objects.annotate(total=Count('post'))
+                 .order_by('-total').first())
+        values = {
+            'username': author.username,
+            'post_id': post.pk,
+            'slug': group.slug if group else '',
+        }
+        query = {
+            'search': '?q=' + post.text.split()[0].strip('.,'),
+        }
+        targets = []
+        for pattern in urls.urlpatterns:
+            name = pattern.name
+            kwargs = {}
+            for key in pattern.pattern.converters:
+                if key not in values or not values[key]:
+                    raise CommandError(
+                        f'Не из чего взять {key} для {name}.')
+                kwargs[key] = values[key]
+            if name in FOLLOW_TARGET:
+                if stranger is None:
+                    continue
+                kwargs['username'] = stranger.username
+            url = reverse(f'{urls.app_name}:{name}', kwargs=kwargs)
+            targets.append((name, url + query.get(name, '')))
+        return targets
@@ -0,0 +1,208 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+from mixer.backend.django import Mixer
+
+from posts import counters, search, timelines
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+
+PASSWORD = 'password'
+SENTENCES = 2000
+
+
+@contextmanager
+def keep_dates(*fields):
+    """Отключает auto_now_add, чтобы bulk_create сохранил заданные даты."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def popularity(count, skew):
+    """Накопленные веса по закону Ципфа: первые авторы популярнее."""
+    total = 0
+    weights = []
+    for rank in range(1, count + 1):
+        total += 1 / rank ** skew
+        weights.append(total)
+    return weights
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами, комментариями и подписками через bulk_create.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Среднее число подписок пользователя.')
+        parser.add_argument('--comments', type=float, default=3,
+                            help='Среднее число комментариев к посту.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить посты.')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Неравномерность популярности авторов.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.faker = Faker('ru_RU')
+        self.faker.seed_instance(options['seed'])
+        self.mixer = Mixer(commit=False)
+        self.batch_size = options['batch_size']
+        self.sentences = [self.faker.sentence(nb_words=12)
+                          for _ in range(SENTENCES)]
+        started = time.perf_counter()
+        with transaction.atomic():
+            users = self.step('Пользователи', self.create_users,
+                              options['users'])
+            groups = self.step('Группы', self.create_groups,
+                               options['groups'])
+            weights = popularity(len(users), options['skew'])
+            posts = self.step('Посты', self.create_posts, options['posts'],
+                              users, weights, groups, options['days'])
+            follows = self.step('Подписки', self.create_follows, users,
+                                weights, options['follows'])
+            self.step('Комментарии', self.create_comments, posts, users,
+                      options['comments'])
+            self.step('Ленты', self.fill_timelines, posts, follows)
+            self.step('Счётчики', lambda: counters.reconcile())
+            self.step('Поисковый индекс', search.rebuild)
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с'))
+
+    def step(self, title, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        size = ''
+        if isinstance(result, (list, int)):
+            size = f': {result if isinstance(result, int) else len(result)}'
+        self.stdout.write(
+            f'{title}{size} — {time.perf_counter() - started:.1f} с')
+        return result
+
+    def bulk(self, model, objects):
+        for start in range(0, len(objects), self.batch_size):
+            model.objects.bulk_create(
+                objects[start:start + self.batch_size])
+
+    def text(self, low, high):
+        return ' '.join(self.random.choices(
+            self.sentences, k=self.random.randint(low, high)))
+
+    def create_users(self, count):
+        # Хэш пароля один на всех: считать его для каждого слишком долго.
+        password = make_password(PASSWORD)
+        offset = User.objects.count()
+        names = [f'user_{offset + number}' for number in range(count)]
+        self.bulk(User, [
+            self.mixer.blend(
+                User, username=name, password=password,
+                first_name=self.faker.first_name(),
+                last_name=self.faker.last_name())
+            for name in names])
+        return list(User.objects.filter(username__in=names)
+                    .order_by('pk').values_list('pk', flat=True))
+
+    def create_groups(self, count):
+        offset = Group.objects.count()
+        slugs = [f'group-{offset + number}' for number in range(count)]
+        self.bulk(Group, [
+            self.mixer.blend(Group, slug=slug,
+                             title=self.faker.catch_phrase()[:200],
+                             description=self.text(1, 3))
+            for slug in slugs])
+        return list(Group.objects.filter(slug__in=slugs)
+                    .values_list('pk', flat=True))
+
+    def create_posts(self, count, users, weights, groups, days):
+        last_pk = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        now = timezone.now()
+        step = timedelta(days=days) / max(count, 1)
+        authors = self.random.choices(users, cum_weights=weights, k=count)
+        posts = [
+            Post(author_id=author,
+                 group_id=(self.random.choice(groups)
+                           if groups and self.random.random() < 0.7
+                           else None),
+                 text=self.text(1, 6),
+                 pub_date=now - step * (count - number))
+            for number, author in enumerate(authors)]
+        with keep_dates(Post._meta.get_field('pub_date')):
+            self.bulk(Post, posts)
+        return list(Post.objects.filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', 'author_id', 'pub_date'))
+
+    def create_follows(self, users, weights, average):
+        follows = []
+        for user in users:
+            wanted = min(self.random.randint(0, average * 2), len(users) - 1)
+            authors = set(self.random.choices(
+                users, cum_weights=weights, k=wanted))
+            authors.discard(user)
+            follows.extend(Follow(user_id=user, author_id=author)
+                           for author in authors)
+        existing = set(Follow.objects.filter(user__in=users)
+                       .values_list('user_id', 'author_id'))
+        follows = [follow for follow in follows
+                   if (follow.user_id, follow.author_id) not in existing]
+        self.bulk(Follow, follows)
+        return [(follow.user_id, follow.author_id) for follow in follows]
+
+    def create_comments(self, posts, users, average):
+        count = int(len(posts) * average)
+        comments = []
+        for post_id, _, pub_date in self.random.choices(posts, k=count):
+            comments.append(Comment(
+                post_id=post_id,
+                author_id=self.random.choice(users),
+                text=self.text(1, 2),
+                created=pub_date + timedelta(
+                    minutes=self.random.randint(1, 60 * 24))))
+        with keep_dates(Comment._meta.get_field('created')):
+            self.bulk(Comment, comments)
+        return comments
+
+    def fill_timelines(self, posts, follows):
+        """Те же записи, что дал бы timelines.rebuild(), но без запроса
+        на каждую подписку. Записей лент на порядки больше, чем постов,
+        поэтому они вставляются через executemany, минуя модели."""
+        adapt = connection.ops.adapt_datetimefield_value
+        by_author = {}
+        for post_id, author_id, pub_date in reversed(posts):
+            by_author.setdefault(author_id, []).append(
+                (post_id, adapt(pub_date)))
+        limit = timelines.backfill_limit()
+        table = TimelineEntry._meta.db_table
+        sql = (f'INSERT INTO {table} (user_id, post_id, author_id, pub_date)'
+               f' VALUES (%s, %s, %s, %s)')
+        rows = []
+        total = 0
+        with connection.cursor() as cursor:
+            for user_id, author_id in follows:
+                for post_id, pub_date in by_author.get(author_id, ())[:limit]:
+                    rows.append((user_id, post_id, author_id, pub_date))
+                if len(rows) >= self.batch_size:
+                    cursor.executemany(sql, rows)
+                    total += len(rows)
+                    rows = []
+            cursor.executemany(sql, rows)
+        return total + len(rows)
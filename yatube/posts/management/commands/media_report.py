@@ -0,0 +1,119 @@
+import os
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.management.base import BaseCommand
+from PIL import Image
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts import thumbnails
+from posts.models import Post
+from posts.storage import file_hash
+
+
+def _walk(root):
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            yield path, os.path.getsize(path)
+
+
+def _megabytes(size):
+    return f'{size / 1024 / 1024:.2f} МБ'
+
+
+class Command(BaseCommand):
+    help = ('Оценивает, сколько места и процессорного времени экономят '
+            'хранение картинок по хэшу и единый набор миниатюр на '
+            'текущем MEDIA_ROOT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=10,
+                            help='Сколько картинок уменьшить для оценки '
+                                 'времени создания миниатюры.')
+        parser.add_argument('--apply', action='store_true',
+                            help='Перенести картинки постов в хранилище '
+                                 'по хэшу, удалив дубликаты.')
+
+    def handle(self, *args, **options):
+        posts_root = os.path.join(settings.MEDIA_ROOT, 'posts')
+        thumbs_root = os.path.join(settings.MEDIA_ROOT,
+                                   sorl_settings.THUMBNAIL_PREFIX)
+
+        by_hash = defaultdict(list)
+        for path, size in _walk(posts_root):
+            with open(path, 'rb') as image:
+                by_hash[file_hash(image)].append((path, size))
+        originals = sum(len(paths) for paths in by_hash.values())
+        duplicates = originals - len(by_hash)
+        duplicate_bytes = sum(size for paths in by_hash.values()
+                              for _, size in paths[1:])
+
+        thumbs = list(_walk(thumbs_root))
+        thumbs_bytes = sum(size for _, size in thumbs)
+        per_source = len(thumbs) / originals if originals else 0
+        renditions = len(thumbnails.unique_renditions())
+        # Лишние варианты: всё, что сверх единого набора на уникальную
+        # картинку.
+        needed = len(by_hash) * renditions
+        extra_thumbs = max(len(thumbs) - needed, 0)
+        avg_thumb = thumbs_bytes / len(thumbs) if thumbs else 0
+
+        seconds = self._thumbnail_seconds(
+            [paths[0][0] for paths in by_hash.values()][:options['sample']])
+
+        self.stdout.write(f'Оригиналов: {originals}, уникальных: '
+                          f'{len(by_hash)}, дубликатов: {duplicates} '
+                          f'({_megabytes(duplicate_bytes)})')
+        self.stdout.write(f'Миниатюр: {len(thumbs)} '
+                          f'({_megabytes(thumbs_bytes)}), в среднем '
+                          f'{per_source:.2f} на оригинал, нужно '
+                          f'{renditions} на уникальную картинку')
+        self.stdout.write(
+            f'Экономия места: {_megabytes(duplicate_bytes)} на оригиналах, '
+            f'{_megabytes(extra_thumbs * avg_thumb)} на миниатюрах')
+        self.stdout.write(
+            f'Экономия процессора: {extra_thumbs} созданий миниатюр, '
+            f'около {extra_thumbs * seconds:.1f} с '
+            f'({seconds * 1000:.1f} мс на миниатюру)')
+
+        if options['apply']:
+            moved = self._apply()
+            self.stdout.write(self.style.SUCCESS(
+                f'Перенесено картинок постов: {moved}'))
+
+    def _thumbnail_seconds(self, paths):
+        """Среднее время декодирования и уменьшения одной картинки."""
+        if not paths:
+            return 0
+        geometry = thumbnails.unique_renditions()[0][0]
+        width, height = (int(side) for side in geometry.split('x'))
+        started = time.perf_counter()
+        for path in paths:
+            with Image.open(path) as image:
+                image.convert('RGB').resize((width, height))
+        return (time.perf_counter() - started) / len(paths)
+
+    def _apply(self):
+        field = Post._meta.get_field('image')
+        storage = field.storage
+        moved = 0
+        for post in Post.objects.exclude(image='').only(
+                'image', 'image_width', 'image_height'):
+            old_name = post.image.name
+            upload_name = field.generate_filename(
+                post, os.path.basename(old_name))
+            with storage.open(old_name) as content:
+                new_name = storage.hashed_name(upload_name, File(content))
+                if new_name == old_name:
+                    continue
+                new_name = storage.save(upload_name, File(content))
+            Post.objects.filter(pk=post.pk).update(image=new_name)
+            if not Post.objects.filter(image=old_name).exists():
+                # Вместе с оригиналом удаляются и его миниатюры.
+                delete_thumbnails(post.image)
+            moved += 1
+        return moved
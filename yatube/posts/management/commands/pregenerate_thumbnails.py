@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры для уже загруженных изображений постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Число процессов; 0 — в текущем процессе.')
+
+    def handle(self, *args, **options):
+        post_ids = list(
+            Post.objects.exclude(image='').values_list('pk', flat=True))
+        created = thumbnails.pregenerate(post_ids, options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Постов с картинками: {len(post_ids)}, миниатюр: {created}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timelines
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок с нуля.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Пересобрать ленты только этих '
+                                 'пользователей.')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        with transaction.atomic():
+            created = timelines.rebuild(users)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {created}'))
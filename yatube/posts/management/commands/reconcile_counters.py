@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики постов, '
+            'комментариев и подписок и исправляет расхождения.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено постов: {fixed["posts"]}, '
+            f'пользователей: {fixed["users"]}'))
@@ -0,0 +1,174 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+from core import routers
+from posts.models import Comment, Post, User
+
+from .benchmark_site import percentile
+
+# Так работала база до настройки: стандартные журнал и fsync SQLite.
+BASELINE = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+# Каждая такая по счёту запись создаёт пост, остальные — комментарии.
+POST_EVERY = 10
+
+
+class Command(BaseCommand):
+    help = ('Нагружает копию базы одновременными писателями (комментарии '
+            'и посты, как add_comment и post_create) и читателями лент. '
+            'Сравнивает стандартные настройки SQLite с SQLITE_PRAGMAS: '
+            'пропускную способность и число ошибок «database is locked».')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--output', help='Файл для JSON-отчёта.')
+
+    def handle(self, *args, **options):
+        primary = connections[routers.PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Команда проверяет только SQLite.')
+        self.post_ids = list(Post.objects.values_list('pk', flat=True)[:500])
+        self.user_ids = list(User.objects.values_list('pk', flat=True)[:500])
+        if not self.post_ids:
+            raise CommandError('Нет постов: сначала запустите '
+                               'generate_data.')
+        profiles = {'baseline': BASELINE, 'tuned': settings.SQLITE_PRAGMAS}
+        report = {
+            'meta': {
+                'writers': options['writers'],
+                'readers': options['readers'],
+                'seconds': options['seconds'],
+                'profiles': profiles,
+            },
+        }
+        for name, pragmas in profiles.items():
+            with self.database_copy(pragmas):
+                report[name] = self.run(options)
+        output = json.dumps(report, ensure_ascii=False, indent=2,
+                            sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    @contextmanager
+    def database_copy(self, pragmas):
+        """Подменяет основную базу копией во временном файле, чтобы
+        нагрузка и смена режима журнала не задели настоящую."""
+        primary = connections[routers.PRIMARY]
+        primary.ensure_connection()
+        database = primary.settings_dict
+        original = {key: database.get(key) for key in ('NAME', 'PRAGMAS')}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stress.sqlite3')
+            target = sqlite3.connect(path)
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            # Исходное соединение не закрываем, а откладываем: закрытие
+            # уничтожило бы тестовую базу в памяти.
+            saved, primary.connection = primary.connection, None
+            database.update(NAME=path, PRAGMAS=pragmas)
+            try:
+                yield path
+            finally:
+                connections.close_all()
+                primary.connection = saved
+                database.update(original)
+                if original['PRAGMAS'] is None:
+                    del database['PRAGMAS']
+
+    def run(self, options):
+        """Писатели и читатели — отдельные процессы, как воркеры сервера:
+        в потоках одного процесса GIL растягивал бы время удержания
+        блокировки записи."""
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        queue = context.Queue()
+        workers = [
+            context.Process(target=self.worker, args=(kind, stop, queue))
+            for kind, count in (('writes', options['writers']),
+                                ('reads', options['readers']))
+            for _ in range(count)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        results = {'writes': [], 'reads': [], 'errors': {}}
+        for _ in workers:
+            kind, timings, errors = queue.get()
+            results[kind].extend(timings)
+            for message, count in errors.items():
+                results['errors'][message] = (
+                    results['errors'].get(message, 0) + count)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        summary = {'errors': results['errors'],
+                   'lock_errors': sum(
+                       count for message, count in results['errors'].items()
+                       if 'locked' in message)}
+        for kind in ('writes', 'reads'):
+            timings = results[kind] or [0]
+            summary[kind] = len(results[kind])
+            summary[f'{kind}_per_second'] = round(
+                len(results[kind]) / elapsed, 1)
+            summary[f'{kind}_p95_ms'] = round(percentile(timings, 95), 2)
+            summary[f'{kind}_max_ms'] = round(max(timings), 2)
+        return summary
+
+    def worker(self, kind, stop, queue):
+        # Соединения родителя после fork использовать нельзя.
+        for connection in connections.all():
+            connection.connection = None
+        random.seed()
+        timings, errors = [], {}
+        step = 0
+        try:
+            while not stop.is_set():
+                step += 1
+                started = time.perf_counter()
+                try:
+                    if kind == 'writes':
+                        with transaction.atomic():
+                            self.write(step)
+                    else:
+                        self.read()
+                except OperationalError as error:
+                    errors[str(error)] = errors.get(str(error), 0) + 1
+                else:
+                    timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            connections.close_all()
+            queue.put((kind, timings, errors))
+
+    def write(self, step):
+        author_id = random.choice(self.user_ids)
+        if step % POST_EVERY == 0:
+            Post.objects.create(author_id=author_id,
+                                text=f'Нагрузочный пост {step}')
+        else:
+            Comment.objects.create(post_id=random.choice(self.post_ids),
+                                   author_id=author_id,
+                                   text=f'Нагрузочный комментарий {step}')
+
+    def read(self):
+        list(Post.objects.for_feed()[:10])
+        list(Comment.objects.filter(post_id=random.choice(self.post_ids))
+             .select_related('author')[:10])
@@ -0,0 +1,39 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import routers
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файлы реплик из '
+            'DATABASE_REPLICAS. Нужна для локальной проверки чтения с '
+            'реплик; настоящие реплики наполняет сама СУБД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*',
+                            help='Какие реплики обновить; по умолчанию '
+                                 'все.')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        if not aliases:
+            raise CommandError('Реплики не настроены: задайте '
+                               'YATUBE_DB_REPLICAS.')
+        primary = connections[routers.PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Копировать можно только базу SQLite.')
+        primary.ensure_connection()
+        for alias in aliases:
+            if alias not in settings.DATABASE_REPLICAS:
+                raise CommandError(f'{alias} — не реплика.')
+            replica = connections[alias]
+            replica.close()
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f'{alias}: скопирована'))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рекомендации авторов и похожие посты для '
+            'изменившихся пользователей и постов. Запускается по '
+            'расписанию.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересчитать рекомендации для всех.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = recommendations.update(everything=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано пользователей: {updated["users"]}, постов: '
+            f'{updated["posts"]} за '
+            f'{time.perf_counter() - started:.1f} с'))
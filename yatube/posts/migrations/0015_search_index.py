@@ -0,0 +1,77 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:08
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+FTS_TABLE = 'posts_post_fts'
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+
+
+def fill_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    backend = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if fts5_available(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE {FTS_TABLE} USING '
+                f"fts5(text, tokenize='unicode61 remove_diacritics 2')")
+            if backend in ('auto', 'fts5'):
+                # Регистр FTS5 приводит сам, остаётся только «ё».
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE}(rowid, text) '
+                    f"SELECT id, replace(replace(text, 'ё', 'е'), 'Ё', 'е') "
+                    f'FROM posts_post')
+                return
+    Post = apps.get_model('posts', 'Post')
+    SearchTerm = apps.get_model('posts', 'SearchTerm')
+    batch = []
+    for post_id, text in Post.objects.values_list('pk', 'text').iterator():
+        words = re.findall(r'\w+', text.lower().replace('ё', 'е'))
+        batch.extend(
+            SearchTerm(term=term[:64], post_id=post_id, frequency=frequency)
+            for term, frequency in Counter(words).items())
+    SearchTerm.objects.bulk_create(batch)
+
+
+def drop_fts_table(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_image_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, verbose_name='Слово')),
+                ('frequency', models.PositiveIntegerField(verbose_name='Число вхождений')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Post', verbose_name='Пост')),
+            ],
+            options={
+                'verbose_name': 'Слово поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchterm',
+            constraint=models.UniqueConstraint(fields=('term', 'post'), name='unique_term_post'),
+        ),
+        migrations.RunPython(fill_search_index, drop_fts_table),
+    ]
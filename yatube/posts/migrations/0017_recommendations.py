@@ -0,0 +1,86 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0016_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorSuggestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+            ],
+            options={
+                'verbose_name': 'Рекомендованный автор',
+                'verbose_name_plural': 'Рекомендованные авторы',
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RelatedPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+            ],
+            options={
+                'verbose_name': 'Похожий пост',
+                'verbose_name_plural': 'Похожие посты',
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StaleRecommendation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'Пользователь'), ('post', 'Пост')], max_length=4, verbose_name='Что')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Id')),
+            ],
+            options={
+                'verbose_name': 'Устаревшие рекомендации',
+                'verbose_name_plural': 'Устаревшие рекомендации',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stalerecommendation',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_stale_recommendation'),
+        ),
+        migrations.AddField(
+            model_name='relatedpost',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='posts.Post', verbose_name='Пост'),
+        ),
+        migrations.AddField(
+            model_name='relatedpost',
+            name='related',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Post', verbose_name='Похожий пост'),
+        ),
+        migrations.AddField(
+            model_name='authorsuggestion',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AddField(
+            model_name='authorsuggestion',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='author_suggestions', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddConstraint(
+            model_name='relatedpost',
+            constraint=models.UniqueConstraint(fields=('post', 'rank'), name='unique_post_related_rank'),
+        ),
+        migrations.AddConstraint(
+            model_name='authorsuggestion',
+            constraint=models.UniqueConstraint(fields=('user', 'rank'), name='unique_user_suggestion_rank'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:32
+
+from django.db import migrations, models
+from PIL import Image
+import posts.models
+import posts.storage
+
+
+def fill_dimensions(apps, schema_editor):
+    # Без размеров поле картинки открывало бы файл при каждой загрузке
+    # поста; значения читаются без моделей, чтобы не открывать его здесь.
+    Post = apps.get_model('posts', 'Post')
+    storage = posts.storage.HashedMediaStorage()
+    rows = (Post.objects.exclude(image='')
+            .filter(models.Q(image_width=None) | models.Q(image_height=None))
+            .values_list('pk', 'image'))
+    for pk, name in rows:
+        try:
+            with storage.open(name) as content:
+                with Image.open(content) as image:
+                    width, height = image.size
+        except (OSError, ValueError):
+            continue
+        Post.objects.filter(pk=pk).update(image_width=width,
+                                          image_height=height)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=posts.models.PostImageField(blank=True, height_field='image_height', storage=posts.storage.HashedMediaStorage(), upload_to='posts/', verbose_name='Изображение', width_field='image_width'),
+        ),
+        migrations.RunPython(fill_dimensions, migrations.RunPython.noop),
+    ]
@@ -2,9 +2,25 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import HashedMediaStorage
+
 User = get_user_model()
 
 
+class PostImageField(models.ImageField):
+    """Картинка, которая не ломает загрузку поста, если размеры ещё не
+    записаны, а файл недоступен."""
+
+    def update_dimension_fields(self, instance, force=False, *args,
+                                **kwargs):
+        try:
+            super().update_dimension_fields(instance, force, *args,
+                                            **kwargs)
+        except OSError:
+            if force:
+                raise
+
+
 class Group(models.Model):
     title = models.CharField("Заголовок", max_length=200)
     slug = models.SlugField('Индификатор', unique=True)
@@ -18,6 +34,12 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты вместе со всем, что выводят карточки лент."""
+        return self.select_related('author', 'group')
+
+
 class Post(models.Model):
     text = models.TextField('Текст поста')
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
@@ -32,20 +54,78 @@ class Post(models.Model):
         null=True,
         on_delete=models.SET_NULL,
         verbose_name='Группа',)
-    image = models.ImageField(
+    image = PostImageField(
         'Изображение',
         upload_to='posts/',
+        storage=HashedMediaStorage(),
+        width_field='image_width',
+        height_field='image_height',
         blank=True)
+    image_width = models.PositiveIntegerField(
+        'Ширина изображения',
+        null=True,
+        editable=False)
+    image_height = models.PositiveIntegerField(
+        'Высота изображения',
+        null=True,
+        editable=False)
+    image_hash = models.CharField(
+        'Хэш изображения',
+        max_length=64,
+        blank=True,
+        editable=False)
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['pub_date', 'id'],
+                         name='post_pub_date_id_idx'),
+            # Ленты профиля и группы: фильтр и сортировка по одному индексу.
+            models.Index(fields=['author', 'pub_date', 'id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', 'pub_date', 'id'],
+                         name='post_group_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
 
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',)
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0)
+
+    class Meta:
+        indexes = [
+            # Популярные авторы для лент подписок (timelines).
+            models.Index(fields=['followers_count'],
+                         name='userstats_followers_idx'),
+        ]
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return str(self.user)
+
+
 class Comment(models.Model):
     post = models.ForeignKey(
         Post,
@@ -62,6 +142,10 @@ class Comment(models.Model):
         auto_now_add=True)
 
     class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+        ]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -85,5 +169,143 @@ class Follow(models.Model):
             models.UniqueConstraint(
                 fields=["user", "author"],
                 name="unique_user_author")]
+        indexes = [
+            # Подписчики автора; подписки читателя покрывает
+            # unique_user_author.
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_user_post')]
+        indexes = [
+            models.Index(fields=['user', 'pub_date', 'post'],
+                         name='timeline_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        ]
+        ordering = ['-pub_date', '-post_id']
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+
+
+class SearchTerm(models.Model):
+    """Запись инвертированного индекса: сколько раз слово встречается
+    в посте. Используется поиском, когда FTS5 недоступен."""
+    term = models.CharField('Слово', max_length=64)
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Пост',
+    )
+    frequency = models.PositiveIntegerField('Число вхождений')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['term', 'post'],
+                name='unique_term_post')]
+        verbose_name = 'Слово поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
+
+
+class AuthorSuggestion(models.Model):
+    """Автор из списка «на кого подписаться» пользователя
+    (posts.recommendations)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='author_suggestions',
+        verbose_name='Пользователь',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    rank = models.PositiveSmallIntegerField('Место')
+    score = models.FloatField('Оценка')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'rank'],
+                name='unique_user_suggestion_rank')]
+        ordering = ['rank']
+        verbose_name = 'Рекомендованный автор'
+        verbose_name_plural = 'Рекомендованные авторы'
+
+
+class RelatedPost(models.Model):
+    """Похожий пост для страницы поста (posts.recommendations)."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='related_entries',
+        verbose_name='Пост',
+    )
+    related = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий пост',
+    )
+    rank = models.PositiveSmallIntegerField('Место')
+    score = models.FloatField('Оценка')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'rank'],
+                name='unique_post_related_rank')]
+        ordering = ['rank']
+        verbose_name = 'Похожий пост'
+        verbose_name_plural = 'Похожие посты'
+
+
+class StaleRecommendation(models.Model):
+    """Пользователь или пост, чьи рекомендации пора пересчитать."""
+    USER = 'user'
+    POST = 'post'
+    KINDS = ((USER, 'Пользователь'), (POST, 'Пост'))
+
+    kind = models.CharField('Что', max_length=4, choices=KINDS)
+    object_id = models.PositiveIntegerField('Id')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'object_id'],
+                name='unique_stale_recommendation')]
+        verbose_name = 'Устаревшие рекомендации'
+        verbose_name_plural = 'Устаревшие рекомендации'
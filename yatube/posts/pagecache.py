@@ -0,0 +1,159 @@
+"""Кэш целых страниц лент с «дырками» для персональных частей.
+
+Страница сохраняется в кэше как «скелет» — HTML, общий для всех
+пользователей, в котором на месте персональных частей (меню
+пользователя в шапке, вкладки лент, кнопка подписки, кнопки поста и
+форма комментария с CSRF-токеном) стоят метки ``<!--hole:...-->``. При
+показе метки заменяются частями, нарисованными для текущего
+пользователя функциями из ``HOLES``; остальная страница не рисуется и
+посты не загружаются. Анониму достаётся готовая страница целиком.
+
+В шаблоне персональная часть задаётся тегом ``{% hole 'имя' ... %}``
+из библиотеки ``holes``. Вне кэшируемых страниц тег сразу рисует часть.
+
+Ключ страницы — путь, номер страницы (или курсор) и подпись штампов из
+``posts.conditional``. Сигналы, меняющие штампы, тем самым делают
+недействительными и сохранённые страницы: новый ключ просто ещё не
+заполнен, а старые истекают через ``PAGE_CACHE_TIMEOUT``.
+"""
+import hashlib
+import re
+from functools import wraps
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+from . import conditional, follow_graph, recommendations
+from .forms import CommentForm
+
+HOLE = re.compile(r'<!--hole:(\w+)\?([^>]*)-->')
+
+HOLES = {}
+
+# Параметры запроса, от которых зависит страница ленты.
+PAGE_PARAMS = ('page', 'cursor')
+
+
+def hole(function):
+    """Регистрирует функцию, рисующую персональную часть страницы."""
+    HOLES[function.__name__] = function
+    return function
+
+
+@hole
+def user_menu(request):
+    return render_to_string('includes/user_menu.html', request=request)
+
+
+@hole
+def feed_switcher(request):
+    return render_to_string('posts/includes/switcher.html', request=request)
+
+
+@hole
+def follow_button(request, username, author_id):
+    user = request.user
+    if not user.is_authenticated or user.username == username:
+        return ''
+    following = follow_graph.is_following(user.pk, int(author_id))
+    return render_to_string('posts/includes/follow_button.html',
+                            {'username': username, 'following': following},
+                            request=request)
+
+
+@hole
+def suggested_authors(request, author_id):
+    user = request.user
+    if not user.is_authenticated:
+        return ''
+    # Подписки после пересчёта и автора открытой страницы не советуем.
+    following = follow_graph.ids('following', user.pk)
+    authors = [
+        author for author in recommendations.suggested_authors(user.pk)
+        if str(author.pk) != author_id and not (
+            following is not None
+            and follow_graph.contains(following, author.pk))]
+    return render_to_string('posts/includes/suggested_authors.html',
+                            {'authors': authors}, request=request)
+
+
+@hole
+def post_actions(request, post_id, author_id):
+    if not request.user.is_authenticated:
+        return ''
+    context = {
+        'post_id': post_id,
+        'is_author': str(request.user.pk) == author_id,
+        'form': CommentForm(),
+    }
+    return render_to_string('posts/includes/post_actions.html', context,
+                            request=request)
+
+
+def render_hole(request, name, params):
+    """Персональная часть ``name`` или метка на её месте, если сейчас
+    рисуется скелет страницы."""
+    if request is None:
+        return ''
+    params = {key: str(value) for key, value in params.items()}
+    if getattr(request, 'page_skeleton', False):
+        return f'<!--hole:{name}?{urlencode(sorted(params.items()))}-->'
+    return HOLES[name](request, **params)
+
+
+def fill(request, skeleton):
+    """Заменяет метки скелета частями для пользователя ``request``."""
+    return HOLE.sub(
+        lambda match: HOLES[match[1]](request, **dict(parse_qsl(match[2]))),
+        skeleton)
+
+
+def page_key(request):
+    # Остальные параметры страницу не меняют и не должны плодить ключи.
+    page = sorted((name, value) for name, value in request.GET.items()
+                  if name in PAGE_PARAMS)
+    source = '|'.join([request.path, urlencode(page),
+                       conditional.signature(request.page_stamps)])
+    return 'page:' + hashlib.md5(source.encode()).hexdigest()
+
+
+def cached_page(view):
+    """Декоратор представления под ``conditional``: отдаёт страницу из
+    кэша, а при промахе рисует скелет и сохраняет его."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        page_stamps = getattr(request, 'page_stamps', None)
+        if (not settings.PAGE_CACHE_TIMEOUT or page_stamps is None
+                or request.method not in ('GET', 'HEAD')):
+            return view(request, *args, **kwargs)
+        key = page_key(request)
+        anonymous_key = key + ':anonymous'
+        anonymous = not request.user.is_authenticated
+        found = cache.get_many([key, anonymous_key] if anonymous else [key])
+        if anonymous and anonymous_key in found:
+            return HttpResponse(found[anonymous_key])
+        skeleton = found.get(key)
+        if skeleton is None:
+            request.page_skeleton = True
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                request.page_skeleton = False
+            if response.status_code != 200 or response.streaming:
+                return response
+            skeleton = response.content.decode(response.charset)
+            # Реплика могла ещё не получить последнее изменение, и
+            # такую страницу нельзя запоминать под новым ключом.
+            if not conditional.unsettled(page_stamps):
+                cache.set(key, skeleton, settings.PAGE_CACHE_TIMEOUT)
+        else:
+            response = HttpResponse()
+        html = fill(request, skeleton)
+        if anonymous and not conditional.unsettled(page_stamps):
+            cache.set(anonymous_key, html, settings.PAGE_CACHE_TIMEOUT)
+        response.content = html
+        return response
+    return wrapper
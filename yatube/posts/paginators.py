@@ -0,0 +1,176 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorPage:
+    """Страница курсорного паджинатора.
+
+    Повторяет ту часть интерфейса ``django.core.paginator.Page``,
+    которой пользуются шаблоны: итерация, ``len``, ``has_next``,
+    ``has_previous`` и ``has_other_pages``.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous,
+                 cursor=None):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.paginator = paginator
+        # Курсоры считаются сразу: после этого object_list можно
+        # заменить, например, на посты вместо записей ленты.
+        self.next_cursor = None
+        self.previous_cursor = None
+        if has_next and object_list:
+            self.next_cursor = paginator.encode_cursor(NEXT, object_list[-1])
+        if has_previous and object_list:
+            self.previous_cursor = paginator.encode_cursor(
+                PREVIOUS, object_list[0])
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<CursorPage %s>' % (self.cursor or 'first')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class CursorPaginator:
+    """Паджинатор по ключу (keyset pagination).
+
+    Вместо ``COUNT(*)`` и ``OFFSET`` каждая страница выбирается одним
+    запросом по диапазону ключа ``ordering``, поэтому глубокие страницы
+    отдаются так же быстро, как первая. Ключ должен быть уникальным,
+    поэтому последним полем в нём идёт первичный ключ.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.model = object_list.model
+
+    def encode_cursor(self, direction, obj):
+        values = [
+            self.model._meta.get_field(name).value_to_string(obj)
+            for name in self.fields
+        ]
+        raw = '|'.join([direction] + values)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает пару (направление, значения ключа) или None."""
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+        direction, *values = raw.split('|')
+        if direction not in (NEXT, PREVIOUS) or (
+                len(values) != len(self.fields)):
+            return None
+        try:
+            values = [
+                self.model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.fields, values)
+            ]
+        except ValidationError:
+            return None
+        if None in values:
+            return None
+        return direction, values
+
+    def _position_filter(self, values, reverse):
+        """Условие «строго после курсора» в порядке ``ordering``."""
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            if reverse:
+                descending = not descending
+            lookup = 'lt' if descending else 'gt'
+            step = Q(**{
+                '%s__%s' % (self.fields[index], lookup): values[index]})
+            for prev in range(index):
+                step &= Q(**{self.fields[prev]: values[prev]})
+            condition |= step
+        # Нестрогая граница по первому полю позволяет СУБД начать обход
+        # индекса сразу с позиции курсора, а не проверять OR построчно.
+        descending = self.ordering[0].startswith('-') != reverse
+        bound = Q(**{
+            '%s__%s' % (self.fields[0], 'lte' if descending else 'gte'):
+            values[0]})
+        return bound & condition
+
+    @staticmethod
+    def _reversed(ordering):
+        return [
+            name[1:] if name.startswith('-') else '-' + name
+            for name in ordering
+        ]
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor)
+        queryset = self.object_list
+        if position is None:
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self,
+                              has_next=len(rows) > self.per_page,
+                              has_previous=False)
+        direction, values = position
+        if direction == NEXT:
+            rows = list(
+                queryset.filter(self._position_filter(values, False))
+                .order_by(*self.ordering)[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self,
+                              has_next=len(rows) > self.per_page,
+                              has_previous=True, cursor=cursor)
+        rows = list(
+            queryset.filter(self._position_filter(values, True))
+            .order_by(*self._reversed(self.ordering))[:self.per_page + 1])
+        page = rows[:self.per_page]
+        page.reverse()
+        return CursorPage(page, self,
+                          has_next=True,
+                          has_previous=len(rows) > self.per_page,
+                          cursor=cursor)
+
+
+def paginate(request, queryset, per_page, ordering=('-pub_date', '-id')):
+    """Возвращает ``page_obj`` для ленты постов.
+
+    Курсорная паджинация включается настройкой
+    ``POSTS_CURSOR_PAGINATION`` или параметром ``cursor`` в запросе,
+    иначе используется стандартный ``Paginator`` с номерами страниц.
+    """
+    if (getattr(settings, 'POSTS_CURSOR_PAGINATION', False)
+            or 'cursor' in request.GET):
+        paginator = CursorPaginator(queryset, per_page, ordering)
+        return paginator.get_page(request.GET.get('cursor'))
+    paginator = Paginator(queryset, per_page)
+    return paginator.get_page(request.GET.get('page'))
@@ -0,0 +1,279 @@
+"""Рекомендации: «на кого подписаться» и «похожие посты».
+
+Рекомендации считает пакетная команда ``update_recommendations`` и
+сохраняет по ``RECOMMENDATIONS_SIZE`` лучших строк на пользователя
+(``AuthorSuggestion``) и на пост (``RelatedPost``). Страницы читают их
+одним запросом по индексу, без вычислений.
+
+Граф подписок — разреженная матрица смежности A (A[u][a] = 1, если u
+подписан на a), которая хранится строками: множествами id подписок и
+подписчиков. Оценка кандидата для пользователя u складывается из строки
+A·A (сколько подписок u подписаны на кандидата — «друзья друзей») и
+строки (A·Aᵀ)·A: читатели с общими с u подписками, взвешенные косинусом
+пересечения, голосуют за своих авторов. Авторы с подписчиками больше
+``RECOMMENDATIONS_MAX_FAN`` в сходство читателей не входят — общая
+подписка на знаменитость почти ничего не говорит. Свободные места
+добираются самыми популярными авторами.
+
+Похожесть постов — скалярное произведение нормированных векторов TF-IDF
+по словам из ``posts.search.tokenize`` плюс ``GROUP_BONUS`` за общую
+группу. Строка матрицы похожести собирается по инвертированному
+индексу, поэтому пост сравнивается только с постами, где есть его
+слова. Слова из большей доли постов, чем ``MAX_TERM_SHARE``, не
+учитываются. Похожесть приближённая: пост ищется по ``QUERY_TERMS``
+самым весомым словам, а для слова хранятся только ``CHAMPIONS`` постов,
+где его вес больше всего. Если похожих по тексту не хватает, место
+занимают свежие посты той же группы.
+
+Пересчёт инкрементный: сигналы кладут изменившихся пользователей и
+посты в ``StaleRecommendation``, команда забирает их и пересчитывает
+вместе с соседями на один шаг — подписчиками изменившегося
+пользователя и постами из новых списков похожих. Остальные строки
+обновит следующий полный пересчёт (``update_recommendations --all``).
+Если пересчёт упал, забранная очередь возвращается обратно.
+
+Инкрементный пересчёт экономит вычисления и запись, но не чтение:
+``load_graph`` читает всю таблицу подписок, а ``load_corpus`` — тексты
+всех постов (частоты слов нужны по всему корпусу). Память и время
+чтения растут с размером базы, а не очереди, поэтому команду стоит
+запускать пачками раз в несколько минут, а не на каждое изменение.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import conditional, search
+from .models import (AuthorSuggestion, Follow, Post, RelatedPost,
+                     StaleRecommendation, User, UserStats)
+
+GROUP_BONUS = 0.2
+MAX_TERM_SHARE = 0.2
+QUERY_TERMS = 10
+CHAMPIONS = 200
+WRITE_BATCH_SIZE = 500
+
+Corpus = namedtuple('Corpus', 'vectors postings groups group_posts')
+
+
+def mark_stale(kind, *object_ids):
+    """Ставит пользователей или посты в очередь пересчёта."""
+    StaleRecommendation.objects.bulk_create(
+        [StaleRecommendation(kind=kind, object_id=object_id)
+         for object_id in object_ids],
+        ignore_conflicts=True)
+
+
+def suggested_authors(user_id):
+    return [suggestion.author for suggestion in
+            AuthorSuggestion.objects.filter(user_id=user_id)
+            .select_related('author')]
+
+
+def related_posts(post_id):
+    return [entry.related for entry in
+            RelatedPost.objects.filter(post_id=post_id)
+            .select_related('related__author')]
+
+
+def _top(scores, size):
+    return heapq.nsmallest(size, scores.items(),
+                           key=lambda item: (-item[1], item[0]))
+
+
+def load_graph():
+    """Строки матрицы подписок и транспонированной к ней; читает все
+    подписки, O(число подписок) памяти."""
+    following, followers = defaultdict(set), defaultdict(set)
+    for user_id, author_id in (Follow.objects.order_by()
+                               .values_list('user_id', 'author_id')
+                               .iterator()):
+        following[user_id].add(author_id)
+        followers[author_id].add(user_id)
+    return following, followers
+
+
+def popular_authors(limit):
+    return list(UserStats.objects.filter(followers_count__gt=0)
+                .order_by('-followers_count', 'user_id')
+                .values_list('user_id', flat=True)[:limit])
+
+
+def who_to_follow(user_id, following, followers, popular, size):
+    """Лучшие ``size`` пар (id автора, оценка) для ``user_id``."""
+    followed = following.get(user_id, set())
+    scores = Counter()
+    for friend in followed:
+        for candidate in following.get(friend, ()):
+            scores[candidate] += 1
+    overlap = Counter()
+    for author in followed:
+        fans = followers[author]
+        if len(fans) <= settings.RECOMMENDATIONS_MAX_FAN:
+            overlap.update(fans)
+    del overlap[user_id]
+    for reader, common in overlap.items():
+        theirs = following[reader]
+        weight = common / math.sqrt(len(followed) * len(theirs))
+        for candidate in theirs:
+            scores[candidate] += weight
+    for excluded in (user_id, *followed):
+        del scores[excluded]
+    best = _top(scores, size)
+    taken = {user_id, *followed, *(author for author, _ in best)}
+    for author in popular:
+        if len(best) == size:
+            break
+        if author not in taken:
+            best.append((author, 0.0))
+    return best
+
+
+def load_corpus():
+    """Векторы TF-IDF всех постов, инвертированный индекс по словам и
+    посты групп от новых к старым; читает тексты всех постов."""
+    counts, groups, group_posts = {}, {}, defaultdict(list)
+    frequency = Counter()
+    for post_id, group_id, text in (Post.objects
+                                    .order_by('-pub_date', '-id')
+                                    .values_list('id', 'group_id', 'text')
+                                    .iterator()):
+        counts[post_id] = Counter(search.tokenize(text))
+        frequency.update(counts[post_id].keys())
+        groups[post_id] = group_id
+        if group_id is not None:
+            group_posts[group_id].append(post_id)
+    total = len(counts)
+    # Слово одного поста ни с кем его не сближает.
+    limit = max(2, MAX_TERM_SHARE * total)
+    vectors, postings = {}, defaultdict(list)
+    for post_id, terms in counts.items():
+        weights = {term: tf * math.log(total / frequency[term])
+                   for term, tf in terms.items()
+                   if 1 < frequency[term] <= limit}
+        norm = math.sqrt(sum(weight ** 2 for weight in weights.values()))
+        vectors[post_id] = {term: weight / norm
+                            for term, weight in weights.items() if norm}
+        for term, weight in vectors[post_id].items():
+            postings[term].append((post_id, weight))
+    for term, posts in postings.items():
+        posts.sort(key=lambda posting: (-posting[1], posting[0]))
+        del posts[CHAMPIONS:]
+    return Corpus(vectors, postings, groups, group_posts)
+
+
+def similar_posts(post_id, corpus, size):
+    """Лучшие ``size`` пар (id поста, оценка) для ``post_id``."""
+    scores = Counter()
+    terms = heapq.nlargest(QUERY_TERMS, corpus.vectors[post_id].items(),
+                           key=lambda item: (item[1], item[0]))
+    for term, weight in terms:
+        for other, other_weight in corpus.postings[term]:
+            scores[other] += weight * other_weight
+    del scores[post_id]
+    group_id = corpus.groups[post_id]
+    if group_id is not None:
+        for other in scores:
+            if corpus.groups[other] == group_id:
+                scores[other] += GROUP_BONUS
+    best = _top(scores, size)
+    if group_id is not None:
+        taken = {post_id, *(other for other, _ in best)}
+        for other in corpus.group_posts[group_id]:
+            if len(best) == size:
+                break
+            if other not in taken:
+                best.append((other, GROUP_BONUS))
+    return best
+
+
+def claim_stale():
+    """Забирает очередь пересчёта одним запросом: отметки, поставленные
+    во время пересчёта, дождутся следующего. Если пересчёт не удался,
+    забранное возвращается через ``mark_stale``."""
+    stale = defaultdict(set)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {StaleRecommendation._meta.db_table} '
+                       f'RETURNING kind, object_id')
+        for kind, object_id in cursor.fetchall():
+            stale[kind].add(object_id)
+    return stale
+
+
+def _replace(model, owner, target, rows):
+    owners = sorted(rows)
+    for start in range(0, len(owners), WRITE_BATCH_SIZE):
+        batch = owners[start:start + WRITE_BATCH_SIZE]
+        with transaction.atomic():
+            model.objects.filter(**{f'{owner}_id__in': batch}).delete()
+            model.objects.bulk_create(
+                model(**{f'{owner}_id': owner_id, f'{target}_id': target_id,
+                         'rank': rank, 'score': score})
+                for owner_id in batch
+                for rank, (target_id, score) in enumerate(rows[owner_id]))
+
+
+def update_users(user_ids=None):
+    """Пересчитывает «на кого подписаться» для ``user_ids`` и их
+    подписчиков; ``None`` — для всех. Возвращает число пользователей."""
+    following, followers = load_graph()
+    existing = set(User.objects.values_list('id', flat=True))
+    if user_ids is None:
+        user_ids = existing
+    else:
+        user_ids = set(user_ids)
+        for user_id in list(user_ids):
+            fans = followers.get(user_id, ())
+            if len(fans) <= settings.RECOMMENDATIONS_MAX_FAN:
+                user_ids.update(fans)
+        user_ids &= existing
+    size = settings.RECOMMENDATIONS_SIZE
+    popular = popular_authors(size * 10)
+    _replace(AuthorSuggestion, 'user', 'author', {
+        user_id: who_to_follow(user_id, following, followers, popular,
+                               size)
+        for user_id in user_ids})
+    conditional.touch(*(conditional.viewer_stamp(user_id)
+                        for user_id in sorted(user_ids)))
+    return len(user_ids)
+
+
+def update_posts(post_ids=None):
+    """Пересчитывает похожие посты для ``post_ids`` и постов из их новых
+    списков; ``None`` — для всех. Возвращает число постов."""
+    corpus = load_corpus()
+    size = settings.RECOMMENDATIONS_SIZE
+    if post_ids is None:
+        post_ids = set(corpus.vectors)
+    post_ids = set(post_ids) & set(corpus.vectors)
+    rows = {post_id: similar_posts(post_id, corpus, size)
+            for post_id in post_ids}
+    neighbours = {other for best in rows.values() for other, _ in best}
+    for post_id in neighbours - post_ids:
+        rows[post_id] = similar_posts(post_id, corpus, size)
+    _replace(RelatedPost, 'post', 'related', rows)
+    conditional.touch(*(f'post:{post_id}' for post_id in rows))
+    return len(rows)
+
+
+def update(everything=False):
+    """Пересчитывает устаревшие рекомендации, а с ``everything`` — все.
+    Возвращает число пересчитанных пользователей и постов."""
+    stale = claim_stale()
+    users = posts = 0
+    try:
+        if everything or stale[StaleRecommendation.USER]:
+            users = update_users(
+                None if everything else stale[StaleRecommendation.USER])
+        if everything or stale[StaleRecommendation.POST]:
+            posts = update_posts(
+                None if everything else stale[StaleRecommendation.POST])
+    except BaseException:
+        # Возвращаем и то, что успели пересчитать: лишний пересчёт
+        # дешевле потерянного.
+        for kind, object_ids in stale.items():
+            mark_stale(kind, *object_ids)
+        raise
+    return {'users': users, 'posts': posts}
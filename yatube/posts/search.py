@@ -0,0 +1,352 @@
+"""Полнотекстовый поиск по постам.
+
+Основной бэкенд — виртуальная таблица SQLite FTS5 ``posts_post_fts`` с
+ранжированием по BM25. Если FTS5 недоступен (другая СУБД или SQLite без
+расширения), используется инвертированный индекс в таблице
+``SearchTerm`` с ранжированием по TF-IDF. Бэкенд выбирается настройкой
+``SEARCH_BACKEND``: ``'auto'``, ``'fts5'`` или ``'index'``.
+
+Индекс обновляется сигналами при сохранении и удалении поста, а
+целиком пересобирается командой ``rebuild_search_index``. Результаты
+упорядочены по убыванию релевантности, а при равной — по убыванию id,
+и листаются курсором по паре (релевантность, id).
+
+Вес TF-IDF зависит от числа постов и от того, в скольких постах есть
+каждое слово, а они меняются, пока пользователь листает страницы. Чтобы
+курсор не пропускал и не повторял результаты, эти числа считаются на
+первой странице и дальше едут в курсоре. Число постов хранится в кэше:
+его считают при пересборке индекса и поправляют при индексации.
+"""
+import base64
+import binascii
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import (Case, Count, ExpressionWrapper, F,
+                              FloatField, Q, Sum, When)
+from django.db.models.expressions import RawSQL
+
+from .models import Post, SearchTerm
+from .paginators import NEXT, PREVIOUS, CursorPage
+
+FTS_TABLE = 'posts_post_fts'
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 16
+REBUILD_BATCH_SIZE = 500
+DOCUMENTS_KEY = 'search_documents'
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Текст в том виде, в котором он попадает в индекс."""
+    return text.lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    return [word[:MAX_TERM_LENGTH]
+            for word in _WORD.findall(normalize(text))]
+
+
+def query_terms(query):
+    """Слова запроса без повторов; все они должны встретиться в посте."""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+@lru_cache(maxsize=None)
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        options = {row[0] for row in cursor.fetchall()}
+    return 'ENABLE_FTS5' in options
+
+
+class Fts5Backend:
+    name = 'fts5'
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING '
+                f"fts5(text, tokenize='unicode61 remove_diacritics 2')")
+
+    def index(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, text) '
+                f'VALUES (%s, %s)', [post.pk, normalize(post.text)])
+
+    def remove(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [post_id])
+
+    def rebuild(self):
+        self.create()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        count = 0
+        batch = []
+        rows = Post.objects.values_list('pk', 'text').iterator()
+        with connection.cursor() as cursor:
+            for pk, text in rows:
+                batch.append((pk, normalize(text)))
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    self._insert(cursor, batch)
+                    count += len(batch)
+                    batch = []
+            self._insert(cursor, batch)
+        return count + len(batch)
+
+    @staticmethod
+    def _insert(cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE}(rowid, text) VALUES (%s, %s)', rows)
+
+    @staticmethod
+    def _match(terms):
+        return ' '.join(f'"{term}"' for term in terms)
+
+    def filter(self, queryset, terms):
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [self._match(terms)]))
+
+    def statistics(self, terms):
+        # Статистику BM25 считает сам FTS5.
+        return ()
+
+    def hits(self, terms, limit, after=None, reverse=False,
+             statistics=()):
+        # bm25() тем меньше, чем лучше совпадение, поэтому знак меняется.
+        sql = (f'SELECT rowid, -bm25({FTS_TABLE}) AS score '
+               f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s')
+        params = [self._match(terms)]
+        if after is not None:
+            lookup = '>' if reverse else '<'
+            sql += (f' AND (-bm25({FTS_TABLE}) {lookup} %s'
+                    f' OR (-bm25({FTS_TABLE}) = %s AND rowid {lookup} %s))')
+            params += [after[0], after[0], after[1]]
+        direction = 'ASC' if reverse else 'DESC'
+        sql += f' ORDER BY score {direction}, rowid {direction} LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(pk, score) for pk, score in cursor.fetchall()]
+
+
+class InvertedIndexBackend:
+    name = 'index'
+
+    def create(self):
+        pass
+
+    def _terms(self, post):
+        return [SearchTerm(term=term, post_id=post.pk, frequency=frequency)
+                for term, frequency in Counter(tokenize(post.text)).items()]
+
+    def index(self, post):
+        existed, _ = SearchTerm.objects.filter(post_id=post.pk).delete()
+        SearchTerm.objects.bulk_create(self._terms(post))
+        if not existed:
+            self._count(1)
+
+    def remove(self, post_id):
+        removed, _ = SearchTerm.objects.filter(post_id=post_id).delete()
+        if removed:
+            self._count(-1)
+
+    @staticmethod
+    def _count(delta):
+        try:
+            cache.incr(DOCUMENTS_KEY, delta)
+        except ValueError:
+            # Числа нет в кэше: его посчитает следующий поиск.
+            pass
+
+    def rebuild(self):
+        SearchTerm.objects.all().delete()
+        count = 0
+        batch = []
+        for post in Post.objects.only('pk', 'text').iterator():
+            batch.extend(self._terms(post))
+            count += 1
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                SearchTerm.objects.bulk_create(batch)
+                batch = []
+        SearchTerm.objects.bulk_create(batch)
+        cache.set(DOCUMENTS_KEY, count, None)
+        return count
+
+    @staticmethod
+    def documents():
+        """Число постов для IDF; полный COUNT — только если его нет в
+        кэше."""
+        total = cache.get(DOCUMENTS_KEY)
+        if total is None:
+            total = Post.objects.count()
+            cache.add(DOCUMENTS_KEY, total, None)
+        return total
+
+    def _matches(self, terms):
+        return (SearchTerm.objects.filter(term__in=terms)
+                .values('post')
+                .annotate(matched=Count('pk'))
+                .filter(matched=len(terms)))
+
+    def filter(self, queryset, terms):
+        return queryset.filter(pk__in=self._matches(terms).values('post'))
+
+    def statistics(self, terms):
+        """Число постов и число постов с каждым словом запроса; пустой
+        кортеж, если какого-то слова нет нигде."""
+        frequencies = dict(
+            SearchTerm.objects.filter(term__in=terms)
+            .values('term').annotate(documents=Count('pk'))
+            .values_list('term', 'documents'))
+        if len(frequencies) < len(terms):
+            return ()
+        return (self.documents(), *(frequencies[term] for term in terms))
+
+    def hits(self, terms, limit, after=None, reverse=False,
+             statistics=()):
+        """``statistics`` — результат ``statistics(terms)`` с первой
+        страницы, чтобы веса не менялись между страницами."""
+        if not statistics:
+            statistics = self.statistics(terms)
+        if not statistics:
+            return []
+        total, *documents = statistics
+        frequencies = dict(zip(terms, documents))
+        weights = [
+            When(term=term, then=ExpressionWrapper(
+                F('frequency') * math.log(1 + total / frequencies[term]),
+                output_field=FloatField()))
+            for term in terms]
+        rows = self._matches(terms).annotate(score=Sum(
+            Case(*weights, output_field=FloatField())))
+        if after is not None:
+            lookup = 'gt' if reverse else 'lt'
+            rows = rows.filter(
+                Q(**{f'score__{lookup}': after[0]})
+                | Q(score=after[0], **{f'post__{lookup}': after[1]}))
+        # По post_id, а не по post: иначе Django сортирует по Post.Meta.
+        ordering = (('score', 'post_id') if reverse
+                    else ('-score', '-post_id'))
+        return [(row['post'], row['score'])
+                for row in rows.order_by(*ordering)[:limit]]
+
+
+def backend():
+    name = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = 'fts5' if fts5_available() else 'index'
+    return Fts5Backend() if name == 'fts5' else InvertedIndexBackend()
+
+
+class SearchPaginator:
+    """Курсорный паджинатор результатов поиска.
+
+    Курсор хранит направление, релевантность и id поста на границе
+    страницы и статистику бэкенда с первой страницы; интерфейс страницы
+    тот же, что у ``CursorPaginator``.
+    """
+
+    def __init__(self, query, per_page):
+        self.terms = query_terms(query)
+        self.per_page = int(per_page)
+        self.backend = backend()
+        self.statistics = ()
+
+    def encode_cursor(self, direction, post):
+        statistics = ','.join(str(number) for number in self.statistics)
+        raw = f'{direction}|{post.search_score!r}|{post.pk}|{statistics}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+            direction, score, pk, statistics = raw.split('|')
+            position = (float(score), int(pk))
+            statistics = tuple(int(number) for number in
+                               statistics.split(',') if number)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+        if direction not in (NEXT, PREVIOUS) or not math.isfinite(
+                position[0]):
+            return None
+        if statistics and (len(statistics) != len(self.terms) + 1
+                           or min(statistics) < 1):
+            return None
+        return direction, position, statistics
+
+    def _posts(self, hits):
+        posts = Post.objects.for_feed().in_bulk(
+            [pk for pk, _ in hits])
+        result = []
+        for pk, score in hits:
+            # Пост могли удалить между запросами к индексу и к таблице.
+            if pk in posts:
+                posts[pk].search_score = score
+                result.append(posts[pk])
+        return result
+
+    def get_page(self, cursor=None):
+        if not self.terms:
+            return CursorPage([], self, has_next=False, has_previous=False)
+        position = self.decode_cursor(cursor)
+        limit = self.per_page + 1
+        if position is None:
+            self.statistics = self.backend.statistics(self.terms)
+            hits = self.backend.hits(self.terms, limit,
+                                     statistics=self.statistics)
+            return CursorPage(self._posts(hits[:self.per_page]), self,
+                              has_next=len(hits) > self.per_page,
+                              has_previous=False)
+        direction, after, self.statistics = position
+        if direction == NEXT:
+            hits = self.backend.hits(self.terms, limit, after,
+                                     statistics=self.statistics)
+            return CursorPage(self._posts(hits[:self.per_page]), self,
+                              has_next=len(hits) > self.per_page,
+                              has_previous=True, cursor=cursor)
+        hits = self.backend.hits(self.terms, limit, after, reverse=True,
+                                 statistics=self.statistics)
+        page = hits[:self.per_page]
+        page.reverse()
+        return CursorPage(self._posts(page), self,
+                          has_next=True,
+                          has_previous=len(hits) > self.per_page,
+                          cursor=cursor)
+
+
+def index_post(post):
+    backend().index(post)
+
+
+def remove_post(post_id):
+    backend().remove(post_id)
+
+
+def filter_posts(queryset, query):
+    """Посты ``queryset``, в которых есть все слова запроса."""
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+    return backend().filter(queryset, terms)
+
+
+def rebuild():
+    """Пересобирает индекс активного бэкенда; возвращает число постов."""
+    with transaction.atomic():
+        return backend().rebuild()
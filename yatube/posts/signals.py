@@ -0,0 +1,163 @@
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import (conditional, counters, follow_graph, fragments,
+               recommendations, search)
+from .models import (Comment, Follow, Group, Post, RelatedPost,
+                     StaleRecommendation, User, UserStats)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.post_added(instance)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.post_removed(instance)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.comments_added(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.comments_removed(instance.post_id)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.follow_added(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.follow_removed(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_card(sender, instance, **kwargs):
+    fragments.bump('post', instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_cards(sender, instance, **kwargs):
+    fragments.bump('group', instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author_cards(sender, instance, update_fields=None,
+                            **kwargs):
+    # Вход меняет только last_login, которого нет на карточках.
+    if update_fields == frozenset({'last_login'}):
+        return
+    fragments.bump('user', instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_graph(sender, instance, **kwargs):
+    follow_graph.changed(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+# Штампы условных GET (conditional.py).
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, raw=False, **kwargs):
+    # При переносе поста в другую группу меняется и прежняя группа.
+    if instance.pk and not raw:
+        instance._previous_group_id = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group_id', flat=True).first())
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def touch_post_pages(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_group_id', None)
+    conditional.touch(*conditional.post_stamps(instance, previous))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_comment_pages(sender, instance, **kwargs):
+    conditional.touch(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def touch_follow_pages(sender, instance, **kwargs):
+    conditional.touch(f'author:{instance.author_id}',
+                      f'author:{instance.user_id}')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def touch_group_pages(sender, instance, **kwargs):
+    conditional.touch('groups', f'group:{instance.pk}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def touch_author_pages(sender, instance, created=False, update_fields=None,
+                       **kwargs):
+    # Новый пользователь ещё нигде не показан, а вход меняет только
+    # last_login.
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    conditional.touch('authors', f'author:{instance.pk}')
+
+
+# Очередь пересчёта рекомендаций (recommendations.py).
+
+@receiver(post_save, sender=User)
+def queue_new_user(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        recommendations.mark_stale(StaleRecommendation.USER, instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def queue_follower(sender, instance, **kwargs):
+    recommendations.mark_stale(StaleRecommendation.USER, instance.user_id)
+
+
+@receiver(post_save, sender=Post)
+def queue_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        recommendations.mark_stale(StaleRecommendation.POST, instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def touch_related_pages(sender, instance, **kwargs):
+    # Страницы, где пост стоит в похожих, не должны ссылаться на него.
+    conditional.touch(*(
+        f'post:{post_id}' for post_id in
+        RelatedPost.objects.filter(related=instance)
+        .values_list('post_id', flat=True)))
@@ -0,0 +1,39 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def file_hash(content):
+    """SHA-256 содержимого файла, прочитанного по частям."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in iter(lambda: content.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class HashedMediaStorage(FileSystemStorage):
+    """Хранилище, раскладывающее файлы по хэшу содержимого.
+
+    Файл сохраняется как ``<каталог>/<2 символа хэша>/<хэш><расширение>``.
+    Одинаковые загрузки получают одно и то же имя и хранятся один раз,
+    а значит, и миниатюры для них создаются один раз.
+    """
+
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = file_hash(content)
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
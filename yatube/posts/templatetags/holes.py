@@ -0,0 +1,14 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import pagecache
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **params):
+    """Персональная часть страницы из ``posts.pagecache.HOLES``: в скелете
+    кэшируемой страницы на её месте остаётся метка."""
+    return mark_safe(
+        pagecache.render_hole(context.get('request'), name, params))
@@ -0,0 +1,24 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import thumbnails
+from posts.fragments import render_card
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_card(post):
+    """Карточка поста для лент, общая для всех страниц и кэшируемая."""
+    return mark_safe(render_card(post))
+
+
+@register.simple_tag
+def rendition(post, name):
+    """Миниатюры картинки поста для ``<picture>`` (``thumbnails.Rendition``)
+    по имени из ``thumbnails.RENDITIONS`` или None, пока их не создали.
+
+    Сама миниатюра создаётся в фоне после сохранения поста (см.
+    ``posts.thumbnails``), страница её не заказывает.
+    """
+    return thumbnails.get_rendition(post, name)
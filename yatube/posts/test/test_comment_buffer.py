@@ -0,0 +1,142 @@
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from posts import comment_buffer
+from posts.models import Comment, Post, User
+
+
+# У каждого потока свой первый уровень TieredCache, и штампы из потока
+# буфера он увидел бы только через SYNC_INTERVAL. Locmem общий для
+# потоков, как Redis для процессов.
+@override_settings(COMMENT_BUFFER=True, CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CommentBufferTests(TransactionTestCase):
+    """Фоновый поток пишет комментарии своим соединением, поэтому данные
+    теста должны быть закоммичены."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(comment_buffer.shutdown)
+        self.author = User.objects.create_user(username='author')
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def comment(self, text, post_id=None):
+        return Comment(post_id=post_id or self.post.pk,
+                       author=self.author, text=text)
+
+    def test_comment_is_written_in_background(self):
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        self.client.get(url)
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Из буфера'})
+        self.assertRedirects(response, url)
+        # Автор читает основную базу, пока буфер не дописан в реплики.
+        self.assertIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+        comment_buffer.flush()
+        self.assertTrue(Comment.objects.filter(text='Из буфера').exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        # bulk_create не посылает сигналов, штамп страницы меняет буфер.
+        self.assertContains(self.client.get(url), 'Из буфера')
+
+    def test_shutdown_writes_everything_accepted(self):
+        total = settings.COMMENT_BUFFER_BATCH * 2 + 1
+        for i in range(total):
+            comment_buffer.submit(self.comment(f'Комментарий {i}'))
+        comment_buffer.shutdown()
+        self.assertEqual(Comment.objects.count(), total)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, total)
+
+    def test_failed_batch_keeps_other_comments(self):
+        with self.assertLogs('posts.comment_buffer', 'WARNING'):
+            comment_buffer.write([self.comment('Первый'),
+                                  self.comment('Сирота', post_id=10 ** 6),
+                                  self.comment('Второй')])
+        self.assertEqual(
+            sorted(Comment.objects.values_list('text', flat=True)),
+            ['Второй', 'Первый'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+
+    def texts(self):
+        return sorted(Comment.objects.values_list('text', flat=True))
+
+    def test_failure_outside_database_keeps_writer(self):
+        failure = RuntimeError('Кэш недоступен')
+        with mock.patch.object(comment_buffer.conditional, 'touch',
+                               side_effect=failure), \
+                self.assertLogs('posts.comment_buffer', 'ERROR'):
+            comment_buffer.submit(self.comment('Первый'))
+            comment_buffer.flush()
+        # Записанная пачка не пишется второй раз, поток жив.
+        comment_buffer.submit(self.comment('Второй'))
+        comment_buffer.flush()
+        self.assertEqual(self.texts(), ['Второй', 'Первый'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+
+    def test_dead_writer_is_restarted(self):
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        comment_buffer._thread = dead
+        comment_buffer.submit(self.comment('Первый'))
+        comment_buffer.flush()
+        self.assertEqual(self.texts(), ['Первый'])
+
+
+@override_settings(COMMENT_RATE_PER_MINUTE=60, COMMENT_RATE_BURST=3)
+class CommentRateLimitTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+
+    def post_comment(self, user):
+        client = Client()
+        client.force_login(user)
+        return client.post(reverse('posts:add_comment', args=[self.post.pk]),
+                           {'text': 'Комментарий'})
+
+    def test_burst_then_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.post_comment(self.author).status_code,
+                             302)
+        response = self.post_comment(self.author)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Comment.objects.count(), 3)
+        # У другого пользователя своё ведро.
+        self.assertEqual(self.post_comment(self.other).status_code, 302)
+
+    def test_bucket_refills(self):
+        with mock.patch('core.ratelimit.time.time', return_value=1000):
+            for _ in range(4):
+                self.post_comment(self.author)
+        with mock.patch('core.ratelimit.time.time', return_value=1001):
+            self.assertEqual(self.post_comment(self.author).status_code,
+                             302)
+            self.assertEqual(self.post_comment(self.author).status_code,
+                             429)
+
+    def test_invalid_form_takes_no_token(self):
+        client = Client()
+        client.force_login(self.author)
+        url = reverse('posts:add_comment', args=[self.post.pk])
+        for _ in range(5):
+            client.post(url, {'text': ''})
+        self.assertEqual(self.post_comment(self.author).status_code, 302)
@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Comment, Post, User
+from posts.views import COMMENTS_ON_PAGE
+
+
+class CommentThreadTests(TestCase):
+    """Комментарии поста выводятся страницами по курсору на
+    (created, id)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.readers = [User.objects.create_user(username=f'reader{i}')
+                       for i in range(3)]
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+        # Одним bulk_create: у многих комментариев совпадёт created, и
+        # порядок между ними задаёт id.
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.readers[i % 3],
+                    text=f'Комментарий {i}')
+            for i in range(COMMENTS_ON_PAGE * 2 + 5))
+        cls.ordered = list(Comment.objects.filter(post=cls.post)
+                           .order_by('created', 'id')
+                           .values_list('text', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def detail(self, query=''):
+        return reverse('posts:post_detail', args=[self.post.pk]) + query
+
+    def test_detail_shows_first_page(self):
+        response = self.client.get(self.detail())
+        comments = response.context['comments']
+        self.assertEqual([comment.text for comment in comments],
+                         self.ordered[:COMMENTS_ON_PAGE])
+        self.assertTrue(comments.has_next())
+        self.assertContains(response, 'Показать ещё')
+        response = self.client.get(
+            self.detail(f'?cursor={comments.next_cursor}'))
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            self.ordered[COMMENTS_ON_PAGE:2 * COMMENTS_ON_PAGE])
+
+    def test_load_more_walks_every_comment_once(self):
+        url = reverse('posts:post_comments', args=[self.post.pk])
+        texts = []
+        while url:
+            data = self.client.get(url).json()
+            texts.extend(comment['text'] for comment in data['comments'])
+            url = data['next']
+        self.assertEqual(texts, self.ordered)
+        comment = data['comments'][-1]
+        self.assertEqual(comment['author_url'],
+                         reverse('posts:profile', args=[comment['author']]))
+
+    def test_queries_do_not_grow_with_comments(self):
+        other = Post.objects.create(author=self.author, text='Тихий пост')
+        Comment.objects.create(post=other, author=self.readers[0],
+                               text='Единственный')
+        counts = []
+        for post in (other, self.post):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('posts:post_detail', args=[post.pk]))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_first_page_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.detail())
+        sql = next(query['sql'] for query in queries
+                   if 'FROM "posts_comment"' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('comment_post_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_missing_post(self):
+        response = self.client.get(
+            reverse('posts:post_comments', args=[10 ** 6]))
+        self.assertEqual(response.status_code, 404)
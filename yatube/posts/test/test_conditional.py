@@ -0,0 +1,179 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from posts import follow_graph, recommendations
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class ConditionalGetTests(TestCase):
+    """Ленты и страница поста отвечают 304, пока не изменилось то, что на
+    них видно."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        cls.other_group = Group.objects.create(title='Другая', slug='other',
+                                               description='Описание')
+        cls.post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def urls(self):
+        return {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_posts', args=[self.group.slug]),
+            'profile': reverse('posts:profile', args=[self.author.username]),
+            'detail': reverse('posts:post_detail', args=[self.post.pk]),
+        }
+
+    def etag(self, url, client=None):
+        response = (client or self.client).get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def revalidate(self, url, etag, client=None):
+        return (client or self.client).get(
+            url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_unchanged_pages_return_304_without_rendering(self):
+        for name, url in self.urls().items():
+            with self.subTest(page=name):
+                response = self.client.get(url)
+                self.assertIn('private', response['Cache-Control'])
+                self.assertIn('no-cache', response['Cache-Control'])
+                # Время не зависит от пользователя, только ETag.
+                self.assertFalse(response.has_header('Last-Modified'))
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+                self.assertEqual(response.content, b'')
+
+    def test_if_modified_since_alone_gets_full_page(self):
+        url = self.urls()['index']
+        self.etag(url, Client())
+        # После входа браузер мог бы спросить только по дате.
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'reader')
+
+    def test_304_does_not_load_posts(self):
+        anonymous = Client()
+        url = reverse('posts:index')
+        etag = self.etag(url, anonymous)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.revalidate(url, etag, anonymous), 304)
+        self.assertEqual(len(queries), 0)
+
+    def test_new_post_changes_feeds(self):
+        urls = self.urls()
+        etags = {name: self.etag(url) for name, url in urls.items()}
+        Post.objects.create(author=self.author, group=self.group,
+                            text='Новый пост')
+        for name in ('index', 'group', 'profile', 'detail'):
+            with self.subTest(page=name):
+                self.assertEqual(self.revalidate(urls[name], etags[name]),
+                                 200)
+
+    def test_unrelated_post_keeps_group_and_detail(self):
+        other = User.objects.create_user(username='other')
+        urls = self.urls()
+        etags = {name: self.etag(url) for name, url in urls.items()}
+        Post.objects.create(author=other, group=self.other_group,
+                            text='Чужой пост')
+        self.assertEqual(self.revalidate(urls['index'], etags['index']), 200)
+        for name in ('group', 'profile', 'detail'):
+            with self.subTest(page=name):
+                self.assertEqual(self.revalidate(urls[name], etags[name]),
+                                 304)
+
+    def test_moving_post_changes_previous_group(self):
+        url = self.urls()['group']
+        etag = self.etag(url)
+        post = Post.objects.create(author=self.author, group=self.group,
+                                   text='Переезжает')
+        etag = self.etag(url)
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(self.revalidate(url, etag), 200)
+
+    def test_comment_changes_detail(self):
+        url = self.urls()['detail']
+        etag = self.etag(url)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        self.assertEqual(self.revalidate(url, etag), 200)
+
+    def test_follow_button_changes_profile(self):
+        url = self.urls()['profile']
+        etag = self.etag(url)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.revalidate(url, etag), 200)
+
+    def test_viewer_changes_suggestions_on_other_profiles(self):
+        url = self.urls()['profile']
+        other = User.objects.create_user(username='other')
+        etag = self.etag(url)
+        watcher = Client()
+        watcher.force_login(other)
+        watcher_etag = self.etag(url, watcher)
+        # Подписка на третьего автора меняет блок «на кого подписаться»
+        # и кнопки подписки, но не страницу автора.
+        third = User.objects.create_user(username='third')
+        follow_graph.follow(self.reader, third.pk)
+        self.assertEqual(self.revalidate(url, etag), 200)
+        etag = self.etag(url)
+        recommendations.update_users([self.reader.pk])
+        self.assertEqual(self.revalidate(url, etag), 200)
+        self.assertEqual(self.revalidate(url, watcher_etag, watcher), 304)
+
+    def test_etag_depends_on_user(self):
+        url = self.urls()['profile']
+        anonymous = Client()
+        self.assertNotEqual(self.etag(url), self.etag(url, anonymous))
+        # ETag читателя не подходит анониму: у того нет кнопки подписки.
+        self.assertEqual(
+            self.revalidate(url, self.etag(url), anonymous), 200)
+
+    def test_login_does_not_change_pages(self):
+        url = self.urls()['index']
+        etag = self.etag(url)
+        self.author.last_login = timezone.now()
+        self.author.save(update_fields=['last_login'])
+        self.assertEqual(self.revalidate(url, etag), 304)
+        self.author.first_name = 'Имя'
+        self.author.save()
+        self.assertEqual(self.revalidate(url, etag), 200)
+
+    def test_missing_pages_still_404(self):
+        for url in (reverse('posts:group_posts', args=['missing']),
+                    reverse('posts:profile', args=['missing']),
+                    reverse('posts:post_detail', args=[10 ** 6])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertFalse(response.has_header('ETag'))
+
+    def test_fresh_changes_from_replica_get_no_validators(self):
+        url = self.urls()['index']
+        with mock.patch('core.routers.reading_replica', return_value=True):
+            Post.objects.create(author=self.author, text='Только что')
+            # Реплика могла ещё не получить новый пост.
+            self.assertFalse(self.client.get(url).has_header('ETag'))
+            with mock.patch('posts.conditional.time.time',
+                            return_value=10 ** 10):
+                self.assertTrue(self.client.get(url).has_header('ETag'))
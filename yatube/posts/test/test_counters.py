@@ -0,0 +1,131 @@
+from io import StringIO
+
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Comment, Follow, Post, User, UserStats
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def setUp(self):
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_new_user_gets_stats(self):
+        user = User.objects.create_user(username='newbie')
+        stats = self.stats(user)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count, stats.following_count),
+            (0, 0, 0))
+
+    def test_views_update_counters(self):
+        self.author_client.post(reverse('posts:post_create'),
+                                data={'text': 'Пост'})
+        post = Post.objects.get(text='Пост')
+        self.reader_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.id}),
+            data={'text': 'Комментарий'})
+        self.reader_client.post(reverse('posts:profile_follow',
+                                        kwargs={'username': self.author}))
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+
+        self.reader_client.post(reverse('posts:profile_unfollow',
+                                        kwargs={'username': self.author}))
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+    def test_admin_delete_updates_counters(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(post=post, author=self.reader,
+                                         text='Комментарий')
+        request = RequestFactory().post('/admin/')
+        site._registry[Comment].delete_model(request, comment)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        site._registry[Post].delete_queryset(
+            request, Post.objects.filter(pk=post.pk))
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_deleting_author_keeps_counters_consistent(self):
+        author = User.objects.create_user(username='leaving')
+        Post.objects.create(author=author, text='Пост')
+        Follow.objects.create(user=self.reader, author=author)
+        Follow.objects.create(user=author, author=self.author)
+        request = RequestFactory().post('/admin/')
+        site._registry[User].delete_model(request, author)
+        # Каскад удаления не воссоздаёт строку счётчиков удалённого.
+        connection.check_constraints()
+        self.assertFalse(UserStats.objects.filter(user_id=author.pk)
+                         .exists())
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+
+    def test_drifted_counter_does_not_go_negative(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.update(posts_count=0, followers_count=0,
+                                 following_count=0)
+        Follow.objects.all().delete()
+        post.delete()
+        stats = self.stats(self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count), (0, 0))
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader,
+                               text='Комментарий')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.update(comments_count=7)
+        UserStats.objects.update(posts_count=5, followers_count=5,
+                                 following_count=5)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        author_stats = self.stats(self.author)
+        reader_stats = self.stats(self.reader)
+        self.assertEqual(
+            (author_stats.posts_count, author_stats.followers_count,
+             author_stats.following_count),
+            (1, 1, 0))
+        self.assertEqual(
+            (reader_stats.posts_count, reader_stats.followers_count,
+             reader_stats.following_count),
+            (0, 0, 1))
+
+    def test_pages_do_not_aggregate(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        # На профиле остаётся только COUNT(*) паджинатора.
+        expected = {
+            reverse('posts:profile', kwargs={'username': self.author}): 1,
+            reverse('posts:post_detail', kwargs={'post_id': post.id}): 0,
+        }
+        for url, aggregates in expected.items():
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.reader_client.get(url)
+                self.assertContains(response, 'Всего постов')
+                counts = [query['sql'] for query in queries
+                          if 'COUNT(' in query['sql'].upper()]
+                self.assertEqual(len(counts), aggregates)
@@ -0,0 +1,221 @@
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from posts import conditional, follow_graph, timelines
+from posts.management.commands.stress_sqlite import Command as StressCommand
+from posts.models import Follow, Post, TimelineEntry, User
+
+
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.authors = [User.objects.create_user(username=f'author{i}')
+                       for i in range(5)]
+        for author in cls.authors:
+            Post.objects.create(author=author, text=f'Пост {author}')
+        cls.ids = [author.pk for author in cls.authors]
+
+    def setUp(self):
+        cache.clear()
+
+    def stats(self, user):
+        user.stats.refresh_from_db()
+        return user.stats.following_count, user.stats.followers_count
+
+    def test_membership_without_queries_when_cached(self):
+        Follow.objects.create(user=self.reader, author=self.authors[1])
+        self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                  self.ids[1]))
+        with self.assertNumQueries(0):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.ids[1]))
+            self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                       self.ids[2]))
+
+    def test_orm_changes_invalidate_graph(self):
+        self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                   self.ids[0]))
+        follow = Follow.objects.create(user=self.reader,
+                                       author=self.authors[0])
+        self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                  self.ids[0]))
+        self.assertEqual(list(follow_graph.ids('followers', self.ids[0])),
+                         [self.reader.pk])
+        follow.delete()
+        self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                   self.ids[0]))
+        self.assertEqual(len(follow_graph.ids('followers', self.ids[0])), 0)
+
+    def test_follow_many(self):
+        conditional.touch(f'author:{self.ids[0]}')
+        before = conditional.stamps(f'author:{self.ids[0]}')
+        added = follow_graph.follow_many(self.reader,
+                                         self.ids + [self.reader.pk])
+        self.assertEqual(added, sorted(self.ids))
+        # Повторная подписка ничего не меняет.
+        self.assertEqual(follow_graph.follow_many(self.reader, self.ids), [])
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 5)
+        self.assertEqual(list(follow_graph.ids('following', self.reader.pk)),
+                         sorted(self.ids))
+        self.assertEqual(self.stats(self.reader), (5, 0))
+        self.assertEqual(self.stats(self.authors[0]), (0, 1))
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader)
+                         .count(), 5)
+        self.assertNotEqual(
+            conditional.stamps(f'author:{self.ids[0]}'), before)
+
+    def test_unfollow_many(self):
+        follow_graph.follow_many(self.reader, self.ids)
+        self.assertEqual(
+            follow_graph.unfollow_many(self.reader, self.ids[:3]),
+            sorted(self.ids[:3]))
+        self.assertEqual(
+            follow_graph.unfollow_many(self.reader, self.ids[:3]), [])
+        self.assertEqual(list(follow_graph.ids('following', self.reader.pk)),
+                         sorted(self.ids[3:]))
+        self.assertEqual(self.stats(self.reader), (2, 0))
+        self.assertEqual(self.stats(self.authors[0]), (0, 0))
+        self.assertEqual(
+            sorted(TimelineEntry.objects.filter(user=self.reader)
+                   .values_list('author_id', flat=True)),
+            sorted(self.ids[3:]))
+
+    @override_settings(FOLLOW_GRAPH_CACHE_LIMIT=2)
+    def test_large_arrays_fall_back_to_database(self):
+        follow_graph.follow_many(self.reader, self.ids)
+        self.assertIsNone(follow_graph.ids('following', self.reader.pk))
+        with self.assertNumQueries(1):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.ids[4]))
+        # Ленты знаменитостей читаются из базы.
+        timelines.pull_celebrities(self.reader)
+
+    def test_follow_views_use_graph(self):
+        client = Client()
+        client.force_login(self.reader)
+        author = self.authors[0].username
+        profile = reverse('posts:profile', args=[author])
+        self.assertContains(client.get(profile), 'Подписаться')
+        client.get(reverse('posts:profile_follow', args=[author]))
+        self.assertContains(client.get(profile), 'Отписаться')
+        client.get(reverse('posts:profile_unfollow', args=[author]))
+        self.assertContains(client.get(profile), 'Подписаться')
+        self.assertEqual(self.stats(self.reader), (0, 0))
+
+
+# Locmem общий для потоков, как Redis для процессов (см.
+# test_comment_buffer.py).
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConcurrentFollowTests(TransactionTestCase):
+    """Одновременные клики по одной паре читатель — автор. Потоки пишут
+    в копию базы в файле: в общей базе в памяти SQLite не ждёт
+    блокировку, а сразу отвечает ошибкой."""
+
+    THREADS = 8
+    ROUNDS = 10
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='author')
+        Post.objects.create(author=self.author, text='Пост')
+
+    def hammer(self, action):
+        """Все потоки одновременно вызывают ``action``; возвращает
+        результаты и ошибки."""
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def click():
+            try:
+                barrier.wait()
+                results.append(action(self.reader, self.author.pk))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=click)
+                   for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def state(self):
+        self.reader.stats.refresh_from_db()
+        self.author.stats.refresh_from_db()
+        return (Follow.objects.count(),
+                self.reader.stats.following_count,
+                self.author.stats.followers_count,
+                TimelineEntry.objects.filter(user=self.reader).count())
+
+    def test_one_click_wins(self):
+        with StressCommand().database_copy(settings.SQLITE_PRAGMAS):
+            for _ in range(self.ROUNDS):
+                for action, expected in ((follow_graph.follow, 1),
+                                         (follow_graph.unfollow, 0)):
+                    results, errors = self.hammer(action)
+                    self.assertEqual(errors, [])
+                    self.assertEqual(results.count(True), 1)
+                    self.assertEqual(self.state(), (expected,) * 4)
+                    self.assertEqual(
+                        follow_graph.is_following(self.reader.pk,
+                                                  self.author.pk),
+                        bool(expected))
+
+
+class FollowListTests(TestCase):
+    """Подписчики и подписки отдаются страницами по id."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.followers = [User.objects.create_user(username=f'reader{i}')
+                         for i in range(7)]
+        for user in cls.followers:
+            Follow.objects.create(user=user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def walk(self, name, username):
+        url, seen = reverse(name, args=[username]), []
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['users']), 3)
+            seen.extend(user['username'] for user in data['users'])
+            url = data['next']
+        return seen
+
+    @mock.patch('posts.views.FOLLOWS_ON_PAGE', 3)
+    def test_pages_cover_all_edges_once(self):
+        self.assertEqual(self.walk('posts:followers', 'author'),
+                         [user.username for user in self.followers])
+        self.assertEqual(self.walk('posts:following', 'reader0'), ['author'])
+        self.assertEqual(self.walk('posts:following', 'author'), [])
+
+    def test_user_fields(self):
+        data = self.client.get(
+            reverse('posts:following', args=['reader0'])).json()
+        self.assertEqual(data, {
+            'users': [{'id': self.author.pk, 'username': 'author',
+                       'url': reverse('posts:profile', args=['author'])}],
+            'next': None,
+        })
+
+    def test_missing_user(self):
+        response = self.client.get(reverse('posts:followers',
+                                           args=['nobody']))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,111 @@
+import json
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from posts import counters, search, timelines, urls
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+
+
+class LoadToolsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('generate_data', users=20, groups=3, posts=60,
+                     follows=4, comments=2, seed=1, stdout=StringIO())
+
+    def test_generated_counts(self):
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 120)
+        self.assertTrue(Follow.objects.exists())
+
+    def test_derived_data_is_consistent(self):
+        self.assertEqual(counters.reconcile(), {'posts': 0, 'users': 0})
+        expected = TimelineEntry.objects.count()
+        self.assertTrue(expected)
+        self.assertEqual(timelines.rebuild(), expected)
+        post = Post.objects.first()
+        page = search.SearchPaginator(post.text, 10).get_page()
+        self.assertIn(post, list(page))
+
+    def test_pub_dates_are_spread(self):
+        dates = Post.objects.order_by('pub_date').values_list(
+            'pub_date', flat=True)
+        self.assertGreater(dates.last() - dates.first(),
+                           dates[1] - dates[0])
+
+    def test_benchmark_reports_every_url(self):
+        follows = Follow.objects.count()
+        output = StringIO()
+        call_command('benchmark_site', repeat=3, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report['urls']),
+                         {pattern.name for pattern in urls.urlpatterns})
+        for name, result in report['urls'].items():
+            with self.subTest(name=name):
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertGreater(result['queries_max'], 0)
+                self.assertTrue(all(status < 400
+                                    for status in result['status']))
+        self.assertEqual(Follow.objects.count(), follows)
+
+
+class AsgiBenchmarkTests(TransactionTestCase):
+    """Оба режима обслуживают запросы в потоках со своими соединениями,
+    поэтому данные должны быть закоммичены."""
+
+    def test_benchmark_compares_both_modes(self):
+        call_command('generate_data', users=10, groups=2, posts=20,
+                     follows=2, comments=1, seed=1, stdout=StringIO())
+        output = StringIO()
+        call_command('benchmark_asgi', requests=12, concurrency=6,
+                     threads=2, client_delay=1, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(len(report['meta']['urls']),
+                         len(settings.ASGI_READ_VIEWS))
+        for mode in ('wsgi', 'asgi'):
+            with self.subTest(mode=mode):
+                self.assertEqual(report[mode]['status'], [200])
+                self.assertGreater(report[mode]['requests_per_second'], 0)
+        self.assertIn('speedup', report)
+
+
+class SqliteStressTests(TransactionTestCase):
+    def test_stress_compares_profiles(self):
+        call_command('generate_data', users=5, groups=1, posts=10,
+                     follows=1, comments=1, seed=1, stdout=StringIO())
+        comments = Comment.objects.count()
+        output = StringIO()
+        call_command('stress_sqlite', writers=2, readers=1, seconds=0.5,
+                     stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['meta']['profiles']['tuned']
+                         ['journal_mode'], 'wal')
+        for profile in ('baseline', 'tuned'):
+            with self.subTest(profile=profile):
+                self.assertGreater(report[profile]['writes'], 0)
+                self.assertGreater(report[profile]['reads'], 0)
+                self.assertIn('lock_errors', report[profile])
+        # Нагрузка пишет в копию, а не в настоящую базу.
+        self.assertEqual(Comment.objects.count(), comments)
+
+
+class CommentBenchmarkTests(TransactionTestCase):
+    def test_buffer_loses_no_comments(self):
+        call_command('generate_data', users=4, groups=1, posts=5,
+                     follows=1, comments=1, seed=1, stdout=StringIO())
+        comments = Comment.objects.count()
+        output = StringIO()
+        call_command('benchmark_comments', posters=4, seconds=0.5,
+                     stdout=output)
+        report = json.loads(output.getvalue())
+        for mode in ('direct', 'buffered'):
+            with self.subTest(mode=mode):
+                self.assertGreater(report[mode]['stored'], 0)
+                self.assertEqual(report[mode]['lost'], 0)
+                self.assertEqual(report[mode]['errors'], 0)
+        # Комментарии пишутся в копию, а не в настоящую базу.
+        self.assertEqual(Comment.objects.count(), comments)
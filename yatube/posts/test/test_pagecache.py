@@ -0,0 +1,155 @@
+import re
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class PageCacheTests(TestCase):
+    """Ленты и страница поста берутся из кэша, персональные части
+    дорисовываются для каждого пользователя."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text='Пост')
+
+    def setUp(self):
+        cache.clear()
+
+    def client_for(self, user=None, **kwargs):
+        client = Client(**kwargs)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def rendered(self, response):
+        """Рисовалась ли сама страница, а не только её персональные
+        части."""
+        return 'base.html' in [template.name
+                               for template in response.templates]
+
+    def urls(self):
+        return {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_posts', args=[self.group.slug]),
+            'profile': reverse('posts:profile', args=[self.author.username]),
+            'detail': reverse('posts:post_detail', args=[self.post.pk]),
+        }
+
+    def test_cached_pages_are_not_rendered_again(self):
+        for user in (None, self.reader):
+            client = self.client_for(user)
+            for name, url in self.urls().items():
+                with self.subTest(page=name, user=user):
+                    cache.clear()
+                    first = client.get(url)
+                    second = client.get(url)
+                    self.assertEqual(second.status_code, 200)
+                    self.assertFalse(self.rendered(second))
+                    if user is None:
+                        self.assertEqual(second.content, first.content)
+                    else:
+                        # CSRF-токен маскируется при каждом показе.
+                        self.assertContains(second, 'Пользователь: reader')
+
+    def test_anonymous_hit_makes_no_queries(self):
+        client = self.client_for()
+        url = self.urls()['index']
+        client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertContains(response, 'Пост')
+        self.assertEqual(len(queries), 0)
+
+    def test_skeleton_has_no_personal_parts(self):
+        url = self.urls()['detail']
+        self.client_for(self.author).get(url)
+        response = self.client_for().get(url)
+        self.assertFalse(self.rendered(response))
+        self.assertContains(response, 'Войти')
+        for text in ('Пользователь: author', 'Редактировать запись',
+                     'csrfmiddlewaretoken', '<!--hole:'):
+            self.assertNotContains(response, text)
+        response = self.client_for(self.reader).get(url)
+        self.assertContains(response, 'Пользователь: reader')
+        self.assertContains(response, 'Добавить комментарий')
+        self.assertNotContains(response, 'Редактировать запись')
+
+    def test_follow_button_is_personal(self):
+        url = self.urls()['profile']
+        Follow.objects.create(user=self.reader, author=self.author)
+        other = User.objects.create_user(username='other')
+        self.assertContains(self.client_for(self.reader).get(url),
+                            'Отписаться')
+        response = self.client_for(other).get(url)
+        self.assertFalse(self.rendered(response))
+        self.assertContains(response, 'Подписаться')
+        response = self.client_for(self.author).get(url)
+        self.assertNotContains(response, 'Подписаться')
+        self.assertNotContains(response, 'Отписаться')
+
+    def test_comment_form_from_cache_passes_csrf(self):
+        url = self.urls()['detail']
+        self.client_for(self.author).get(url)
+        client = self.client_for(self.reader, enforce_csrf_checks=True)
+        response = client.get(url)
+        self.assertFalse(self.rendered(response))
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"',
+                          response.content.decode())[1]
+        response = client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Из кэша', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Comment.objects.filter(text='Из кэша').exists())
+        self.assertContains(client.get(url), 'Из кэша')
+
+    def test_changes_invalidate_pages(self):
+        client = self.client_for()
+        urls = self.urls()
+        for url in urls.values():
+            client.get(url)
+        Post.objects.create(author=self.author, group=self.group,
+                            text='Новый пост')
+        for name in ('index', 'group', 'profile'):
+            with self.subTest(page=name):
+                self.assertContains(client.get(urls[name]), 'Новый пост')
+        self.group.title = 'Переименованная'
+        self.group.save()
+        self.assertContains(client.get(urls['detail']), 'Переименованная')
+
+    def test_key_depends_only_on_page_params(self):
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Пост {i}') for i in range(12))
+        client = self.client_for()
+        url = self.urls()['index']
+        first = client.get(url, {'page': 1})
+        self.assertNotEqual(first.content,
+                            client.get(url, {'page': 2}).content)
+        response = client.get(url, {'page': 1, 'utm_source': 'mail'})
+        self.assertFalse(self.rendered(response))
+        self.assertEqual(response.content, first.content)
+
+    def test_fresh_pages_from_replica_are_not_stored(self):
+        client = self.client_for()
+        url = self.urls()['index']
+        with mock.patch('core.routers.reading_replica', return_value=True):
+            Post.objects.create(author=self.author, text='Только что')
+            client.get(url)
+            self.assertTrue(self.rendered(client.get(url)))
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_can_be_disabled(self):
+        client = self.client_for()
+        url = self.urls()['index']
+        client.get(url)
+        self.assertTrue(self.rendered(client.get(url)))
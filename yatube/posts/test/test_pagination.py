@@ -1,6 +1,9 @@
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from posts.models import Post, Group, User
+from posts.paginators import CursorPaginator
 from posts.views import POSTS_ON_PAGE
 
 
@@ -51,3 +54,88 @@ class PaginatorViewsTest(TestCase):
                 response = self.authorized_client.get(value)
                 self.assertEqual(
                     len(response.context['page_obj']), expected)
+
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUser')
+        cls.group = Group.objects.create(
+            title='test group',
+            slug='test_slug',
+            description='test description',
+        )
+        cls.amount_posts = 23
+        Post.objects.bulk_create([
+            Post(text=f'#{i} Текст тестового поста #{i}',
+                 author=cls.user, group=cls.group)
+            for i in range(cls.amount_posts)
+        ])
+        cls.ordered = list(Post.objects.order_by('-pub_date', '-id'))
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_pages_cover_feed_without_gaps(self):
+        """Переходы «вперёд» выдают все посты ровно один раз."""
+        paginator = CursorPaginator(Post.objects.all(), POSTS_ON_PAGE)
+        seen = []
+        page = paginator.get_page(None)
+        seen.extend(page)
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            seen.extend(page)
+        self.assertEqual(seen, self.ordered)
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_previous_returns_same_page(self):
+        paginator = CursorPaginator(Post.objects.all(), POSTS_ON_PAGE)
+        first = paginator.get_page(None)
+        second = paginator.get_page(first.next_cursor)
+        back = paginator.get_page(second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_one_range_query_per_page(self):
+        """Страница выбирается одним запросом без COUNT и OFFSET."""
+        paginator = CursorPaginator(Post.objects.all(), POSTS_ON_PAGE)
+        cursor = paginator.get_page(None).next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            list(paginator.get_page(cursor))
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql'].upper()
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = CursorPaginator(Post.objects.all(), POSTS_ON_PAGE)
+        for cursor in ('', 'мусор', 'bm90LWEtY3Vyc29y'):
+            with self.subTest(cursor=cursor):
+                page = paginator.get_page(cursor)
+                self.assertEqual(list(page), self.ordered[:POSTS_ON_PAGE])
+
+    def test_views_use_cursor_when_requested(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url + '?cursor=')
+                page_obj = response.context['page_obj']
+                self.assertTrue(page_obj.is_cursor)
+                response = self.guest_client.get(
+                    url, {'cursor': page_obj.next_cursor})
+                self.assertEqual(list(response.context['page_obj']),
+                                 self.ordered[POSTS_ON_PAGE:
+                                              2 * POSTS_ON_PAGE])
+
+    @override_settings(POSTS_CURSOR_PAGINATION=True)
+    def test_setting_enables_cursor_pagination(self):
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertTrue(response.context['page_obj'].is_cursor)
+        self.assertContains(response, '?cursor=')
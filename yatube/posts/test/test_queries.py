@@ -0,0 +1,74 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+from core import queries
+from posts.models import Comment, Follow, Group, Post, User
+from posts.views import POSTS_ON_PAGE
+
+
+class FeedQueryCountTests(TestCase):
+    """Число запросов страницы не зависит от числа постов на ней, и
+    одинаковые запросы не повторяются для каждого поста (N+1)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text='Первый пост')
+        Comment.objects.create(post=cls.post, author=cls.user,
+                               text='Первый комментарий')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.client.get(reverse('posts:profile_follow',
+                                kwargs={'username': self.author}))
+        cache.clear()
+
+    def count_queries(self, url):
+        # Холодный кэш — худший случай для числа запросов.
+        cache.clear()
+        with queries.capture() as log:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(log.problems(slow=False), [])
+        return len(log)
+
+    def add_posts_and_comments(self):
+        """Каждый новый пост и комментарий — от отдельного автора."""
+        for i in range(POSTS_ON_PAGE):
+            author = User.objects.create_user(username=f'author_{i}')
+            group = Group.objects.create(title=f'Группа {i}',
+                                         slug=f'group_{i}',
+                                         description='Описание')
+            Post.objects.create(author=author, group=group, text=f'Пост {i}')
+            Post.objects.create(author=self.author, group=self.group,
+                                text=f'Пост автора {i}')
+            Comment.objects.create(post=self.post, author=author,
+                                   text=f'Комментарий {i}')
+        Follow.objects.filter(user=self.user).delete()
+        self.client.get(reverse('posts:profile_follow',
+                                kwargs={'username': self.author}))
+
+    def test_views_have_constant_query_count(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:post_comments', kwargs={'post_id': self.post.id}),
+            reverse('posts:search') + '?q=пост',
+        )
+        before = {url: self.count_queries(url) for url in urls}
+        self.add_posts_and_comments()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), before[url])
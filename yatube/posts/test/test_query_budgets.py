@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template import engines
+from django.test import Client, TestCase
+from django.urls import reverse
+from core import queries
+from posts import timelines, urls
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class QueryBudgetTests(TestCase):
+    """Страницы укладываются в бюджет запросов из PERF_QUERY_BUDGETS.
+    Что число запросов не растёт с числом постов (N+1), проверяет
+    test_queries.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.other = User.objects.create_user(username='other')
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        cls.post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text='Пост номер 1')
+        Comment.objects.create(post=cls.post, author=cls.author,
+                               text='Комментарий')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        timelines.rebuild()
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def requests(self):
+        post = self.post.pk
+        return [
+            ('posts:index', 'get', []),
+            ('posts:group_posts', 'get', [self.group.slug]),
+            ('posts:profile', 'get', [self.author.username]),
+            ('posts:post_detail', 'get', [post]),
+            ('posts:post_comments', 'get', [post]),
+            ('posts:followers', 'get', [self.author.username]),
+            ('posts:following', 'get', [self.user.username]),
+            ('posts:post_create', 'get', []),
+            ('posts:post_edit', 'get', [post]),
+            ('posts:add_comment', 'post', [post]),
+            ('posts:follow_index', 'get', []),
+            ('posts:search', 'get', []),
+            ('posts:profile_follow', 'get', [self.other.username]),
+            ('posts:profile_unfollow', 'get', [self.other.username]),
+        ]
+
+    def test_every_page_has_budget(self):
+        budgets = settings.PERF_QUERY_BUDGETS
+        for pattern in urls.urlpatterns:
+            with self.subTest(name=pattern.name):
+                self.assertIn(f'{urls.app_name}:{pattern.name}', budgets)
+
+    def test_pages_stay_within_budget(self):
+        for view, method, args in self.requests():
+            url = reverse(view, args=args)
+            if view == 'posts:search':
+                url += '?q=пост'
+            # Холодный кэш — худший случай для числа запросов.
+            cache.clear()
+            with self.subTest(url=url), queries.capture() as log:
+                response = getattr(self.client, method)(
+                    url, {'text': 'Ещё комментарий'} if method == 'post'
+                    else {})
+                self.assertIn(response.status_code, (200, 302))
+            with self.subTest(url=url):
+                self.assertEqual(
+                    log.problems(view, nplusone=False, slow=False), [])
+
+
+class QueryLogTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [User.objects.create_user(username=f'author_{i}')
+                       for i in range(3)]
+        for author in cls.authors:
+            Post.objects.create(author=author, text='Текст')
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            queries.fingerprint("SELECT * FROM t WHERE id = 1 AND "
+                                "name = 'a''b' AND x IN (1, 2)"),
+            queries.fingerprint("SELECT  * FROM t WHERE id = 25 AND "
+                                "name = 'c' AND x IN (3)"))
+
+    def test_detects_nplusone_from_python(self):
+        with queries.capture() as log:
+            for post in Post.objects.all():
+                post.author.username
+        (key, repeated), = log.repeated()
+        self.assertEqual(len(repeated), len(self.authors))
+        self.assertIn('auth_user', key)
+        self.assertTrue(repeated[0].origin.startswith(
+            'posts/test/test_query_budgets.py:'))
+        problems = log.problems(slow=False)
+        self.assertEqual(len(problems), 1)
+        self.assertTrue(problems[0].startswith('N+1: 3 раз'))
+
+    def test_attributes_query_to_template_line(self):
+        template = engines['django'].get_template(
+            'posts/includes/post_card.html')
+        posts = list(Post.objects.all())
+        with queries.capture() as log:
+            for post in posts:
+                template.render({'post': post})
+        (key, repeated), = log.repeated()
+        self.assertIn('auth_user', key)
+        # {{ post.author.get_full_name }} на пятой строке карточки.
+        self.assertEqual({query.origin for query in repeated},
+                         {'posts/includes/post_card.html:5'})
+
+    def test_budget_exceeded(self):
+        with self.settings(PERF_QUERY_BUDGETS={'posts:index': 1}):
+            with queries.capture() as log:
+                list(User.objects.all())
+                list(Post.objects.all())
+            self.assertEqual(log.problems('posts:index'),
+                             ['posts:index: 2 запросов при бюджете 1'])
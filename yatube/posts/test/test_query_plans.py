@@ -0,0 +1,127 @@
+import re
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts import timelines
+from posts.models import Comment, Follow, Group, Post, User
+from posts.paginators import NEXT, CursorPaginator
+from posts.views import POSTS_ON_PAGE
+
+# Полный проход по таблице — «SCAN t» без индекса. «SCAN t USING INDEX»
+# — это обход индекса в нужном порядке, он допустим.
+FULL_SCAN = re.compile(r'^SCAN \S+( AS \S+)?$')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+
+# Осознанные исключения: (имя страницы, шаг плана).
+ALLOWED = {
+    # Форма поста выводит список всех групп.
+    ('posts:post_create', 'SCAN posts_group'),
+    ('posts:post_edit', 'SCAN posts_group'),
+    # Результаты поиска сортируются по релевантности, которую FTS5
+    # считает только для найденных строк.
+    ('posts:search', 'USE TEMP B-TREE FOR ORDER BY'),
+}
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class QueryPlanTests(TestCase):
+    """Запросы страниц не скатываются в полный проход по таблице
+    или сортировку во временном B-дереве."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(POSTS_ON_PAGE * 2):
+            post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text=f'Пост номер {i}')
+            Comment.objects.create(post=post, author=cls.user,
+                                   text='Комментарий')
+        cls.post = post
+        timelines.rebuild()
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def cursor(self, queryset):
+        """Курсор второй страницы ленты."""
+        paginator = CursorPaginator(queryset, POSTS_ON_PAGE)
+        return '?cursor=' + paginator.encode_cursor(
+            NEXT, queryset[POSTS_ON_PAGE - 1])
+
+    def comment_cursor(self):
+        """Курсор второй страницы комментариев."""
+        comments = Comment.objects.filter(post=self.post)
+        return '?cursor=' + CursorPaginator(
+            comments, 1, ('created', 'id')).encode_cursor(
+                NEXT, comments.order_by('created', 'id').first())
+
+    def pages(self):
+        posts = Post.objects.order_by('-pub_date', '-id')
+        entries = timelines.feed_for(self.user)
+        author, group, post = self.author.username, self.group.slug, self.post
+        return [
+            ('posts:index', [], ''),
+            ('posts:index', [], '?page=2'),
+            ('posts:index', [], self.cursor(posts)),
+            ('posts:group_posts', [group], ''),
+            ('posts:group_posts', [group],
+             self.cursor(posts.filter(group=self.group))),
+            ('posts:profile', [author], ''),
+            ('posts:profile', [author],
+             self.cursor(posts.filter(author=self.author))),
+            ('posts:post_detail', [post.pk], ''),
+            ('posts:post_comments', [post.pk], self.comment_cursor()),
+            ('posts:followers', [author], ''),
+            ('posts:followers', [author], f'?after={self.user.pk}'),
+            ('posts:following', [self.user.username], ''),
+            ('posts:post_edit', [post.pk], ''),
+            ('posts:post_create', [], ''),
+            ('posts:follow_index', [], ''),
+            ('posts:follow_index', [],
+             '?cursor=' + CursorPaginator(
+                 entries, POSTS_ON_PAGE, ('-pub_date', '-post_id'))
+             .encode_cursor(NEXT, entries[POSTS_ON_PAGE - 1])),
+            ('posts:search', [], '?q=пост'),
+            ('posts:profile_follow', [self.other.username], ''),
+            ('posts:profile_unfollow', [self.other.username], ''),
+        ]
+
+    def plans(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertIn(response.status_code, (200, 302))
+        for query in queries:
+            sql = query['sql']
+            if sql.lstrip().upper().startswith('SELECT'):
+                yield sql, explain(sql)
+
+    def test_no_full_scans_or_temp_sorts(self):
+        for name, args, query in self.pages():
+            url = reverse(name, args=args) + query
+            for sql, plan in self.plans(url):
+                for step in plan:
+                    if (name, step) in ALLOWED:
+                        continue
+                    with self.subTest(url=url, step=step, sql=sql):
+                        self.assertIsNone(FULL_SCAN.search(step))
+                        self.assertIsNone(TEMP_SORT.search(step))
@@ -0,0 +1,177 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from posts import follow_graph, recommendations
+from posts.models import (AuthorSuggestion, Follow, Group, Post,
+                          RelatedPost, StaleRecommendation, User)
+
+
+def suggested(user):
+    return [author.username
+            for author in recommendations.suggested_authors(user.pk)]
+
+
+def related(post):
+    return [other.text for other in recommendations.related_posts(post.pk)]
+
+
+@override_settings(RECOMMENDATIONS_SIZE=3)
+class WhoToFollowTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.users = {name: User.objects.create_user(username=name)
+                     for name in ('reader', 'twin', 'a', 'b', 'c', 'd', 'e',
+                                  'star')}
+        for user, authors in (('reader', 'ab'), ('a', 'c'), ('b', 'cd'),
+                              ('twin', 'abe')):
+            for author in authors:
+                Follow.objects.create(user=cls.users[user],
+                                      author=cls.users[author])
+        for name in ('a', 'b', 'c', 'd', 'e', 'twin'):
+            Follow.objects.create(user=cls.users[name],
+                                  author=cls.users['star'])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_friends_of_friends_then_co_followers(self):
+        recommendations.update(everything=True)
+        # star и c — через обе подписки, star ещё и от twin с теми же
+        # подписками; d — через одну, e — только от twin. Свои подписки
+        # и сам читатель не предлагаются.
+        self.assertEqual(suggested(self.users['reader']), ['star', 'c', 'd'])
+        self.assertEqual(suggested(self.users['star']), ['a', 'b', 'c'])
+
+    @override_settings(RECOMMENDATIONS_SIZE=5)
+    def test_free_places_go_to_popular_authors(self):
+        newcomer = User.objects.create_user(username='newcomer')
+        recommendations.update(everything=True)
+        self.assertEqual(suggested(newcomer)[:3], ['star', 'a', 'b'])
+        self.assertNotIn('newcomer', suggested(newcomer))
+
+    def test_update_takes_only_stale_users(self):
+        recommendations.update(everything=True)
+        self.assertFalse(StaleRecommendation.objects.exists())
+        reader, d = self.users['reader'], self.users['d']
+        follow_graph.follow(reader, d.pk)
+        # Изменились подписки reader; его подписчиков нет.
+        self.assertEqual(recommendations.update(),
+                         {'users': 1, 'posts': 0})
+        self.assertNotIn('d', suggested(reader))
+        self.assertEqual(recommendations.update(),
+                         {'users': 0, 'posts': 0})
+        # Подписка через ORM: пересчитываются и подписчики пользователя.
+        Follow.objects.create(user=d, author=self.users['e'])
+        self.assertEqual(recommendations.update(),
+                         {'users': 3, 'posts': 0})
+
+    def test_profile_shows_suggestions(self):
+        recommendations.update(everything=True)
+        client = Client()
+        client.force_login(self.users['reader'])
+        response = client.get(reverse('posts:profile', args=['star']))
+        self.assertContains(response, 'На кого подписаться')
+        self.assertContains(response, reverse('posts:profile', args=['c']))
+        # Автор открытой страницы не советуется.
+        self.assertNotContains(response,
+                               reverse('posts:profile', args=['star']) +
+                               '"')
+        # Подписка убирает автора из списка сразу, до пересчёта.
+        follow_graph.follow(self.users['reader'], self.users['c'].pk)
+        response = client.get(reverse('posts:profile', args=['star']))
+        self.assertNotContains(response,
+                               reverse('posts:profile', args=['c']))
+        self.assertNotContains(Client().get(
+            reverse('posts:profile', args=['star'])), 'На кого подписаться')
+
+
+@override_settings(RECOMMENDATIONS_SIZE=2)
+class RelatedPostsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        texts = [
+            ('Рыбалка на озере и ловля щуки', None),
+            ('Зимняя рыбалка и щуки подо льдом', None),
+            ('Щуки в озере', cls.group),
+            ('Выпечка хлеба дома', cls.group),
+            ('Закваска для хлеба', None),
+            ('Ремонт велосипеда', None),
+            ('Отпуск у моря', cls.group),
+        ]
+        cls.posts = [Post.objects.create(author=cls.author, text=text,
+                                         group=group)
+                     for text, group in texts]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_text_and_group_similarity(self):
+        recommendations.update(everything=True)
+        fishing, winter, lake, bread, starter, bike, holiday = self.posts
+        # Со «Зимней рыбалкой» общих слов больше, чем с «Щуками в озере».
+        self.assertEqual(related(fishing), [winter.text, lake.text])
+        self.assertEqual(related(lake), [fishing.text, holiday.text])
+        self.assertEqual(related(starter), [bread.text])
+        # Без общих слов — свежие посты той же группы.
+        self.assertEqual(related(holiday), [bread.text, lake.text])
+        self.assertEqual(related(bike), [])
+
+    def test_new_post_reaches_its_neighbours(self):
+        recommendations.update(everything=True)
+        bike = self.posts[5]
+        new = Post.objects.create(author=self.author,
+                                  text='Велосипеда ремонт своими руками')
+        self.assertEqual(recommendations.update(),
+                         {'users': 0, 'posts': 2})
+        self.assertEqual(related(bike), [new.text])
+        self.assertEqual(related(new), [bike.text])
+
+    def test_failed_update_keeps_queue(self):
+        recommendations.update(everything=True)
+        new = Post.objects.create(author=self.author, text='Ремонт дома')
+        with mock.patch.object(recommendations, 'update_posts',
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                recommendations.update()
+        self.assertEqual(
+            list(StaleRecommendation.objects.values_list('kind',
+                                                         'object_id')),
+            [(StaleRecommendation.POST, new.pk)])
+        self.assertGreater(recommendations.update()['posts'], 0)
+        self.assertFalse(StaleRecommendation.objects.exists())
+
+    def test_detail_page_lists_related_posts(self):
+        client = Client()
+        fishing, winter = self.posts[:2]
+        url = reverse('posts:post_detail', args=[fishing.pk])
+        self.assertNotContains(client.get(url), 'Похожие записи')
+        recommendations.update(everything=True)
+        response = client.get(url)
+        self.assertContains(response, 'Похожие записи')
+        winter_url = reverse('posts:post_detail', args=[winter.pk])
+        self.assertContains(response, winter_url)
+        # Удалённый пост пропадает и со страниц, где он был похожим.
+        winter.delete()
+        self.assertNotContains(client.get(url), winter_url)
+
+    def test_detail_reads_related_with_one_query(self):
+        recommendations.update(everything=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(related(self.posts[0])), 2)
+
+    def test_command(self):
+        output = StringIO()
+        call_command('update_recommendations', '--all', stdout=output)
+        self.assertIn(f'постов: {len(self.posts)}', output.getvalue())
+        self.assertEqual(RelatedPost.objects.count(), 10)
+        self.assertEqual(AuthorSuggestion.objects.count(), 0)
@@ -0,0 +1,116 @@
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts import search
+from posts.models import Post, User
+
+
+class SearchTestsMixin:
+    """Одинаковые проверки для обоих бэкендов поиска."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.strong = Post.objects.create(
+            author=cls.user, text='Ёжик и ёжик в тумане')
+        cls.weak = Post.objects.create(
+            author=cls.user, text='Ёжик пошёл гулять в лес')
+        cls.other = Post.objects.create(
+            author=cls.user, text='Про котиков')
+
+    def setUp(self):
+        cache.clear()
+
+    def page(self, query, cursor=None, per_page=10):
+        return search.SearchPaginator(query, per_page).get_page(cursor)
+
+    def test_ranked_and_normalized(self):
+        self.assertEqual(list(self.page('ЕЖИК')), [self.strong, self.weak])
+
+    def test_all_terms_required(self):
+        self.assertEqual(list(self.page('ежик лес')), [self.weak])
+        self.assertEqual(list(self.page('ежик котиков')), [])
+        self.assertEqual(list(self.page('  ')), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.create(author=self.user, text='Про котиков')
+        post.text = 'Ёжик и котики'
+        post.save()
+        self.assertIn(post, list(self.page('ежик')))
+        post.delete()
+        self.assertNotIn(post, list(self.page('ежик')))
+
+    def test_cursor_pages_cover_results_once(self):
+        Post.objects.bulk_create([
+            Post(author=self.user, text=f'Ёжик номер {number}')
+            for number in range(5)])
+        search.rebuild()
+        expected = list(self.page('ежик'))
+        seen = []
+        page = self.page('ежик', per_page=2)
+        seen.extend(page)
+        while page.has_next():
+            page = self.page('ежик', page.next_cursor, per_page=2)
+            seen.extend(page)
+        self.assertEqual(seen, expected)
+        back = self.page('ежик', page.previous_cursor, per_page=2)
+        # Семь результатов по два: последняя страница — седьмой.
+        self.assertEqual(list(back), expected[4:6])
+
+    def test_bad_cursor_starts_from_first_page(self):
+        self.assertEqual(list(self.page('ежик', 'мусор')),
+                         [self.strong, self.weak])
+
+    def test_view_keeps_query_in_pagination(self):
+        for number in range(11):
+            Post.objects.create(author=self.user, text=f'Лес {number}')
+        response = Client().get(reverse('posts:search'), {'q': 'лес'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertContains(response, '?q=%D0%BB%D0%B5%D1%81&amp;cursor=')
+
+    def test_admin_search_uses_index(self):
+        request = RequestFactory().get('/admin/posts/post/')
+        request.user = self.admin
+        results, distinct = site._registry[Post].get_search_results(
+            request, Post.objects.all(), 'тумане')
+        self.assertEqual(list(results), [self.strong])
+        self.assertFalse(distinct)
+
+
+@override_settings(SEARCH_BACKEND='fts5')
+class Fts5SearchTests(SearchTestsMixin, TestCase):
+    pass
+
+
+@override_settings(SEARCH_BACKEND='index')
+class InvertedIndexSearchTests(SearchTestsMixin, TestCase):
+    def test_new_posts_do_not_shift_open_cursor(self):
+        Post.objects.bulk_create([
+            Post(author=self.user, text=f'Ёжик номер {number}')
+            for number in range(5)])
+        search.rebuild()
+        expected = list(self.page('ежик'))
+        page = self.page('ежик', per_page=2)
+        seen = list(page)
+        # Новые посты меняют IDF, но не страницы уже начатого поиска.
+        for number in range(20):
+            Post.objects.create(author=self.user, text=f'Котик {number}')
+        while page.has_next():
+            page = self.page('ежик', page.next_cursor, per_page=2)
+            seen.extend(page)
+        self.assertEqual(seen, expected)
+
+    def test_next_page_does_not_count_posts(self):
+        page = self.page('ежик', per_page=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.page('ежик', page.next_cursor, per_page=1)
+        self.assertFalse([query for query in queries
+                          if 'COUNT(*)' in query['sql']])
+        self.assertEqual(search.InvertedIndexBackend.documents(),
+                         Post.objects.count())
@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from posts import thumbnails
+from posts.models import Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        self.post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF,
+                                     content_type='image/gif'),
+        )
+
+    def test_page_shows_placeholder_without_pillow(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+        with mock.patch.object(thumbnails, 'enqueue') as enqueue, \
+                mock.patch('sorl.thumbnail.default.engine.get_image',
+                           side_effect=AssertionError('Pillow в запросе')):
+            for url in urls:
+                with self.subTest(url=url):
+                    response = self.client.get(url)
+                    self.assertContains(response, 'aspect-ratio')
+                    self.assertNotContains(response, '<img class="card-img')
+        # GET ничего не ставит в очередь.
+        enqueue.assert_not_called()
+
+    def test_generated_thumbnail_replaces_placeholder(self):
+        with mock.patch.object(thumbnails, 'enqueue'):
+            self.client.get(reverse('posts:index'))
+        self.assertEqual(thumbnails.generate(self.post.id),
+                         len(thumbnails.unique_renditions()))
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<img class="card-img')
+        self.assertNotContains(response, 'aspect-ratio')
+
+    def test_image_edited_during_generation_is_queued(self):
+        def generating(post_id, name):
+            if name == 'old.gif':
+                # Автор сменил картинку, пока старая ещё обрабатывается.
+                thumbnails.enqueue(post_id, 'new.gif')
+                thumbnails.enqueue(post_id, 'old.gif')
+            return 1
+
+        with mock.patch.object(thumbnails, 'generate',
+                               side_effect=generating) as generate:
+            thumbnails.enqueue(self.post.id, 'old.gif')
+        names = [call.args[1] for call in generate.call_args_list]
+        self.assertEqual(names, ['old.gif', 'new.gif'])
+
+    def test_failed_generation_is_retried(self):
+        create = thumbnails.backend.create_thumbnails
+        errors = iter([OSError('диск')])
+
+        def flaky(*args):
+            for error in errors:
+                raise error
+            return create(*args)
+
+        with mock.patch.object(thumbnails.backend, 'create_thumbnails',
+                               side_effect=flaky), \
+                self.assertLogs('posts.thumbnails', 'ERROR'):
+            thumbnails.enqueue(self.post.id, self.post.image.name)
+        self.assertIsNotNone(
+            thumbnails.get_rendition(self.post, 'feed_card'))
+        self.assertFalse(cache.get(
+            thumbnails._queued_key(self.post.id, self.post.image.name)))
+
+    def test_command_backfills_existing_media(self):
+        call_command('pregenerate_thumbnails', workers=0, stdout=StringIO())
+        for geometry, options in thumbnails.unique_renditions():
+            self.assertIsNotNone(thumbnails.backend.get_existing_thumbnail(
+                self.post.image, geometry, **options))
+
+    def test_identical_uploads_are_stored_once(self):
+        twin = Post.objects.create(
+            author=self.user,
+            text='Тот же файл',
+            image=SimpleUploadedFile('other_name.gif', SMALL_GIF,
+                                     content_type='image/gif'),
+        )
+        self.assertEqual(twin.image.name, self.post.image.name)
+        self.assertEqual(
+            len(os.listdir(os.path.dirname(twin.image.path))), 1)
+
+    def test_renditions_share_thumbnail(self):
+        thumbnails.generate(self.post.id)
+        feed = thumbnails.get_rendition(self.post, 'feed_card')
+        hero = thumbnails.get_rendition(self.post, 'detail_hero')
+        self.assertEqual(feed.srcset, hero.srcset)
+        self.assertNotEqual(feed.sizes, hero.sizes)
+
+    def test_page_has_srcset_for_every_width(self):
+        thumbnails.generate(self.post.id)
+        rendition = thumbnails.get_rendition(self.post, 'feed_card')
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'srcset="{rendition.srcset}"')
+        for width in thumbnails.RENDITIONS['feed_card']['widths']:
+            self.assertIn(f' {width}w', rendition.srcset)
+        self.assertContains(
+            response, f'width="{rendition.width}" '
+                      f'height="{rendition.height}"')
+        if thumbnails.WEBP:
+            self.assertContains(response, 'type="image/webp"')
+        else:
+            self.assertNotContains(response, 'type="image/webp"')
+
+    def test_webp_variants_only_when_supported(self):
+        with mock.patch.object(thumbnails, 'WEBP', False):
+            formats = {format_ for format_, *_ in
+                       thumbnails.variants('feed_card')}
+        self.assertEqual(formats, {None})
+        with mock.patch.object(thumbnails, 'WEBP', True):
+            variants = thumbnails.variants('feed_card')
+        webp = [options for format_, _, _, options in variants
+                if format_ == 'WEBP']
+        self.assertEqual(len(webp), 2)
+        self.assertTrue(all(options['format'] == 'WEBP'
+                            for options in webp))
+
+    def test_source_decoded_once_for_all_widths(self):
+        from sorl.thumbnail import default
+        with mock.patch.object(default.engine, 'get_image',
+                               wraps=default.engine.get_image) as get_image:
+            thumbnails.generate(self.post.id)
+        decoded = [call for call in get_image.call_args_list
+                   if call.args[0].name == self.post.image.name]
+        self.assertEqual(len(decoded), 1)
+
+    def test_fallback_keeps_original_format(self):
+        thumbnails.generate(self.post.id)
+        rendition = thumbnails.get_rendition(self.post, 'feed_card')
+        self.assertTrue(all(thumbnail.name.endswith('.gif')
+                            for _, thumbnail in rendition.candidates[None]))
+
+    def test_rendition_reads_kvstore_once(self):
+        from sorl.thumbnail import default
+        thumbnails.generate(self.post.id)
+        cache.clear()
+        with mock.patch.object(default.kvstore, '_get_raw',
+                               side_effect=AssertionError('по одному')), \
+                self.assertNumQueries(1):
+            self.assertIsNotNone(
+                thumbnails.get_rendition(self.post, 'feed_card'))
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(
+                thumbnails.get_rendition(self.post, 'detail_hero'))
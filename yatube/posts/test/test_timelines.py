@@ -0,0 +1,156 @@
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts import timelines
+from posts.models import Follow, Post, TimelineEntry, User
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(author=cls.author,
+                                           text='Старый пост')
+
+    def setUp(self):
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def follow(self):
+        self.reader_client.get(reverse('posts:profile_follow',
+                                       kwargs={'username': self.author}))
+
+    def feed(self):
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_timeline(self):
+        self.follow()
+        self.assertEqual(self.feed(), [self.old_post])
+
+    def test_new_post_fans_out_to_followers(self):
+        self.follow()
+        self.author_client.post(reverse('posts:post_create'),
+                                data={'text': 'Новый пост'})
+        new_post = Post.objects.get(text='Новый пост')
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post).exists())
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    def test_unfollow_trims_timeline(self):
+        self.follow()
+        self.reader_client.get(reverse('posts:profile_unfollow',
+                                       kwargs={'username': self.author}))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_are_pulled_on_read(self):
+        self.follow()
+        self.author_client.post(reverse('posts:post_create'),
+                                data={'text': 'Пост знаменитости'})
+        new_post = Post.objects.get(text='Пост знаменитости')
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.reader, post=new_post).exists())
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_with_same_date_are_pulled(self):
+        self.follow()
+        first = Post.objects.create(author=self.author, text='Первый')
+        timelines.pull_celebrities(self.reader)
+        second = Post.objects.create(author=self.author, text='Второй')
+        Post.objects.filter(pk=second.pk).update(pub_date=first.pub_date)
+        timelines.pull_celebrities(self.reader)
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.reader)
+                .values_list('post_id', flat=True)),
+            {self.old_post.pk, first.pk, second.pk})
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_repeated_celebrity_feed_read_does_not_write(self):
+        self.follow()
+        Post.objects.create(author=self.author, text='Пост знаменитости')
+        url = reverse('posts:follow_index')
+        self.reader_client.get(url)
+        self.reader_client.cookies.pop(settings.DATABASE_PIN_COOKIE, None)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reader_client.get(url)
+        self.assertEqual(len(response.context['page_obj']), 2)
+        self.assertFalse([query for query in queries.captured_queries
+                          if not query['sql'].startswith('SELECT')])
+        self.assertNotIn(settings.DATABASE_PIN_COOKIE, response.cookies)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_author_crossing_limit_both_ways(self):
+        other = User.objects.create_user(username='other')
+
+        def publish(text):
+            post = Post.objects.create(author=self.author, text=text)
+            timelines.fan_out(post)
+            return post
+
+        def expire():
+            cache.delete(timelines.CELEBRITIES_CACHE_KEY)
+
+        def timeline():
+            return set(TimelineEntry.objects.filter(user=self.reader)
+                       .values_list('post__text', flat=True))
+
+        self.follow()
+        publish('Раскладка')
+        follow = Follow.objects.create(user=other, author=self.author)
+        expire()
+        publish('Подтянут при чтении')
+        self.assertNotIn('Подтянут при чтении', timeline())
+        timelines.pull_celebrities(self.reader)
+        publish('Не подтянут')
+        follow.delete()
+        expire()
+        # Автор вышел из знаменитостей: недостающее дописано сразу.
+        timelines.celebrity_ids()
+        publish('Снова раскладка')
+        self.assertEqual(timeline(), {
+            'Старый пост', 'Раскладка', 'Подтянут при чтении',
+            'Не подтянут', 'Снова раскладка'})
+
+    def test_page_is_single_read(self):
+        self.follow()
+        entries = timelines.feed_for(self.reader)
+        with self.assertNumQueries(1):
+            [entry.post for entry in entries[:10]]
+
+    def test_rebuild_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists())
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.reader)
+                 .values_list('post', flat=True)),
+            [self.old_post.id])
+
+    def test_cursor_pagination_of_follow_feed(self):
+        Post.objects.bulk_create([
+            Post(author=self.author, text=f'Пост #{i}') for i in range(12)
+        ])
+        self.follow()
+        url = reverse('posts:follow_index')
+        first = self.reader_client.get(url + '?cursor=')
+        page_obj = first.context['page_obj']
+        second = self.reader_client.get(url, {'cursor': page_obj.next_cursor})
+        seen = list(page_obj) + list(second.context['page_obj'])
+        self.assertEqual(
+            seen, list(Post.objects.order_by('-pub_date', '-id')))
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from posts import thumbnails, uploads
+from posts.forms import PostForm
+from posts.models import Post, User
+from posts.storage import file_hash
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+# Тег EXIF Orientation: картинку нужно повернуть на 90° по часовой.
+ORIENTATION = 0x0112
+
+
+def make_jpeg(size, orientation=None, color=(200, 100, 50), **options):
+    exif = Image.Exif()
+    exif[ORIENTATION] = orientation or 1
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', exif=exif.tobytes(),
+                                       **options)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0,
+                   POST_IMAGE_MAX_SIZE=64)
+class UploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def create(self, data, name='photo.jpg'):
+        self.client.post(reverse('posts:post_create'), {
+            'text': 'Пост с фото',
+            'image': SimpleUploadedFile(name, data,
+                                        content_type='image/jpeg'),
+        })
+        return Post.objects.latest('id')
+
+    def test_form_stores_header_dimensions(self):
+        post = self.create(make_jpeg((120, 40)))
+        self.assertEqual((post.image_width, post.image_height), (120, 40))
+        self.assertEqual(post.image_hash, '')
+
+    def test_original_is_downscaled_rotated_and_stripped(self):
+        post = self.create(make_jpeg((120, 40), orientation=6))
+        old_path = post.image.path
+        thumbnails.generate(post.id)
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (21, 64))
+        with post.image.open('rb'), Image.open(post.image) as image:
+            self.assertEqual(image.size, (21, 64))
+            self.assertNotIn('exif', image.info)
+            self.assertEqual(post.image_hash, file_hash(post.image))
+        self.assertNotEqual(post.image.path, old_path)
+        self.assertFalse(Post.objects.filter(image_hash='').exists())
+
+    def test_small_clean_original_is_kept(self):
+        buffer = BytesIO()
+        Image.new('RGB', (32, 16)).save(buffer, 'PNG')
+        post = self.create(buffer.getvalue(), name='small.png')
+        name = post.image.name
+        thumbnails.generate(post.id)
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual((post.image_width, post.image_height), (32, 16))
+        self.assertEqual(len(post.image_hash), 64)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels_rejected(self):
+        form = PostForm(
+            data={'text': 'Пост'},
+            files={'image': SimpleUploadedFile('big.jpg',
+                                               make_jpeg((20, 20)))})
+        self.assertFalse(form.is_valid())
+        self.assertTrue(form.has_error('image', 'too_many_pixels'))
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_too_large_file_rejected(self):
+        form = PostForm(
+            data={'text': 'Пост'},
+            files={'image': SimpleUploadedFile('big.jpg',
+                                               make_jpeg((20, 20)))})
+        self.assertFalse(form.is_valid())
+        self.assertTrue(form.has_error('image', 'file_too_large'))
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_too_large_upload_dropped_while_receiving(self):
+        response = self.client.post(reverse('posts:post_create'), {
+            'text': 'Пост с фото',
+            'image': SimpleUploadedFile('big.jpg', make_jpeg((20, 20))),
+        })
+        self.assertTrue(response.context['form'].has_error(
+            'image', 'file_too_large'))
+        self.assertFalse(Post.objects.exists())
+
+    def test_icc_profile_kept(self):
+        profile = b'icc-profile' * 10
+        post = self.create(make_jpeg((120, 40), orientation=6,
+                                     icc_profile=profile))
+        thumbnails.generate(post.id)
+        post.refresh_from_db()
+        with post.image.open('rb'), Image.open(post.image) as image:
+            self.assertEqual(image.size, (21, 64))
+            self.assertEqual(image.info.get('icc_profile'), profile)
+
+    def test_unsavable_format_keeps_original(self):
+        post = self.create(make_jpeg((120, 40), orientation=6))
+        name = post.image.name
+        without_jpeg = {format_: save for format_, save in Image.SAVE.items()
+                        if format_ != 'JPEG'}
+        with mock.patch.dict(Image.SAVE, without_jpeg, clear=True), \
+                self.assertLogs('posts.uploads', 'WARNING'):
+            self.assertFalse(uploads.normalize(post))
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual((post.image_width, post.image_height), (120, 40))
+        # С хэшем оригинал больше не обрабатывается.
+        with post.image.open('rb'):
+            self.assertEqual(post.image_hash, file_hash(post.image))
+
+    def test_missing_file_does_not_break_loading(self):
+        post = self.create(make_jpeg((120, 40)))
+        Post.objects.filter(pk=post.pk).update(image_width=None,
+                                               image_height=None)
+        os.remove(post.image.path)
+        self.assertEqual(Post.objects.get(pk=post.pk).image.name,
+                         post.image.name)
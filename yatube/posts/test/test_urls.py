@@ -24,6 +24,7 @@ class TaskURLTests(TestCase):
             'posts/profile.html': '/profile/Anb/',
             'posts/post_detail.html': '/posts/1/',
             'posts/create_post.html': '/create/',
+            'posts/search.html': '/search/?q=пост',
         }
 
     def setUp(self):
@@ -1,5 +1,6 @@
 from django.test import Client, TestCase
 from django.urls import reverse
+from posts import fragments
 from posts.models import Post, Group, User
 from django.core.cache import cache
 
@@ -65,9 +66,42 @@ class PostViewsTests(TestCase):
         self.assertEqual(post_group_0, 'Тестовая группа')
 
     def test_cash(self):
-        response1 = self.guest_client.get(reverse('posts:index'))
-        first_check = response1.content
-        Post.objects.get(id=1).delete()
-        response2 = self.guest_client.get(reverse('posts:index'))
-        seconf_check = response2.content
-        self.assertEqual(first_check, seconf_check)
+        """Карточка поста берётся из кэша, пока пост не изменился."""
+        self.guest_client.get(reverse('posts:index'))
+        # update() не отправляет сигналов, поэтому карточка остаётся
+        # в кэше со старым текстом.
+        Post.objects.filter(id=self.post.id).update(text='Скрытая правка')
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Тестовый пост')
+        self.assertNotContains(response, 'Скрытая правка')
+
+    def test_cache_invalidated_by_signals(self):
+        """Изменения поста, группы и автора сразу видны в лентах."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+        post = Post.objects.get(id=self.post.id)
+        post.text = 'Исправленный пост'
+        post.save()
+        author = User.objects.get(id=self.user.id)
+        author.first_name = 'Новое'
+        author.last_name = 'Имя'
+        author.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Исправленный пост')
+                self.assertContains(response, 'Новое Имя')
+        post.delete()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Исправленный пост')
+
+    def test_login_keeps_author_cards(self):
+        """Вход автора не сбрасывает кэш его карточек."""
+        before = fragments.versions(('user', self.user.pk))
+        self.guest_client.force_login(self.user)
+        self.assertEqual(fragments.versions(('user', self.user.pk)), before)
@@ -0,0 +1,381 @@
+"""Фоновая генерация миниатюр изображений постов.
+
+Шаблоны постов запрашивают картинки только по именам из ``RENDITIONS``,
+поэтому на каждое изображение приходится минимум вариантов. Каждый
+вариант нарезается в нескольких ширинах для ``srcset`` и, если Pillow
+умеет WebP, ещё и в WebP для ``<picture>``. Страницы никогда не
+запускают Pillow и ничего не ставят в очередь: тег ``{% rendition %}``
+только ищет готовую миниатюру в key-value хранилище sorl-thumbnail и,
+если её ещё нет, показывает заглушку. Миниатюры создаются в пуле
+процессов ``THUMBNAIL_WORKERS`` сразу после сохранения поста (перед
+этим там же обрабатывается оригинал, см. ``posts.uploads``), а для уже
+загруженных картинок — командой ``pregenerate_thumbnails``. Очередь
+помнит пост вместе с файлом картинки, так что правка во время генерации
+не теряется, а упавшая генерация повторяется.
+
+Процессы пула запускаются через ``spawn``: fork из многопоточного
+воркера копирует чужие блокировки (буфер комментариев, кэш) в том
+состоянии, в каком их застал, и дочерний процесс может зависнуть.
+"""
+import atexit
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from PIL import features
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+logger = logging.getLogger(__name__)
+
+# Именованные варианты картинок поста: пропорции, ширины для srcset и
+# атрибут sizes. Варианты с одинаковыми параметрами дают одни и те же
+# файлы миниатюр.
+RENDITIONS = {
+    'feed_card': {
+        'size': (960, 339),
+        'widths': (480, 960),
+        'sizes': '(max-width: 576px) 100vw, 960px',
+        'options': {'crop': 'center', 'upscale': True},
+    },
+    'detail_hero': {
+        'size': (960, 339),
+        'widths': (480, 960),
+        'sizes': '(max-width: 768px) 100vw, 75vw',
+        'options': {'crop': 'center', 'upscale': True},
+    },
+}
+
+# WebP создаётся только если Pillow собран с его поддержкой.
+WEBP = features.check('webp')
+
+QUEUED_KEY = 'thumbnail_queued:%s:%s'
+QUEUED_TIMEOUT = 60
+# Сколько раз пробовать обработать картинку, если что-то сломалось.
+ATTEMPTS = 3
+
+_executor = None
+
+
+class CachedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, умеющий искать миниатюру без её создания."""
+
+    def _options(self, source, options):
+        # Вариант без формата — в формате оригинала (PNG и GIF не теряют
+        # прозрачность), а не в THUMBNAIL_FORMAT, как было бы без
+        # THUMBNAIL_PRESERVE_FORMAT.
+        options.setdefault('format', self._get_format(source))
+        # Остальное — те же умолчания, что в
+        # ThumbnailBackend.get_thumbnail, иначе имя файла не совпадёт.
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def get_existing_thumbnail(self, file_, geometry_string, **options):
+        """Готовая миниатюра или ``None``, если её ещё не создали."""
+        return self.get_existing_thumbnails(
+            file_, [(geometry_string, options)])[0]
+
+    def get_existing_thumbnails(self, file_, specs):
+        """Готовые миниатюры (или ``None``) для ``specs`` — пар
+        (геометрия, опции) — одним чтением key-value хранилища."""
+        source = ImageFile(file_)
+        keys = []
+        for geometry, options in specs:
+            options = self._options(source, dict(options))
+            name = self._get_thumbnail_filename(source, geometry, options)
+            keys.append(add_prefix(ImageFile(name, default.storage).key))
+        values = _get_many_raw(keys)
+        return [deserialize_image_file(values[key]) if values[key] else None
+                for key in keys]
+
+    def create_thumbnails(self, file_, specs, size=None):
+        """Создаёт недостающие миниатюры из ``specs`` — пар (геометрия,
+        опции), декодируя исходную картинку один раз. ``size`` — уже
+        известные размеры картинки.
+
+        Возвращает число созданных миниатюр.
+        """
+        source = ImageFile(file_)
+        pending = []
+        for geometry, options in specs:
+            options = self._options(source, dict(options))
+            name = self._get_thumbnail_filename(source, geometry, options)
+            thumbnail = ImageFile(name, default.storage)
+            if default.kvstore.get(thumbnail) is None:
+                pending.append((geometry, options, thumbnail))
+        if not pending:
+            return 0
+        source_image = default.engine.get_image(source)
+        try:
+            source.set_size(
+                size or default.engine.get_image_size(source_image))
+            image_info = default.engine.get_image_info(source_image)
+            for geometry, options, thumbnail in pending:
+                if not thumbnail.exists():
+                    options['image_info'] = image_info
+                    self._create_thumbnail(source_image, geometry, options,
+                                           thumbnail)
+                    self._create_alternative_resolutions(
+                        source_image, geometry, options, thumbnail.name)
+        finally:
+            default.engine.cleanup(source_image)
+        default.kvstore.get_or_set(source)
+        for _, _, thumbnail in pending:
+            default.kvstore.set(thumbnail, source)
+        return len(pending)
+
+
+def _get_many_raw(keys):
+    """Сырые значения key-value хранилища по ключам; для хранилища
+    sorl по умолчанию (кэш перед таблицей) — один ``get_many`` к кэшу и
+    не больше одного запроса к базе на промахи."""
+    kvstore, empty = default.kvstore, cached_db_kvstore.EMPTY_VALUE
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        return {key: kvstore._get_raw(key) for key in keys}
+    found = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(key__in=missing)
+                      .values_list('key', 'value'))
+        # Отсутствие тоже кэшируется, как в KVStore._get_raw.
+        fetched = {key: stored.get(key, empty) for key in missing}
+        kvstore.cache.set_many(fetched,
+                               sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(fetched)
+    return {key: None if found[key] == empty else found[key]
+            for key in keys}
+
+
+backend = CachedThumbnailBackend()
+
+
+def variants(name):
+    """Миниатюры варианта ``name``: (формат, ширина, геометрия, опции).
+
+    Формат ``None`` означает формат исходной картинки.
+    """
+    spec = RENDITIONS[name]
+    full_width, full_height = spec['size']
+    formats = (None, 'WEBP') if WEBP else (None,)
+    result = []
+    for format_ in formats:
+        for width in spec['widths']:
+            height = round(width * full_height / full_width)
+            options = dict(spec['options'])
+            if format_:
+                options['format'] = format_
+            result.append((format_, width, f'{width}x{height}', options))
+    return result
+
+
+def unique_renditions():
+    """Параметры всех миниатюр без повторов: (геометрия, опции)."""
+    seen = []
+    for name in RENDITIONS:
+        for _, _, geometry, options in variants(name):
+            if (geometry, options) not in seen:
+                seen.append((geometry, options))
+    return seen
+
+
+class Rendition:
+    """Набор готовых миниатюр одного варианта для ``<picture>``."""
+
+    def __init__(self, sizes, candidates):
+        self.sizes = sizes
+        # {формат: [(ширина, миниатюра), ...]} по возрастанию ширины
+        self.candidates = candidates
+        self.fallback = candidates[None][-1][1]
+
+    @property
+    def url(self):
+        return self.fallback.url
+
+    @property
+    def width(self):
+        return self.fallback.width
+
+    @property
+    def height(self):
+        return self.fallback.height
+
+    def _srcset(self, format_):
+        return ', '.join(f'{thumbnail.url} {width}w'
+                         for width, thumbnail
+                         in self.candidates.get(format_, ()))
+
+    @property
+    def srcset(self):
+        return self._srcset(None)
+
+    @property
+    def webp_srcset(self):
+        return self._srcset('WEBP')
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _pool(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        mp_context=multiprocessing.get_context('spawn'))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = _pool(settings.THUMBNAIL_WORKERS)
+        atexit.register(_executor.shutdown, wait=False)
+    return _executor
+
+
+def _drop_executor(executor):
+    # Сломанный пул (процесс упал) больше ничего не примет.
+    global _executor
+    if _executor is executor:
+        _executor = None
+        executor.shutdown(wait=False)
+
+
+def _queued_key(post_id, name):
+    # Ключ по файлу, а не по посту: новая картинка, загруженная, пока
+    # обрабатывается старая, встаёт в очередь сама.
+    digest = hashlib.md5(name.encode()).hexdigest()
+    return QUEUED_KEY % (post_id, digest)
+
+
+def generate(post_id, name=''):
+    """Обрабатывает оригинал картинки, если это ещё не сделано, и создаёт
+    все миниатюры поста; выполняется в процессе пула. ``name`` — файл,
+    с которым пост ставили в очередь.
+
+    Возвращает число созданных миниатюр или ``None``, если что-то не
+    удалось и стоит попробовать ещё раз."""
+    from . import conditional, fragments, uploads
+    from .models import Post
+
+    post = (Post.objects.filter(pk=post_id)
+            .only('image', 'image_width', 'image_height', 'image_hash',
+                  'author', 'group')
+            .first())
+    if post is None or not post.image:
+        return 0
+    created = None
+    if not post.image_hash:
+        try:
+            uploads.normalize(post)
+        except Exception:
+            logger.exception('Не удалось обработать картинку поста %s',
+                             post_id)
+            return None
+    try:
+        size = None
+        if post.image_width and post.image_height:
+            size = (post.image_width, post.image_height)
+        created = backend.create_thumbnails(post.image, unique_renditions(),
+                                            size)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры поста %s', post_id)
+    if created is None:
+        return None
+    # Карточка и страницы с заглушкой больше не нужны.
+    fragments.bump('post', post_id)
+    conditional.touch(*conditional.post_stamps(post))
+    cache.delete(_queued_key(post_id, name))
+    return created
+
+
+def enqueue(post_id, name):
+    """Ставит генерацию миниатюр поста с картинкой ``name`` в очередь
+    пула процессов; неудачная попытка повторяется до ``ATTEMPTS`` раз."""
+    if not cache.add(_queued_key(post_id, name), True, QUEUED_TIMEOUT):
+        return
+    if not settings.THUMBNAIL_WORKERS:
+        for _ in range(ATTEMPTS):
+            if generate(post_id, name) is not None:
+                return
+        _give_up(post_id, name)
+        return
+    _submit(post_id, name, 1)
+
+
+def _submit(post_id, name, attempt):
+    executor = _get_executor()
+    try:
+        future = executor.submit(generate, post_id, name)
+    except (BrokenProcessPool, RuntimeError):
+        _drop_executor(executor)
+        executor = _get_executor()
+        future = executor.submit(generate, post_id, name)
+    future.add_done_callback(
+        lambda done: _finished(done, executor, post_id, name, attempt))
+
+
+def _finished(future, executor, post_id, name, attempt):
+    error = future.exception()
+    if error is None and future.result() is not None:
+        return
+    if isinstance(error, BrokenProcessPool):
+        _drop_executor(executor)
+    if attempt < ATTEMPTS:
+        _submit(post_id, name, attempt + 1)
+    else:
+        _give_up(post_id, name, error)
+
+
+def _give_up(post_id, name, error=None):
+    logger.error('Миниатюры поста %s не созданы за %s попыток', post_id,
+                 ATTEMPTS, exc_info=error)
+    # Следующее сохранение поста снова поставит его в очередь.
+    cache.delete(_queued_key(post_id, name))
+
+
+def enqueue_on_commit(post):
+    if post.image:
+        transaction.on_commit(lambda: enqueue(post.pk, post.image.name))
+
+
+def get_rendition(post, name):
+    """``Rendition`` для шаблона или ``None``, если миниатюр ещё нет.
+    Очередь не трогает: чтение страницы не должно порождать работу."""
+    if not post.image:
+        return None
+    candidates = {}
+    specs = variants(name)
+    found = backend.get_existing_thumbnails(
+        post.image, [(geometry, options) for _, _, geometry, options in specs])
+    for (format_, width, _, _), thumbnail in zip(specs, found):
+        if thumbnail is not None:
+            candidates.setdefault(format_, []).append((width, thumbnail))
+    if None not in candidates:
+        return None
+    return Rendition(RENDITIONS[name]['sizes'], candidates)
+
+
+def pregenerate(post_ids, workers=None):
+    """Создаёт миниатюры для списка постов; возвращает их число."""
+    workers = settings.THUMBNAIL_WORKERS if workers is None else workers
+    if not workers:
+        return sum(generate(post_id) or 0 for post_id in post_ids)
+    with _pool(workers) as executor:
+        return sum(created or 0 for created in
+                   executor.map(generate, post_ids, chunksize=16))
@@ -0,0 +1,169 @@
+"""Материализованные ленты подписок (fan-out on write).
+
+Новый пост сразу раскладывается по лентам подписчиков автора, поэтому
+страница ``follow_index`` читается одним запросом по индексу
+``(user, pub_date, post)``. Посты авторов, у которых подписчиков больше
+``TIMELINE_FANOUT_LIMIT``, при публикации не раскладываются: каждый
+подписчик подтягивает их в свою ленту сам при её чтении (fan-out on read).
+
+Кто знаменитость, решает только ``celebrity_ids()``, и публикация, и
+чтение ленты спрашивают её. Когда автор выходит из этого множества,
+подписчики перестают подтягивать его посты, поэтому при пересчёте
+множества его ещё не подтянутые посты дописываются в их ленты. Прежнее
+множество хранится в кэше без срока; если его вытеснили, такая
+досылка пропускается.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+
+from core import routers
+
+from . import follow_graph
+from .models import Follow, Post, TimelineEntry, UserStats
+
+CELEBRITIES_CACHE_KEY = 'timeline_celebrities'
+CELEBRITIES_SEEN_KEY = 'timeline_celebrities_seen'
+CELEBRITIES_CACHE_TIMEOUT = 60
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+
+
+def backfill_limit():
+    return getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 500)
+
+
+def _entry(user_id, post):
+    return TimelineEntry(user_id=user_id, post_id=post.id,
+                         author_id=post.author_id, pub_date=post.pub_date)
+
+
+def _posts(**filters):
+    return (Post.objects.filter(**filters)
+            .only('id', 'author', 'pub_date')
+            .order_by('-pub_date', '-id'))
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def celebrity_ids():
+    """Авторы, чьи посты не раскладываются по лентам при публикации."""
+    ids = cache.get(CELEBRITIES_CACHE_KEY)
+    if ids is None:
+        ids = set(
+            UserStats.objects.filter(followers_count__gt=fanout_limit())
+            .values_list('user_id', flat=True))
+        left = cache.get(CELEBRITIES_SEEN_KEY, set()) - ids
+        cache.set(CELEBRITIES_CACHE_KEY, ids, CELEBRITIES_CACHE_TIMEOUT)
+        cache.set(CELEBRITIES_SEEN_KEY, ids, None)
+        for author_id in sorted(left):
+            catch_up(author_id)
+    return ids
+
+
+def catch_up(author_id):
+    """Дописывает в ленты подписчиков посты автора, которые они ещё не
+    подтянули, пока он был знаменитостью."""
+    followers = list(Follow.objects.filter(author_id=author_id)
+                     .values_list('user_id', flat=True))
+    if followers:
+        _pull(followers, [author_id])
+
+
+def fan_out(post):
+    """Добавляет новый пост в ленты подписчиков автора."""
+    if post.author_id in celebrity_ids():
+        return
+    followers = Follow.objects.filter(author_id=post.author_id)
+    _insert([_entry(user_id, post)
+             for user_id in followers.values_list('user_id', flat=True)])
+
+
+def backfill(user, author):
+    """Заполняет ленту последними постами автора после подписки."""
+    posts = _posts(author=author)[:backfill_limit()]
+    _insert([_entry(user.id, post) for post in posts])
+
+
+def trim(user, *authors):
+    """Убирает посты авторов из ленты после отписки."""
+    TimelineEntry.objects.filter(user=user, author__in=authors).delete()
+
+
+def pull_celebrities(user):
+    """Подтягивает в ленту новые посты популярных авторов."""
+    celebrities = celebrity_ids()
+    if not celebrities:
+        return
+    following = follow_graph.ids('following', user.pk)
+    if following is None:
+        followed = list(
+            Follow.objects.filter(user=user, author_id__in=celebrities)
+            .values_list('author_id', flat=True))
+    else:
+        followed = [author_id for author_id in celebrities
+                    if follow_graph.contains(following, author_id)]
+    if followed:
+        _pull([user.id], followed)
+
+
+def _pull(user_ids, author_ids):
+    """Добавляет в ленты ``user_ids`` посты ``author_ids``, которых там
+    ещё нет.
+
+    Отметка «подтянуто до» — наибольший id поста автора в ленте: новые
+    посты получают большие id, поэтому посты с одной датой не теряются,
+    а уже подтянутые не читаются снова. Если нового нет, запись в базу
+    не делается.
+    """
+    # Лента пишется в основную базу, и реплика может ещё не знать о
+    # последней подтянутой записи.
+    marks = {
+        (user_id, author_id): last for user_id, author_id, last in
+        TimelineEntry.objects.using(routers.PRIMARY)
+        .filter(user_id__in=user_ids, author_id__in=author_ids)
+        .order_by().values('user_id', 'author_id')
+        .annotate(last=Max('post_id'))
+        .values_list('user_id', 'author_id', 'last')}
+    newer = Q()
+    for author_id in author_ids:
+        start = min(marks.get((user_id, author_id), 0)
+                    for user_id in user_ids)
+        newer |= Q(author_id=author_id, id__gt=start)
+    posts = _posts().filter(newer)[:backfill_limit()]
+    entries = [_entry(user_id, post) for post in posts
+               for user_id in user_ids
+               if post.id > marks.get((user_id, post.author_id), 0)]
+    if entries:
+        _insert(entries)
+
+
+def feed_for(user):
+    """Записи ленты подписок пользователя вместе с постами."""
+    pull_celebrities(user)
+    return (TimelineEntry.objects.filter(user=user)
+            .select_related('post__author', 'post__group'))
+
+
+def rebuild(users=None):
+    """Пересобирает ленты с нуля по текущим подпискам.
+
+    Возвращает число созданных записей.
+    """
+    entries = TimelineEntry.objects.all()
+    follows = Follow.objects.order_by('user_id')
+    if users is not None:
+        entries = entries.filter(user__in=users)
+        follows = follows.filter(user__in=users)
+    entries.delete()
+    created = 0
+    for user_id, author_id in follows.values_list('user_id', 'author_id'):
+        posts = _posts(author_id=author_id)[:backfill_limit()]
+        batch = [_entry(user_id, post) for post in posts]
+        _insert(batch)
+        created += len(batch)
+    return created
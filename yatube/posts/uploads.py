@@ -0,0 +1,173 @@
+"""Обработка картинок, загруженных к постам.
+
+В запросе картинка не декодируется: Django пишет большие загрузки во
+временный файл по частям, ``SizeLimitUploadHandler`` бросает файл, как
+только он перерос ``POST_IMAGE_MAX_UPLOAD_SIZE``, а форма проверяет
+размеры из заголовка. Остальное делается в пуле процессов миниатюр
+(``posts.thumbnails``) перед созданием миниатюр: оригинал поворачивается
+по EXIF, уменьшается до ``POST_IMAGE_MAX_SIZE`` и сохраняется без
+метаданных, но с цветовым профилем ICC. Размеры итогового файла
+хранятся в полях ``width_field``/``height_field`` картинки, а хэш — в
+``image_hash``, так что открывать файл ради них больше не нужно.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete as delete_thumbnails
+
+from .storage import file_hash
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 90
+
+# Форматы, которые Pillow открывает, но пересохраняет в другом: у MPO
+# (снимки камер) первый кадр — обычный JPEG.
+SAVE_AS = {'MPO': 'JPEG'}
+
+# Метаданные, которые не переносятся в обработанный оригинал.
+METADATA_KEYS = ('exif', 'XML:com.adobe.xmp')
+
+
+def max_upload_size():
+    return getattr(settings, 'POST_IMAGE_MAX_UPLOAD_SIZE', 20 * 1024 * 1024)
+
+
+def max_pixels():
+    return getattr(settings, 'POST_IMAGE_MAX_PIXELS', 50 * 1000 * 1000)
+
+
+def max_size():
+    return getattr(settings, 'POST_IMAGE_MAX_SIZE', 2048)
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """Пропускает загружаемый файл, как только он перерос
+    ``POST_IMAGE_MAX_UPLOAD_SIZE``, не дописывая его в память или во
+    временный файл. Имена пропущенных полей — в ``rejected(request)``."""
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_upload_size():
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = set()
+            self.request.rejected_uploads.add(self.field_name)
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def rejected(request):
+    """Поля запроса, файлы которых отброшены как слишком большие."""
+    return getattr(request, 'rejected_uploads', set())
+
+
+def too_large():
+    return ValidationError(
+        'Файл больше %(limit)s.',
+        code='file_too_large',
+        params={'limit': filesizeformat(max_upload_size())})
+
+
+def validate(upload):
+    """Проверяет загруженную картинку, не декодируя её.
+
+    ``upload.image`` — картинка Pillow, открытая полем формы: у неё
+    прочитан только заголовок.
+    """
+    if upload.size > max_upload_size():
+        raise too_large()
+    width, height = upload.image.size
+    if width * height > max_pixels():
+        raise ValidationError(
+            'Картинка %(width)s×%(height)s слишком большая.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height})
+    return width, height
+
+
+def _needs_rewrite(image, limit):
+    if getattr(image, 'is_animated', False):
+        # Анимацию Pillow при пересохранении потеряет.
+        return False
+    return (max(image.size) > limit
+            or any(key in image.info for key in METADATA_KEYS))
+
+
+def _rewrite(image, limit):
+    """Поворачивает, уменьшает и пересохраняет картинку без метаданных."""
+    format_ = SAVE_AS.get(image.format, image.format)
+    icc_profile = image.info.get('icc_profile')
+    # Для JPEG уменьшение начинается ещё при декодировании.
+    image.draft(image.mode, (limit, limit))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((limit, limit), Image.LANCZOS)
+    for key in METADATA_KEYS:
+        image.info.pop(key, None)
+    options = {}
+    if format_ == 'JPEG':
+        options = {'quality': JPEG_QUALITY, 'optimize': True}
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    buffer = BytesIO()
+    image.save(buffer, format_, **options)
+    return image.size, buffer.getvalue()
+
+
+def normalize(post):
+    """Приводит оригинал картинки поста к ограничениям и записывает в пост
+    её размеры и хэш.
+
+    Возвращает True, если оригинал пришлось перезаписать.
+    """
+    from .models import Post
+
+    field_file = post.image
+    limit = max_size()
+    content = None
+    with field_file.open('rb'):
+        with Image.open(field_file) as image:
+            if _needs_rewrite(image, limit):
+                try:
+                    size, content = _rewrite(image, limit)
+                except (KeyError, OSError, ValueError):
+                    # Формат, который Pillow не умеет сохранять: оригинал
+                    # остаётся как есть, и обработка не повторяется.
+                    logger.warning('Оригинал %s не пересохранён',
+                                   field_file.name, exc_info=True)
+            if content is None:
+                size = image.size
+                digest = file_hash(field_file)
+    name = field_file.name
+    if content is not None:
+        upload = ContentFile(content)
+        digest = file_hash(upload)
+        name = field_file.storage.save(
+            field_file.field.generate_filename(
+                post, os.path.basename(field_file.name)),
+            upload)
+    Post.objects.filter(pk=post.pk).update(
+        image=name, image_width=size[0], image_height=size[1],
+        image_hash=digest)
+    post.image_width, post.image_height = size
+    post.image_hash = digest
+    if name == field_file.name:
+        return False
+    post.image = name
+    if not Post.objects.filter(image=field_file.name).exists():
+        # Вместе со старым оригиналом удаляются и его миниатюры.
+        delete_thumbnails(field_file)
+    return True
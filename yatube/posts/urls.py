@@ -10,10 +10,14 @@ urlpatterns = [
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('', views.index, name='index'),
+    path('posts/<int:post_id>/comments/',
+         views.post_comments,
+         name='post_comments'),
     path('posts/<int:post_id>/comment/',
          views.add_comment,
          name='add_comment'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search_posts, name='search'),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
@@ -24,4 +28,10 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('profile/<str:username>/followers/',
+         views.followers,
+         name='followers'),
+    path('profile/<str:username>/following/',
+         views.following,
+         name='following'),
 ]
@@ -1,18 +1,60 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from .models import Post, Group, User, Comment, Follow
+from .models import Comment, Post, Group, User, Follow
 from .forms import PostForm, CommentForm
+from .paginators import CursorPaginator, paginate
 from django.urls import reverse
+from django.db import transaction
+from . import (comment_buffer, follow_graph, recommendations, search,
+               thumbnails, timelines, uploads)
+from .conditional import conditional
+from .pagecache import cached_page
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.http import urlencode
+from core import ratelimit, routers
 
 POSTS_ON_PAGE = 10
+COMMENTS_ON_PAGE = 50
+FOLLOWS_ON_PAGE = 100
 
 
+# Штампы страниц для условных GET (см. conditional.py). None — страницы
+# нет, и представление само ответит 404.
+
+def index_stamps(request):
+    return ['posts', 'groups', 'authors']
+
+
+def group_stamps(request, slug):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('id', flat=True).first())
+    if group_id is None:
+        return None
+    return [f'group:{group_id}', 'authors']
+
+
+def profile_stamps(request, username):
+    author_id = (User.objects.filter(username=username)
+                 .values_list('id', flat=True).first())
+    if author_id is None:
+        return None
+    return [f'author:{author_id}', 'groups', 'authors']
+
+
+def post_stamps(request, post_id):
+    author_id = (Post.objects.filter(pk=post_id)
+                 .values_list('author_id', flat=True).first())
+    if author_id is None:
+        return None
+    return [f'post:{post_id}', f'author:{author_id}', 'groups', 'authors']
+
+
+@conditional(index_stamps)
+@cached_page
 def index(request):
-    posts = Post.objects.all()
-    paginator = Paginator(posts, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = Post.objects.for_feed()
+    page_obj = paginate(request, posts, POSTS_ON_PAGE)
     title = 'Последние обновления на сайте'
     context = {
         'title': title,
@@ -21,13 +63,12 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@conditional(group_stamps)
+@cached_page
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = Post.objects.select_related('group')\
-        .filter(group=group)
-    paginator = Paginator(posts, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = Post.objects.for_feed().filter(group=group)
+    page_obj = paginate(request, posts, POSTS_ON_PAGE)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -35,46 +76,124 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional(profile_stamps)
+@cached_page
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    paginator = Paginator(posts, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    following = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user,
-        author=author).exists()
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    posts = author.posts.for_feed()
+    page_obj = paginate(request, posts, POSTS_ON_PAGE)
     context = {
         'author': author,
         'posts': posts,
         'page_obj': page_obj,
-        'following': following,
     }
     return render(request, 'posts/profile.html', context)
 
 
+def comment_page(request, post_id):
+    """Страница комментариев поста по курсору из параметра ``cursor``,
+    от старых к новым."""
+    comments = Comment.objects.filter(post_id=post_id).select_related(
+        'author')
+    paginator = CursorPaginator(comments, COMMENTS_ON_PAGE,
+                                ordering=('created', 'id'))
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+@conditional(post_stamps)
+@cached_page
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'), pk=post_id)
     author = post.author
-    form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post=post)
+    comments = comment_page(request, post_id)
     context = {
         'post': post,
         'author': author,
-        'form': form,
-        'comments': comments
+        'comments': comments,
+        'related': recommendations.related_posts(post.pk),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@conditional(post_stamps)
+def post_comments(request, post_id):
+    """Следующие комментарии поста в JSON для кнопки «Показать ещё»."""
+    get_object_or_404(Post.objects.only('id'), pk=post_id)
+    comments = comment_page(request, post_id)
+    next_url = None
+    if comments.has_next():
+        next_url = '%s?%s' % (
+            reverse('posts:post_comments', args=[post_id]),
+            urlencode({'cursor': comments.next_cursor}))
+    return JsonResponse({
+        'comments': [{
+            'id': comment.pk,
+            'author': comment.author.username,
+            'author_url': reverse('posts:profile',
+                                  args=[comment.author.username]),
+            'text': comment.text,
+            'created': comment.created.isoformat(),
+        } for comment in comments],
+        'next': next_url,
+    })
+
+
+def follow_list(request, username, kind):
+    """Подписчики или подписки пользователя в JSON, по FOLLOWS_ON_PAGE
+    по порядку id, начиная после ``?after=``. Страница читается из
+    индекса подписок, без объектов модели."""
+    user_id = get_object_or_404(
+        User.objects.values_list('id', flat=True), username=username)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    field, other = follow_graph.EDGES[kind]
+    rows = list(
+        Follow.objects.filter(**{field: user_id, f'{other}__gt': after})
+        .order_by(other)
+        .values_list(other, other.replace('_id', '__username'))
+        [:FOLLOWS_ON_PAGE + 1])
+    next_url = None
+    if len(rows) > FOLLOWS_ON_PAGE:
+        rows = rows[:FOLLOWS_ON_PAGE]
+        next_url = '%s?%s' % (
+            reverse(f'posts:{kind}', args=[username]),
+            urlencode({'after': rows[-1][0]}))
+    return JsonResponse({
+        'users': [{
+            'id': pk,
+            'username': name,
+            'url': reverse('posts:profile', args=[name]),
+        } for pk, name in rows],
+        'next': next_url,
+    })
+
+
+@conditional(profile_stamps)
+def followers(request, username):
+    return follow_list(request, username, 'followers')
+
+
+@conditional(profile_stamps)
+def following(request, username):
+    return follow_list(request, username, 'following')
+
+
 @login_required
 def post_create(request):
     template = 'posts/create_post.html'
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None,
+                    rejected_uploads=uploads.rejected(request))
     if form.is_valid() and request.user.is_authenticated:
         post = form.save(commit=False)
         post.author = request.user
-        form.save()
+        with transaction.atomic():
+            form.save()
+            timelines.fan_out(post)
+            thumbnails.enqueue_on_commit(post)
         return redirect('posts:profile', request.user)
     return render(request, template, {'form': form})
 
@@ -83,9 +202,12 @@ def post_create(request):
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = PostForm(request.POST or None, files=request.FILES or None,
+                    rejected_uploads=uploads.rejected(request),
                     instance=post)
     if form.is_valid() and post.author == request.user:
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.enqueue_on_commit(post)
         return redirect('posts:post_detail', post_id=post_id)
     else:
         context = {
@@ -96,25 +218,46 @@ def post_edit(request, post_id):
         return render(request, 'posts/create_post.html', context)
 
 
+def comment_rate(user):
+    """Ведро токенов пользователя для ``core.ratelimit``."""
+    return (f'comment:{user.pk}', settings.COMMENT_RATE_PER_MINUTE / 60,
+            settings.COMMENT_RATE_BURST)
+
+
 @login_required
 def add_comment(request, post_id):
     # Получите пост и сохраните его в переменную post.
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
+        if (settings.COMMENT_RATE_PER_MINUTE
+                and not ratelimit.allow(*comment_rate(request.user))):
+            response = HttpResponse(
+                'Слишком много комментариев, попробуйте позже.',
+                content_type='text/plain; charset=utf-8', status=429)
+            response['Retry-After'] = ratelimit.retry_after(
+                *comment_rate(request.user))
+            return response
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        if settings.COMMENT_BUFFER:
+            comment_buffer.submit(comment)
+            # Автор должен увидеть свой комментарий, а не отстающую
+            # реплику.
+            routers.mark_written()
+        else:
+            with transaction.atomic():
+                comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    entries = timelines.feed_for(request.user)
+    page_obj = paginate(request, entries, POSTS_ON_PAGE,
+                        ordering=('-pub_date', '-post_id'))
+    page_obj.object_list = [entry.post for entry in page_obj]
     title = 'Последние обновления на сайте'
     context = {
         'title': title,
@@ -127,11 +270,8 @@ def follow_index(request):
 def profile_follow(request, username):
     # Подписаться на автора
     author = get_object_or_404(User, username=username)
-    if request.user == author:
-        return redirect(reverse('posts:follow_index'))
-    if Follow.objects.filter(user=request.user, author=author).exists():
-        return redirect(reverse('posts:follow_index'))
-    Follow.objects.create(user=request.user, author=author)
+    if request.user != author:
+        follow_graph.follow(request.user, author.pk)
     return redirect(reverse('posts:follow_index'))
 
 
@@ -139,7 +279,19 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     # Дизлайк, отписка
     author = get_object_or_404(User, username=username)
-    if request.user == author:
-        return redirect(reverse('posts:follow_index'))
-    Follow.objects.filter(user=request.user, author=author).delete()
+    if request.user != author:
+        follow_graph.unfollow(request.user, author.pk)
     return redirect(reverse('posts:follow_index'))
+
+
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    paginator = search.SearchPaginator(query, POSTS_ON_PAGE)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        # Ссылки паджинатора должны сохранять запрос.
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
@@ -26,6 +26,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,7 +43,9 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, учитывающий время отрисовки в core.perf
+        'BACKEND': 'core.template_backend.DjangoTemplates',
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -58,12 +62,61 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# Сколько секунд держать соединение с базой между запросами; 0 —
+# закрывать после каждого запроса, None — не закрывать
+CONN_MAX_AGE = int(os.environ.get('YATUBE_CONN_MAX_AGE', 60))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+    }
+}
+
+# Реплики для чтения (core.routers): YATUBE_DB_REPLICAS=2 добавляет базы
+# replica_1 и replica_2 в файлах db.replica_N.sqlite3; локально их
+# заполняет команда sync_replicas
+DATABASE_REPLICAS = []
+for number in range(1, int(os.environ.get('YATUBE_DB_REPLICAS', 0)) + 1):
+    DATABASE_REPLICAS.append(f'replica_{number}')
+    DATABASES[f'replica_{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db.replica_{number}.sqlite3'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
     }
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# PRAGMA для каждого нового соединения SQLite (core.sqlite); у отдельной
+# базы их можно переопределить ключом PRAGMAS
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 10000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
 }
+# Страницы, которые читают с реплик
+DATABASE_REPLICA_VIEWS = (
+    'posts:index',
+    'posts:group_posts',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:post_comments',
+    'posts:followers',
+    'posts:following',
+    'posts:follow_index',
+)
+# Приложения, которые всегда читаются из основной базы
+DATABASE_PRIMARY_APPS = ('sessions',)
+# Служебные записи, после которых клиент не закрепляется за основной
+# базой (запись в приложения выше тоже не закрепляет)
+DATABASE_UNPINNED_MODELS = ('posts.timelineentry',)
+# После записи клиент DATABASE_PIN_SECONDS секунд читает только из
+# основной базы, чтобы видеть свои изменения несмотря на отставание реплик
+DATABASE_PIN_COOKIE = 'db_primary'
+DATABASE_PIN_SECONDS = 5
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -104,8 +157,155 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Двухуровневый кэш: LRU в памяти процесса перед общим для всех воркеров
+# кэшем 'shared'. По умолчанию общий уровень файловый; для Redis и т. п.
+# достаточно задать переменные окружения с бэкендом и адресом.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+            # Часто меняющиеся ключи без первого уровня и журнала
+            'SHARED_ONLY': ['ratelimit'],
+        },
+    },
+    # Файловый кэш по умолчанию — только для разработки: его incr не
+    # атомарный (core.W001). При переполнении он выбрасывает случайные
+    # записи, поэтому предел задан с запасом на штампы и журнал
+    'shared': {
+        'BACKEND': os.environ.get(
+            'YATUBE_SHARED_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get(
+            'YATUBE_SHARED_CACHE_LOCATION',
+            os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
 }
+
+# Тесты работают с кэшем в памяти, а не с общим кэшем выше
+TEST_RUNNER = 'core.runner.TestRunner'
+
+# Курсорная паджинация лент вместо COUNT(*) и OFFSET
+POSTS_CURSOR_PAGINATION = False
+
+# Полнотекстовый поиск: 'fts5' — SQLite FTS5, 'index' — инвертированный
+# индекс в обычной таблице, 'auto' — FTS5, если он доступен
+SEARCH_BACKEND = 'auto'
+
+# Материализованные ленты подписок: посты авторов, у которых подписчиков
+# больше TIMELINE_FANOUT_LIMIT, подтягиваются в ленту при её чтении
+TIMELINE_FANOUT_LIMIT = 1000
+# Сколько последних постов автора попадает в ленту при подписке
+TIMELINE_BACKFILL_LIMIT = 500
+
+# Срок жизни карточки поста в кэше; карточки сбрасываются сигналами
+# при изменении поста, группы или автора
+POST_CARD_CACHE_TIMEOUT = 60 * 60
+
+# Число процессов, создающих миниатюры в фоне; 0 — создавать их сразу
+# в текущем процессе (удобно для разработки и тестов)
+THUMBNAIL_WORKERS = 2
+
+# Загрузки больше этого размера пишутся во временный файл по частям,
+# а не держатся целиком в памяти
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+# Первый обработчик отбрасывает файл, как только он перерос
+# POST_IMAGE_MAX_UPLOAD_SIZE, до записи в память или на диск
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Ограничения на картинки постов: размер файла проверяется при приёме,
+# число пикселей по заголовку — в форме, а оригинал затем уменьшается в
+# фоне до POST_IMAGE_MAX_SIZE по большей стороне
+POST_IMAGE_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+POST_IMAGE_MAX_SIZE = 2048
+
+# Метрики запросов (core.perf): скользящие гистограммы за последние
+# PERF_WINDOWS окон по PERF_WINDOW_SECONDS секунд и заголовок Server-Timing
+PERF_WINDOW_SECONDS = 60
+PERF_WINDOWS = 15
+PERF_SERVER_TIMING = True
+
+# Разбор SQL в разработке (core.queries): N+1 — повтор одного и того же
+# по структуре запроса PERF_NPLUSONE_THRESHOLD раз, медленные запросы и
+# превышение бюджета страницы пишутся в лог core.queries; None — включён,
+# если включён DEBUG
+PERF_QUERY_INSPECTION = None
+PERF_NPLUSONE_THRESHOLD = 3
+PERF_SLOW_QUERY_MS = 100
+# Бюджеты числа SQL-запросов страниц при холодном кэше; проверяются
+# тестами posts/test/test_query_budgets.py
+PERF_QUERY_BUDGETS = {
+    'posts:index': 4,
+    'posts:group_posts': 6,
+    'posts:profile': 8,
+    'posts:post_detail': 6,
+    'posts:post_comments': 5,
+    'posts:followers': 5,
+    'posts:following': 5,
+    'posts:post_create': 3,
+    'posts:post_edit': 4,
+    'posts:add_comment': 7,
+    'posts:follow_index': 5,
+    'posts:search': 4,
+    'posts:profile_follow': 10,
+    'posts:profile_unfollow': 10,
+}
+
+# ASGI (yatube/asgi.py, core.asgi): представления выполняются в пулах
+# потоков, а цикл событий общается с медленными клиентами. Страницы для
+# чтения из ASGI_READ_VIEWS получают отдельный пул; размер пула — это
+# и число соединений с базой
+ASGI_READ_VIEWS = (
+    'posts:index',
+    'posts:group_posts',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:post_comments',
+    'posts:followers',
+    'posts:following',
+)
+ASGI_READ_THREADS = 8
+ASGI_THREADS = 4
+
+# Условные GET лент и страницы поста (posts/conditional.py): увеличьте
+# после изменения шаблонов, чтобы старые ETag и сохранённые страницы
+# перестали совпадать
+CONDITIONAL_GET_VERSION = 1
+
+# Сколько секунд хранить страницы лент в кэше (posts/pagecache.py);
+# изменения сбрасывают их раньше. 0 — не кэшировать страницы
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Комментарии через буфер записи (posts/comment_buffer.py): запрос только
+# ставит комментарий в очередь, фоновый поток пишет их пачками до
+# COMMENT_BUFFER_BATCH штук
+COMMENT_BUFFER = False
+COMMENT_BUFFER_BATCH = 100
+
+# Не больше COMMENT_RATE_BURST комментариев подряд от одного
+# пользователя, дальше — COMMENT_RATE_PER_MINUTE в минуту; 0 — без
+# ограничения
+COMMENT_RATE_PER_MINUTE = 20
+COMMENT_RATE_BURST = 10
+
+# Граф подписок в кэше (posts/follow_graph.py): массивы id длиннее
+# FOLLOW_GRAPH_CACHE_LIMIT не кэшируются, проверки по ним идут в базу
+FOLLOW_GRAPH_CACHE_LIMIT = 100000
+FOLLOW_GRAPH_CACHE_TIMEOUT = 60 * 60
+
+# Рекомендации (posts/recommendations.py) пересчитывает команда
+# update_recommendations: сколько авторов и похожих постов хранить и
+# авторы с каким числом подписчиков ещё учитываются в сходстве читателей
+RECOMMENDATIONS_SIZE = 5
+RECOMMENDATIONS_MAX_FAN = 1000
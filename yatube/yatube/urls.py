@@ -13,6 +13,7 @@ urlpatterns = [
     # Django пойдёт искать его в django.contrib.auth
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
+    path('core/', include('core.urls', namespace='core')),
 ]
 
 handler404 = 'core.views.page_not_found'